@@ -0,0 +1,71 @@
+"""
+Time to pick a batch for a line, as the number of batches of a product
+grows: the generator over sorted(batches) that Product.allocate used to run,
+against each vectorized policy. Most batches are nearly used up, so the
+first batch that fits is far down the list, which is the case that matters.
+
+    PYTHONPATH=src python benchmarks/allocation_policies.py --batches 100 1000 10000 --lines 500
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from allocation.domain import policies
+from allocation.domain.model import Batch, OrderLine, Product
+
+SKU = "BENCH-SKU"
+
+
+def make_batches(count: int, seed: int):
+    rng = random.Random(seed)
+    start = date.today()
+    # one batch in ten still has real stock left
+    quantities = [
+        rng.randint(50, 200) if rng.random() < 0.1 else rng.randint(0, 5)
+        for _ in range(count)
+    ]
+    return [Batch(f"b{i}", SKU, qty, start + timedelta(i)) for i, qty in enumerate(quantities)]
+
+
+def make_lines(count: int, seed: int):
+    rng = random.Random(seed)
+    return [OrderLine(f"o{i}", SKU, rng.randint(10, 40)) for i in range(count)]
+
+
+def time_generator(batches, lines) -> float:
+    started = time.perf_counter()
+    for line in lines:
+        batch = next((b for b in sorted(batches) if b.can_allocate(line)), None)
+        if batch is not None:
+            batch.allocate(line)
+    return time.perf_counter() - started
+
+
+def time_policy(policy, batches, lines) -> float:
+    product = Product(SKU, batches=batches, policy=policy)
+    started = time.perf_counter()
+    for line in lines:
+        product.allocate(line)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark allocation policies")
+    parser.add_argument("--batches", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'batches':>8}  {'policy':<16}{'us per line':>14}{'speedup':>10}")
+    for count in args.batches:
+        lines = make_lines(args.lines, args.seed)
+        baseline = time_generator(make_batches(count, args.seed), lines)
+        print(f"{count:>8}  {'sorted generator':<16}{baseline / len(lines) * 1e6:>14.1f}{1:>10.1f}")
+        for name, policy in policies.POLICIES.items():
+            elapsed = time_policy(policy(), make_batches(count, args.seed), lines)
+            print(f"{count:>8}  {name:<16}{elapsed / len(lines) * 1e6:>14.1f}{baseline / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Allocation throughput and abort rate of each concurrency strategy when
+every writer competes for the same sku. Needs the docker-compose postgres:
+
+    PYTHONPATH=src python benchmarks/concurrency_strategies.py --writers 8 --allocations 50
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+from allocation.adapters import concurrency, orm
+from allocation.domain import commands
+from allocation.service_layer import handlers, unit_of_work
+
+
+def setup_sku(session_factory, writers: int, allocations: int) -> str:
+    sku = f"bench-{uuid.uuid4().hex[:6]}"
+    with session_factory() as session:
+        session.execute(
+            text("INSERT INTO products (sku, version_number) VALUES (:sku, 1)"), dict(sku=sku)
+        )
+        session.execute(
+            text(
+                "INSERT INTO batches (reference, sku, _purchased_quantity, eta)"
+                " VALUES (:ref, :sku, :qty, NULL)"
+            ),
+            dict(ref=f"{sku}-batch", sku=sku, qty=writers * allocations),
+        )
+        session.commit()
+    return sku
+
+
+def run(strategy: str, writers: int, allocations: int, attempts: int) -> dict:
+    session_factory = unit_of_work.DEFAULT_SESSION_FACTORY
+    sku = setup_sku(session_factory, writers, allocations)
+    lock = threading.Lock()
+    totals = {"committed": 0, "aborted": 0, "failed": 0}
+
+    def writer(number: int):
+        uow = unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory,
+            concurrency=concurrency.STRATEGIES[strategy](),
+            conflict_attempts=attempts,
+        )
+        for i in range(allocations):
+            command = commands.Allocate(f"order-{number}-{i}", sku, 1)
+            tries = 0
+            try:
+                for attempt in uow.retrying():
+                    with attempt:
+                        tries += 1
+                        handlers.allocate(command, uow)
+                outcome = "committed"
+            except Exception:
+                outcome = "failed"
+            with lock:
+                totals[outcome] += 1
+                totals["aborted"] += tries - 1 if outcome == "committed" else tries
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    tried = totals["committed"] + totals["aborted"]
+    return dict(
+        strategy=strategy,
+        throughput=totals["committed"] / elapsed,
+        abort_rate=totals["aborted"] / tried if tried else 0.0,
+        failed=totals["failed"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the concurrency strategies under contention")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--allocations", type=int, default=50)
+    parser.add_argument("--attempts", type=int, default=10)
+    parser.add_argument("--strategy", choices=sorted(concurrency.STRATEGIES), action="append")
+    args = parser.parse_args()
+
+    orm.metadata.create_all(unit_of_work.DEFAULT_SESSION_FACTORY.engine)
+    orm.start_mappers()
+    print(f"{'strategy':<20}{'allocations/s':>15}{'abort rate':>12}{'failed':>8}")
+    for strategy in args.strategy or sorted(concurrency.STRATEGIES):
+        result = run(strategy, args.writers, args.allocations, args.attempts)
+        print(
+            f"{result['strategy']:<20}{result['throughput']:>15.1f}"
+            f"{result['abort_rate']:>12.1%}{result['failed']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
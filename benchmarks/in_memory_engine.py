@@ -0,0 +1,98 @@
+"""
+Commands per second of the in-memory engine, with every commit fsynced
+through the write-ahead log, and how long recovery takes from the log alone
+against a snapshot plus a short log.
+
+    PYTHONPATH=src python benchmarks/in_memory_engine.py --threads 1 8 --commands 2000 --sync-window-ms 0 1
+"""
+import argparse
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+from allocation import metrics
+from allocation.adapters.in_memory_store import InMemoryStore
+from allocation.domain import commands
+from allocation.service_layer import handlers, unit_of_work
+
+logging.disable(logging.WARNING)
+
+
+def throughput(directory: str, threads: int, per_thread: int, sync_window: float) -> dict:
+    metrics.reset()
+    store = InMemoryStore.open(directory, sync_window=sync_window)
+    for worker in range(threads):
+        uow = unit_of_work.InMemoryUnitOfWork(store)
+        handlers.add_batch(commands.CreateBatch(f"b{worker}", f"sku{worker}", per_thread, None), uow)
+
+    def allocate(worker: int):
+        # one sku per thread, as with one shard per process: no write conflicts
+        uow = unit_of_work.InMemoryUnitOfWork(store)
+        for i in range(per_thread):
+            handlers.allocate(commands.Allocate(f"o{worker}-{i}", f"sku{worker}", 1), uow)
+
+    workers = [threading.Thread(target=allocate, args=(worker,)) for worker in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    store.close()
+    group_size = metrics.snapshot()["wal.group_size"]
+    return dict(
+        commands_per_second=threads * per_thread / elapsed,
+        commits_per_fsync=group_size["mean"],
+    )
+
+
+def recovery(directory: str, products: int, commits: int, snapshot: bool) -> float:
+    store = InMemoryStore.open(directory, snapshot_every=commits + products + 1)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    for p in range(products):
+        handlers.add_batch(commands.CreateBatch(f"b{p}", f"sku{p}", commits, None), uow)
+    for i in range(commits):
+        handlers.allocate(commands.Allocate(f"o{i}", f"sku{i % products}", 1), uow)
+    if snapshot:
+        store.snapshot()
+    store.close()
+    started = time.perf_counter()
+    InMemoryStore.open(directory).close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory allocation engine")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--sync-window-ms", type=float, nargs="+", default=[0, 1])
+    parser.add_argument("--products", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'threads':>8}{'window ms':>11}{'commands/s':>12}{'commits/fsync':>15}")
+    for threads in args.threads:
+        for window in args.sync_window_ms:
+            directory = tempfile.mkdtemp()
+            try:
+                result = throughput(directory, threads, args.commands // threads, window / 1000)
+            finally:
+                shutil.rmtree(directory)
+            print(
+                f"{threads:>8}{window:>11.1f}"
+                f"{result['commands_per_second']:>12.0f}{result['commits_per_fsync']:>15.1f}"
+            )
+
+    print(f"\n{'recovery from':<22}{'seconds':>10}")
+    for snapshot in (False, True):
+        directory = tempfile.mkdtemp()
+        try:
+            seconds = recovery(directory, args.products, args.commands, snapshot)
+        finally:
+            shutil.rmtree(directory)
+        print(f"{'snapshot' if snapshot else f'{args.commands} log records':<22}{seconds:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
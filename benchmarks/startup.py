@@ -0,0 +1,48 @@
+"""
+Cold-start time of each entrypoint: the median wall time of importing it in
+a fresh interpreter, which is what a new worker pays before its first request.
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).parents[1] / "src"
+
+MODULES = [
+    "allocation.bootstrap",
+    "allocation.entrypoints.flask_app",
+    "allocation.entrypoints.asgi_app",
+    "allocation.entrypoints.redis_eventconsumer",
+]
+
+
+def time_import(module: str) -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", f"import {module}"],
+        env={**os.environ, "PYTHONPATH": str(SRC)},
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark entrypoint import time")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_import("sys") for _ in range(args.runs))
+    print(f"{'module':<45}{'median ms':>12}{'over bare python':>18}")
+    for module in MODULES:
+        median = statistics.median(time_import(module) for _ in range(args.runs))
+        print(f"{module:<45}{median * 1000:>12.1f}{(median - baseline) * 1000:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
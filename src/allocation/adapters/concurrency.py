@@ -0,0 +1,79 @@
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation.adapters import orm
+
+# serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+
+class ConcurrencyStrategy:
+    """
+    How concurrent writers to the same product are kept apart. Whatever the
+    strategy, products are mapped with version_number as their version
+    column, so an UPDATE of a product that changed underneath us fails.
+    """
+    default_isolation_level = None  # type: Optional[str]
+    locks_products = False
+
+    def __init__(self, isolation_level: Optional[str] = "default"):
+        self.isolation_level = (
+            self.default_isolation_level if isolation_level == "default" else isolation_level
+        )
+
+    def lock(self, session, sku: str):
+        pass
+
+    def is_conflict(self, error: BaseException) -> bool:
+        if isinstance(error, StaleDataError):
+            return True
+        if isinstance(error, DBAPIError):
+            return getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES
+        return False
+
+
+class RepeatableRead(ConcurrencyStrategy):
+    """Relies on the database aborting one of two conflicting transactions."""
+    default_isolation_level = "REPEATABLE READ"
+
+
+class SelectForUpdate(ConcurrencyStrategy):
+    """Locks the products row before the product is loaded."""
+    default_isolation_level = "READ COMMITTED"
+    locks_products = True
+
+    def lock(self, session, sku: str):
+        session.execute(
+            select(orm.products.c.sku).where(orm.products.c.sku == sku).with_for_update()
+        )
+
+
+class CompareAndSet(ConcurrencyStrategy):
+    """
+    Takes no locks: the version check on UPDATE is the only guard, and the
+    losing writer retries with a fresh copy of the product.
+    """
+    default_isolation_level = "READ COMMITTED"
+
+
+class AdvisoryLock(ConcurrencyStrategy):
+    """
+    Takes a transaction-scoped Postgres advisory lock per sku, which also
+    serializes creating a product that has no row to lock yet.
+    """
+    default_isolation_level = "READ COMMITTED"
+    locks_products = True
+
+    def lock(self, session, sku: str):
+        session.execute(select(func.pg_advisory_xact_lock(func.hashtext(sku))))
+
+
+STRATEGIES = {
+    "repeatable_read": RepeatableRead,
+    "select_for_update": SelectForUpdate,
+    "compare_and_set": CompareAndSet,
+    "advisory_lock": AdvisoryLock,
+}
@@ -0,0 +1,314 @@
+import itertools
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import date
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from allocation import metrics
+from allocation.adapters import wal
+from allocation.domain import model
+
+WAL_FILE = "products.wal"
+SNAPSHOT_FILE = "products.snapshot"
+
+
+class ConcurrentModification(Exception):
+    pass
+
+
+class WrongShard(Exception):
+    pass
+
+
+def shard_for(sku: str, shards: int) -> int:
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(sku.encode()) % shards
+
+
+def product_to_dict(product: model.Product) -> dict:
+    return dict(
+        sku=product.sku,
+        version_number=product.version_number,
+        batches=[
+            dict(
+                ref=batch.reference,
+                qty=batch._purchased_quantity,
+                eta=batch.eta.isoformat() if batch.eta else None,
+                allocations=[[line.orderId, line.qty] for line in batch._allocations],
+            )
+            for batch in product.batches
+        ],
+    )
+
+
+def product_from_dict(data: dict) -> model.Product:
+    sku = data["sku"]
+    batches = []
+    for b in data["batches"]:
+        eta = date.fromisoformat(b["eta"]) if b["eta"] else None
+        batch = model.Batch(b["ref"], sku, b["qty"], eta)
+        batch._allocations = {
+            model.OrderLine(orderid, sku, qty) for orderid, qty in b["allocations"]
+        }
+        batch._allocated_quantity = sum(line.qty for line in batch._allocations)
+        batches.append(batch)
+    return model.Product(sku, batches, data["version_number"])
+
+
+def copy_product(product: model.Product) -> model.Product:
+    """A working copy a unit of work can change without touching the stored product."""
+    batches = []
+    for b in product.batches:
+        batch = model.Batch(b.reference, b.sku, b._purchased_quantity, b.eta)
+        batch._allocations = set(b._allocations)
+        batch._allocated_quantity = b._allocated_quantity
+        batches.append(batch)
+    return model.Product(product.sku, batches, product.version_number)
+
+
+class InMemoryStore:
+    """
+    The authoritative copy of the products of one shard, held in memory by
+    the one process that owns the shard. Each commit is appended to a
+    write-ahead log as the new state of the products it changed, together
+    with the outbox rows for their events, and every snapshot_every records
+    the whole store is written to a snapshot and the log cut back to the
+    records that came after it.
+    Opening a store recovers it from the snapshot and the log behind it.
+
+    Commits are optimistic: a product changed by someone else since it was
+    read fails the commit with ConcurrentModification.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            shard: int = 0,
+            shards: int = 1,
+            snapshot_every: int = 10000,
+            sync_window: float = 0.0,
+    ):
+        self.directory = directory
+        self.shard = shard
+        self.shards = shards
+        self.snapshot_every = snapshot_every
+        self.sync_window = sync_window
+        self._products = {}  # type: Dict[str, model.Product]
+        self._sku_by_batch = {}  # type: Dict[str, str]
+        # outbox rows whose commit is on disk and that are not yet relayed,
+        # by id in commit order
+        self._outbox = OrderedDict()  # type: OrderedDict[int, Tuple[str, str]]
+        # (lsn, id, row) of rows whose commit may not be on disk yet; relaying
+        # them could publish events of a commit a crash then loses
+        self._pending = deque()  # type: Deque[Tuple[int, int, Tuple[str, str]]]
+        self._next_outbox_id = 1
+        self._lock = threading.Lock()
+        self._relay_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._since_snapshot = 0
+        self._log = self._recover()
+
+    @classmethod
+    def open(cls, directory: str, **kwargs) -> "InMemoryStore":
+        os.makedirs(directory, exist_ok=True)
+        return cls(directory, **kwargs)
+
+    @property
+    def wal_path(self) -> str:
+        return os.path.join(self.directory, WAL_FILE)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, SNAPSHOT_FILE)
+
+    def owns(self, sku: str) -> bool:
+        return shard_for(sku, self.shards) == self.shard
+
+    def check_owned(self, sku: str):
+        if not self.owns(sku):
+            raise WrongShard(
+                f"{sku} belongs to shard {shard_for(sku, self.shards)}, not {self.shard}"
+            )
+
+    def get(self, sku: str) -> Optional[model.Product]:
+        self.check_owned(sku)
+        with self._lock:
+            product = self._products.get(sku)
+            return copy_product(product) if product is not None else None
+
+    def sku_for_batch(self, batch_ref: str) -> Optional[str]:
+        return self._sku_by_batch.get(batch_ref)
+
+    def availability(self, sku: str) -> List[dict]:
+        """
+        What can ship by each eta of the sku, shaped like views.availability,
+        worked out from the batches held here.
+        """
+        by_eta = {}  # type: Dict[Optional[date], int]
+        for batch in self._batches_of(sku):
+            by_eta[batch.eta] = by_eta.get(batch.eta, 0) + batch.available_quantity
+        schedule, available = [], 0
+        for eta in sorted(by_eta, key=lambda eta: eta or date.min):
+            available += by_eta[eta]
+            schedule.append(dict(eta=eta, available=available))
+        return schedule
+
+    def available_by(self, sku: str, by: date) -> int:
+        return sum(
+            b.available_quantity for b in self._batches_of(sku) if b.eta is None or b.eta <= by
+        )
+
+    def commit(
+            self,
+            products: Iterable[model.Product],
+            read_versions: Dict[str, Optional[int]],
+            outbox_rows: Sequence[dict] = (),
+    ):
+        """
+        Installs the changed products, queues their outbox rows for relay()
+        and waits until their log record is on disk.
+        """
+        with self._lock:
+            changed = [p for p in products if p.version_number != read_versions.get(p.sku)]
+            for product in changed:
+                stored = self._products.get(product.sku)
+                if (stored.version_number if stored else None) != read_versions.get(product.sku):
+                    raise ConcurrentModification(product.sku)
+            if not changed and not outbox_rows:
+                return
+            rows = [
+                [self._next_outbox_id + i, row["channel"], row["payload"]]
+                for i, row in enumerate(outbox_rows)
+            ]
+            record = dict(products=[product_to_dict(p) for p in changed], outbox=rows)
+            for product in changed:
+                # a copy, so the unit of work can't change the store behind its back
+                self._install(copy_product(product))
+            lsn = self._append(record)
+        # outside the lock, so commits arriving meanwhile share the fsync
+        self._log.sync(lsn)
+        self._snapshot_if_due()
+
+    def relay(self, publish_many: Callable[[List[Tuple[str, str]]], None], batch_size: int = 500) -> int:
+        """
+        Publishes the oldest batch of outbox rows whose commit is on disk and
+        drops them, through the log like a commit. Delivery is at-least-once:
+        rows published just before a crash are published again after recovery.
+        """
+        with self._relay_lock:
+            with self._lock:
+                durable = self._log.durable_lsn
+                while self._pending and self._pending[0][0] <= durable:
+                    _, outbox_id, row = self._pending.popleft()
+                    self._outbox[outbox_id] = row
+                batch = list(itertools.islice(self._outbox.items(), batch_size))
+            if not batch:
+                return 0
+            publish_many([row for _, row in batch])
+            with self._lock:
+                lsn = self._append(dict(relayed=[outbox_id for outbox_id, _ in batch]))
+            self._log.sync(lsn)
+        self._snapshot_if_due()
+        return len(batch)
+
+    def pending_outbox(self) -> List[Tuple[str, str]]:
+        """Every row not yet relayed, whether or not its commit is on disk yet."""
+        with self._lock:
+            return list(self._outbox.values()) + [row for _, _, row in self._pending]
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            self._snapshot()
+
+    def close(self):
+        self._log.close()
+
+    def _append(self, record: dict) -> int:
+        lsn = self._log.append(json.dumps(record).encode())
+        self._apply(record, lsn=lsn, install=False)
+        self._since_snapshot += 1
+        return lsn
+
+    def _apply(self, record: dict, lsn: Optional[int] = None, install: bool = True):
+        """Applies a log record; one without an lsn was read back from disk."""
+        if install:
+            for data in record.get("products", []):
+                self._install(product_from_dict(data))
+        for outbox_id, channel, payload in record.get("outbox", []):
+            if lsn is None:
+                self._outbox[outbox_id] = (channel, payload)
+            else:
+                self._pending.append((lsn, outbox_id, (channel, payload)))
+            self._next_outbox_id = max(self._next_outbox_id, outbox_id + 1)
+        for outbox_id in record.get("relayed", []):
+            self._outbox.pop(outbox_id, None)
+
+    def _batches_of(self, sku: str) -> List[model.Batch]:
+        self.check_owned(sku)
+        with self._lock:
+            product = self._products.get(sku)
+        # installed products are replaced, never changed, so reading one needs no lock
+        return list(product.batches) if product is not None else []
+
+    def _install(self, product: model.Product):
+        self._products[product.sku] = product
+        for batch in product.batches:
+            self._sku_by_batch[batch.reference] = product.sku
+
+    def _snapshot_if_due(self):
+        # one snapshot at a time; a commit that finds one running goes on
+        if self._since_snapshot < self.snapshot_every:
+            return
+        if not self._snapshot_lock.acquire(blocking=False):
+            return
+        try:
+            if self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+        finally:
+            self._snapshot_lock.release()
+
+    def _snapshot(self):
+        """
+        Copies the store under the lock and writes it outside, so commits go
+        on meanwhile. Installed products are replaced, never changed in place,
+        so the copied map stays as it was at the copied lsn.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            lsn = self._log.lsn
+            products = list(self._products.values())
+            outbox = [[i, *row] for i, row in self._outbox.items()]
+            outbox += [[i, *row] for _, i, row in self._pending]
+            self._since_snapshot = 0
+        records = [dict(products=[product_to_dict(p)]) for p in products]  # type: List[dict]
+        if outbox:
+            records.append(dict(outbox=outbox))
+        wal.write_snapshot(
+            self.snapshot_path,
+            lsn,
+            [json.dumps(record).encode() for record in records],
+        )
+        self._log.truncate(lsn)
+        metrics.observe("in_memory_store.snapshot_seconds", time.perf_counter() - started)
+
+    def _recover(self) -> wal.WriteAheadLog:
+        started = time.perf_counter()
+        lsn = 0
+        for lsn, payload, _ in wal.read_file(self.snapshot_path):
+            self._apply(json.loads(payload))
+        records = wal.read_file(self.wal_path)
+        # records the snapshot already holds are left from a crash before truncate()
+        replayed = [record for record in records if record[0] > lsn]
+        for lsn, payload, _ in replayed:
+            self._apply(json.loads(payload))
+        self._since_snapshot = len(replayed)
+        # a crash mid-append leaves a partial record, new records must not follow it
+        end = records[-1][2] if records else 0
+        if os.path.exists(self.wal_path) and os.path.getsize(self.wal_path) > end:
+            os.truncate(self.wal_path, end)
+        metrics.observe("in_memory_store.recovery_seconds", time.perf_counter() - started)
+        return wal.WriteAheadLog(self.wal_path, lsn=lsn, sync_window=self.sync_window)
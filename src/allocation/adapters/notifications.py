@@ -1,5 +1,7 @@
 import abc
+import asyncio
 import smtplib
+from typing import Optional
 
 from allocation import config
 
@@ -8,21 +10,52 @@ class AbstractNotifications(abc.ABC):
     @abc.abstractmethod
     def send(self, destination, message):
         raise NotImplementedError
-    
 
-DEFAULT_HOST = config.get_email_host_and_port()["host"]
-DEFAULT_PORT = config.get_email_host_and_port()["port"]
 
 
 class EmailNotifications(AbstractNotifications):
-    def __init__(self, smtp_host=DEFAULT_HOST, port=DEFAULT_PORT) -> None:
-        self.server = smtplib.SMTP(smtp_host, port=port)
-        self.server.noop()
+    def __init__(self, smtp_host=None, port=None) -> None:
+        self.smtp_host = smtp_host or config.get_email_host_and_port()["host"]
+        self.port = port or config.get_email_host_and_port()["port"]
+        self._server = None  # type: Optional[smtplib.SMTP]
+
+    @property
+    def server(self) -> smtplib.SMTP:
+        # connects on the first send, so a mail server outage doesn't stop startup
+        if self._server is None:
+            self._server = smtplib.SMTP(self.smtp_host, port=self.port)
+        return self._server
 
     def send(self, destination, message):
-        msg = f"Subject: allocation service notification\n{message}".format(message=message)
+        msg = f"Subject: allocation service notification\n{message}"
         self.server.sendmail(
             from_addr="allocations@example.com",
             to_addrs=[destination],
-            mag=msg,
-        )
\ No newline at end of file
+            msg=msg,
+        )
+
+
+class AbstractAsyncNotifications(abc.ABC):
+    @abc.abstractmethod
+    async def send(self, destination, message):
+        raise NotImplementedError
+
+
+class AsyncEmailNotifications(AbstractAsyncNotifications):
+    def __init__(self, smtp_host=None, port=None) -> None:
+        self.smtp_host = smtp_host or config.get_email_host_and_port()["host"]
+        self.port = port or config.get_email_host_and_port()["port"]
+
+    async def send(self, destination, message):
+        # smtplib is blocking, so the send runs on the default executor
+        await asyncio.to_thread(self._send, destination, message)
+
+    def _send(self, destination, message):
+        msg = f"Subject: allocation service notification\n{message}"
+        with smtplib.SMTP(self.smtp_host, port=self.port) as server:
+            server.sendmail(
+                from_addr="allocations@example.com",
+                to_addrs=[destination],
+                msg=msg,
+            )
+
@@ -1,6 +1,9 @@
 from sqlalchemy.orm import registry
-from sqlalchemy import MetaData, Table, Column, Integer, String, Date, ForeignKey
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Date, ForeignKey, Text, inspect, literal, select,
+)
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import PASSIVE_NO_FETCH
 
 from allocation.domain import model
 from allocation.domain.model import OrderLine
@@ -32,6 +35,7 @@ batches = Table(
     Column("reference", String(255)),
     Column("sku", ForeignKey("products.sku")),
     Column("_purchased_quantity", Integer, nullable=False),
+    Column("_allocated_quantity", Integer, nullable=False, server_default="0"),
     Column("eta", Date, nullable=True)
 )
 
@@ -51,6 +55,24 @@ allocations_view = Table(
     Column("batchref", String(255))
 )
 
+# cumulative available-to-promise: for each eta of a sku, the quantity that
+# can ship by then, from every batch arriving on or before it
+availability_view = Table(
+    "availability_view",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("eta", Date, primary_key=True),
+    Column("available", Integer, nullable=False)
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("channel", String(255), nullable=False),
+    Column("payload", Text, nullable=False)
+)
+
 
 def start_mappers():
     lines_mapper = mapper_registry.map_imperatively(OrderLine, order_lines)
@@ -58,11 +80,61 @@ def start_mappers():
         model.Batch,
         batches,
         properties={
+            # only loaded when a batch's order lines are needed, allocating
+            # goes by the persisted _allocated_quantity instead
             "_allocations": relationship(
-                lines_mapper, secondary=allocations, collection_class=set,
+                lines_mapper, secondary=allocations, collection_class=set, lazy="select",
             )
         }
     )
+    setattr(model.Batch, "_holds", _holds)
+    setattr(model.Batch, "_add_allocation", _add_allocation)
     mapper_registry.map_imperatively(
-        model.Product, products, properties={"batches": relationship(batches_mapper)}
+        model.Product,
+        products,
+        properties={"batches": relationship(batches_mapper)},
+        # the domain bumps version_number itself, every UPDATE checks it
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
+    )
+
+
+def _unloaded_allocations(batch: model.Batch):
+    """The batch's state if it is persistent and its lines aren't loaded, else None."""
+    state = inspect(batch, raiseerr=False)
+    if state is None or state.session is None or "_allocations" in state.dict:
+        return None
+    return state
+
+
+def _holds(batch: model.Batch, line: OrderLine) -> bool:
+    state = _unloaded_allocations(batch)
+    if state is None:
+        return line in batch._allocations
+    # one keyed lookup instead of the batch's whole history; being an ORM
+    # query it autoflushes, so lines added earlier in the session count too
+    found = state.session.execute(
+        select(literal(1))
+        .select_from(OrderLine)
+        .join(allocations, allocations.c.orderline_id == order_lines.c.id)
+        .where(
+            allocations.c.batch_id == state.identity[0],
+            order_lines.c.orderId == line.orderId,
+            order_lines.c.sku == line.sku,
+            order_lines.c.qty == line.qty,
+        )
+        .limit(1)
+    ).first()
+    return found is not None
+
+
+def _add_allocation(batch: model.Batch, line: OrderLine):
+    state = _unloaded_allocations(batch)
+    if state is None:
+        batch._allocations.add(line)
+        return
+    # queued without loading the collection, the next flush inserts it and
+    # a later load of the collection includes it
+    state.manager["_allocations"].impl.append(
+        state, state.dict, line, None, passive=PASSIVE_NO_FETCH,
     )
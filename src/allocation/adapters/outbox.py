@@ -0,0 +1,55 @@
+import json
+import logging
+from dataclasses import asdict
+from typing import Callable, Dict, Iterable, List, Tuple, Type
+
+from sqlalchemy import select
+
+from allocation.adapters import orm
+from allocation.domain import events, model
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = {
+    events.Allocated: "line_allocated",
+    events.OrderAllocated: "order_allocated",
+} # type: Dict[Type[events.Event], str]
+
+
+def rows_for(products: Iterable[model.Product]) -> List[dict]:
+    """Outbox rows for the not-yet-collected events of the given products."""
+    return [
+        dict(channel=CHANNELS[type(event)], payload=json.dumps(asdict(event)))
+        for product in products
+        for event in product.events
+        if isinstance(event, events.Event) and type(event) in CHANNELS
+    ]
+
+
+def relay(
+        session_factory,
+        publish_many: Callable[[List[Tuple[str, str]]], None],
+        batch_size: int = 500,
+) -> int:
+    """
+    Publishes the oldest batch of outbox rows and deletes them. Delivery is
+    at-least-once: a crash between publishing and committing the delete
+    means the batch is published again by the next relay.
+    """
+    session = session_factory()
+    try:
+        rows = session.execute(
+            select(orm.outbox.c.id, orm.outbox.c.channel, orm.outbox.c.payload)
+                .order_by(orm.outbox.c.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            return 0
+        publish_many([(row.channel, row.payload) for row in rows])
+        session.execute(orm.outbox.delete().where(orm.outbox.c.id.in_([row.id for row in rows])))
+        session.commit()
+        logger.debug("relayed %s outbox messages", len(rows))
+        return len(rows)
+    finally:
+        session.close()
@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from allocation.domain import model
+
+
+class ProductCache:
+    """
+    Process-local LRU cache of Product aggregates shared across units of
+    work. An entry is only trusted while its version_number matches the one
+    in the database, which every change to a product bumps.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._products = OrderedDict()  # type: OrderedDict[str, model.Product]
+        self._lock = threading.Lock()
+
+    def get(self, sku: str, version_number: int) -> Optional[model.Product]:
+        with self._lock:
+            product = self._products.get(sku)
+            if product is None or product.version_number != version_number:
+                self.misses += 1
+                return None
+            self._products.move_to_end(sku)
+            self.hits += 1
+            return product
+
+    def put(self, product: model.Product):
+        with self._lock:
+            self._products[product.sku] = product
+            self._products.move_to_end(product.sku)
+            while len(self._products) > self.max_size:
+                self._products.popitem(last=False)
+
+    def invalidate(self, sku: str):
+        with self._lock:
+            self._products.pop(sku, None)
+
+    def __len__(self):
+        return len(self._products)
@@ -1,17 +1,44 @@
+import functools
 import json
 import logging
 from dataclasses import asdict
+from typing import List, Tuple
 
 import redis
+import redis.asyncio
 
 from allocation import config
 from allocation.domain import events
 
 logger = logging.getLogger(__name__)
 
-r = redis.Redis(**config.get_redis_host_and_port())
+
+
+# clients are created on first publish, not when the module is imported
+@functools.lru_cache(maxsize=None)
+def get_client() -> redis.Redis:
+    return redis.Redis(**config.get_redis_host_and_port())
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_client() -> redis.asyncio.Redis:
+    return redis.asyncio.Redis(**config.get_redis_host_and_port())
 
 
 def publish(channel, event: events.Event):
     logger.debug("publishing: channel=%s, event=%s", channel, event)
-    r.publish(channel, json.dumps(asdict(event)))
+    get_client().publish(channel, json.dumps(asdict(event)))
+
+
+def publish_many(messages: List[Tuple[str, str]]):
+    logger.debug("publishing %s messages", len(messages))
+    pipe = get_client().pipeline(transaction=False)
+    for channel, payload in messages:
+        pipe.publish(channel, payload)
+    pipe.execute()
+
+
+async def publish_async(channel, event: events.Event):
+    logger.debug("publishing: channel=%s, event=%s", channel, event)
+    await get_async_client().publish(channel, json.dumps(asdict(event)))
+
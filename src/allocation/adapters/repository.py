@@ -1,10 +1,175 @@
 import abc
-from typing import Set
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import QueryableAttribute, joinedload, selectinload
+
 from allocation.adapters import orm
+from allocation.adapters.concurrency import ConcurrencyStrategy
+from allocation.adapters.in_memory_store import InMemoryStore
+from allocation.adapters.product_cache import ProductCache
 from allocation.domain import model
+from allocation.domain.policies import AllocationPolicy
+
+
+LAZY = "lazy"
+SELECTIN = "selectin"
+JOINED = "joined"
+COUNTS = "counts"
+
+
+def _mapped(cls, name: str) -> QueryableAttribute:
+    # the mapping is imperative, so the model classes don't declare these
+    return getattr(cls, name)
+
+
+# loader options for each profile; COUNTS loads the batches only, whose
+# allocated quantities are persisted, so a batch's order lines are loaded
+# only when that batch is actually changed
+LOADING_PROFILES = {
+    LAZY: lambda: [],
+    SELECTIN: lambda: [
+        selectinload(_mapped(model.Product, "batches"))
+            .selectinload(_mapped(model.Batch, "_allocations"))
+    ],
+    JOINED: lambda: [
+        joinedload(_mapped(model.Product, "batches"))
+            .joinedload(_mapped(model.Batch, "_allocations"))
+    ],
+    COUNTS: lambda: [selectinload(_mapped(model.Product, "batches"))],
+}
 
 
 class AbstractRepository(abc.ABC):
+    def __init__(self, policy: Optional[AllocationPolicy] = None):
+        self.seen = set() # type: Set[model.Product]
+        # handed to every product seen, in place of the model's default
+        self.policy = policy
+
+    def add(self, product: model.Product):
+        self._add(product)
+        self._track(product)
+
+    def get(self, sku, loading: str = LAZY) -> Optional[model.Product]:
+        product = self._get(sku, loading)
+        if product:
+            self._track(product)
+        return product
+
+    def get_by_batch_ref(self, batch_ref, loading: str = LAZY):
+        product = self._get_by_batch_ref(batch_ref, loading)
+        if product:
+            self._track(product)
+        return product
+
+    def _track(self, product: model.Product):
+        if self.policy is not None:
+            product.policy = self.policy
+        self.seen.add(product)
+
+    @abc.abstractmethod
+    def _add(self, product: model.Product):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get(self, sku, loading: str = LAZY) -> Optional[model.Product]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _get_by_batch_ref(self, batch_ref, loading: str = LAZY) -> Optional[model.Product]:
+        raise NotImplementedError
+
+
+class SqlAlchemyRepository(AbstractRepository):
+    def __init__(
+            self,
+            session,
+            cache: Optional[ProductCache] = None,
+            concurrency: Optional[ConcurrencyStrategy] = None,
+            policy: Optional[AllocationPolicy] = None,
+    ):
+        super().__init__(policy)
+        self.session = session
+        self.cache = cache
+        self.concurrency = concurrency
+
+    def _add(self, product):
+        self._lock(product.sku)
+        self.session.add(product)
+
+    def _locks_products(self) -> bool:
+        return self.concurrency is not None and self.concurrency.locks_products
+
+    def _lock(self, sku):
+        if self.concurrency is not None and self.concurrency.locks_products:
+            self.concurrency.lock(self.session, sku)
+
+    def _get(self, sku, loading: str = LAZY) -> Optional[model.Product]:
+        self._lock(sku)
+        if self.cache is not None:
+            return self._get_through_cache(self.cache, sku, loading)
+        return self._query(loading).filter_by(sku=sku).first()
+
+    def _get_through_cache(self, cache: ProductCache, sku, loading: str) -> Optional[model.Product]:
+        version_number = self.session.execute(
+            select(orm.products.c.version_number).where(orm.products.c.sku == sku)
+        ).scalar_one_or_none()
+        if version_number is None:
+            return None
+        cached = cache.get(sku, version_number)
+        if cached is None:
+            return self._query(loading).filter_by(sku=sku).first()
+        # attaches a copy of the cached aggregate to this session without a query
+        return self.session.merge(cached, load=False)
+
+    def list(self):
+        return self.session.query(model.Product).all()
+
+    def _get_by_batch_ref(self, batch_ref, loading: str = LAZY) -> Optional[model.Product]:
+        if self.cache is not None or self._locks_products():
+            sku = self.session.execute(
+                select(orm.batches.c.sku).where(orm.batches.c.reference == batch_ref)
+            ).scalar_one_or_none()
+            return self._get(sku, loading) if sku is not None else None
+        return (
+            self._query(loading)
+                .join(model.Batch)
+                .filter(orm.batches.c.reference == batch_ref)
+                .first()
+        )
+
+    def _query(self, loading: str):
+        return self.session.query(model.Product).options(*LOADING_PROFILES[loading]())
+
+
+class InMemoryRepository(AbstractRepository):
+    """
+    Working copies of the products in an InMemoryStore, with the version
+    each was read at so the store can tell whether it changed meanwhile.
+    Loading profiles don't apply, the whole product is always at hand.
+    """
+
+    def __init__(self, store: InMemoryStore, policy: Optional[AllocationPolicy] = None):
+        super().__init__(policy)
+        self.store = store
+        self.read_versions = {}  # type: Dict[str, Optional[int]]
+
+    def _add(self, product):
+        self.store.check_owned(product.sku)
+        self.read_versions.setdefault(product.sku, None)
+
+    def _get(self, sku, loading: str = LAZY) -> Optional[model.Product]:
+        product = self.store.get(sku)
+        if product is not None:
+            self.read_versions.setdefault(sku, product.version_number)
+        return product
+
+    def _get_by_batch_ref(self, batch_ref, loading: str = LAZY) -> Optional[model.Product]:
+        sku = self.store.sku_for_batch(batch_ref)
+        return self._get(sku, loading) if sku is not None else None
+
+
+class AbstractAsyncRepository(abc.ABC):
     def __init__(self):
         self.seen = set() # type: Set[model.Product]
 
@@ -12,14 +177,14 @@ class AbstractRepository(abc.ABC):
         self._add(product)
         self.seen.add(product)
 
-    def get(self, sku) -> model.Product:
-        product = self._get(sku)
+    async def get(self, sku) -> Optional[model.Product]:
+        product = await self._get(sku)
         if product:
             self.seen.add(product)
         return product
 
-    def get_by_batch_ref(self, batch_ref):
-        product = self._get_by_batch_ref(batch_ref)
+    async def get_by_batch_ref(self, batch_ref):
+        product = await self._get_by_batch_ref(batch_ref)
         if product:
             self.seen.add(product)
         return product
@@ -29,15 +194,15 @@ class AbstractRepository(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def _get(self, sku) -> model.Product:
+    async def _get(self, sku) -> Optional[model.Product]:
         raise NotImplementedError
 
     @abc.abstractmethod
-    def _get_by_batch_ref(self, batch_ref) -> model.Product:
+    async def _get_by_batch_ref(self, batch_ref) -> Optional[model.Product]:
         raise NotImplementedError
 
 
-class SqlAlchemyRepository(AbstractRepository):
+class AsyncSqlAlchemyRepository(AbstractAsyncRepository):
     def __init__(self, session):
         super().__init__()
         self.session = session
@@ -45,17 +210,22 @@ class SqlAlchemyRepository(AbstractRepository):
     def _add(self, product):
         self.session.add(product)
 
-    def _get(self, sku) -> model.Product:
-        return self.session.query(model.Product).filter_by(sku=sku).one()
+    def _product_query(self):
+        # lazy loading can't be awaited, so the whole aggregate is loaded up front
+        return select(model.Product).options(
+            selectinload(_mapped(model.Product, "batches"))
+                .selectinload(_mapped(model.Batch, "_allocations"))
+        )
 
-    def list(self):
-        return self.session.query(model.Product).all()
+    async def _get(self, sku) -> Optional[model.Product]:
+        result = await self.session.execute(self._product_query().filter_by(sku=sku))
+        return result.scalars().first()
 
-    def _get_by_batch_ref(self, batch_ref) -> model.Product:
-        return (
-            self.session.query(model.Product)
+    async def _get_by_batch_ref(self, batch_ref) -> Optional[model.Product]:
+        result = await self.session.execute(
+            self._product_query()
                 .join(model.Batch)
                 .filter(orm.batches.c.reference == batch_ref)
-                .first()
         )
+        return result.scalars().first()
 
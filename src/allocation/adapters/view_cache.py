@@ -0,0 +1,77 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class CachedView:
+    value: Any
+    etag: str
+    last_modified: datetime
+
+
+def cached_view(value: Any) -> CachedView:
+    # the etag depends on the content only, so every process agrees on it
+    etag = hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+    return CachedView(value, etag, datetime.now(timezone.utc).replace(microsecond=0))
+
+
+class ViewCache:
+    """
+    Read-through LRU cache of query results with a TTL. Event handlers that
+    change the read model invalidate the keys they touch; the TTL bounds how
+    stale a key changed by another process can get.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._views = OrderedDict()  # type: OrderedDict[str, Tuple[float, CachedView]]
+        # when each key was last invalidated, so a load that raced with an
+        # invalidation doesn't put its stale result back
+        self._generation = 0
+        self._invalidated = OrderedDict()  # type: OrderedDict[str, int]
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedView]:
+        with self._lock:
+            cached = self._views.get(key)
+            if cached is None or self.clock() - cached[0] > self.ttl:
+                self._views.pop(key, None)
+                self.misses += 1
+                return None
+            self._views.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def get_or_load(self, key: str, load: Callable[[], Any]) -> CachedView:
+        view = self.get(key)
+        if view is not None:
+            return view
+        with self._lock:
+            started = self._generation
+        view = cached_view(load())
+        with self._lock:
+            if self._invalidated.get(key, -1) < started:
+                self._views[key] = (self.clock(), view)
+                self._views.move_to_end(key)
+                while len(self._views) > self.max_size:
+                    self._views.popitem(last=False)
+        return view
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._views.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                self._invalidated.popitem(last=False)
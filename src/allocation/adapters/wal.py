@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Tuple
+
+from allocation import metrics
+
+# every record is framed as payload length, log sequence number and crc32 of the payload
+HEADER = struct.Struct("<IQI")
+
+
+def frame(lsn: int, payload: bytes) -> bytes:
+    return HEADER.pack(len(payload), lsn, zlib.crc32(payload)) + payload
+
+
+def read_frames(buffer) -> Iterator[Tuple[int, bytes, int]]:
+    """
+    (lsn, payload, end offset) of each whole record in the buffer. Stops at
+    the first torn or corrupt record, which is where a crash cut the log.
+    """
+    view = memoryview(buffer)
+    offset = 0
+    while offset + HEADER.size <= len(view):
+        length, lsn, crc = HEADER.unpack_from(view, offset)
+        end = offset + HEADER.size + length
+        if end > len(view):
+            return
+        payload = bytes(view[offset + HEADER.size:end])
+        if zlib.crc32(payload) != crc:
+            return
+        yield lsn, payload, end
+        offset = end
+
+
+def read_file(path: str) -> List[Tuple[int, bytes, int]]:
+    """All whole records in the file, read through mmap."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return list(read_frames(mapped))
+
+
+def write_snapshot(path: str, lsn: int, payloads: List[bytes]):
+    """Replaces the snapshot atomically: a crash leaves either the old one or the new one."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        for payload in payloads:
+            f.write(frame(lsn, payload))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_directory(path)
+
+
+def _fsync_directory(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Append-only log of records, made durable with group fsync: a committer
+    that finds its record not yet on disk fsyncs for everyone who appended
+    before it, so concurrent commits share one fsync. sync_window holds the
+    fsync back a little to let more commits join it.
+    """
+
+    def __init__(self, path: str, lsn: int = 0, sync_window: float = 0.0):
+        self.path = path
+        self.sync_window = sync_window
+        self._file = open(path, "ab")
+        self._lsn = lsn
+        self._durable = lsn
+        self._append_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def lsn(self) -> int:
+        return self._lsn
+
+    @property
+    def durable_lsn(self) -> int:
+        """The last record known to be on disk, with every one before it."""
+        return self._durable
+
+    def append(self, payload: bytes) -> int:
+        with self._append_lock:
+            self._lsn += 1
+            self._file.write(frame(self._lsn, payload))
+            return self._lsn
+
+    def sync(self, lsn: int):
+        """Returns once the record with this lsn, and every one before it, is on disk."""
+        if self._durable >= lsn:
+            return
+        with self._sync_lock:
+            if self._durable >= lsn:
+                # synced by the commit that held the lock before us
+                return
+            if self.sync_window:
+                time.sleep(self.sync_window)
+            with self._append_lock:
+                self._file.flush()
+                upto = self._lsn
+            started = time.perf_counter()
+            os.fsync(self._file.fileno())
+            metrics.observe("wal.fsync_seconds", time.perf_counter() - started)
+            metrics.observe("wal.group_size", upto - self._durable)
+            self._durable = upto
+
+    def truncate(self, upto: int):
+        """
+        Drops the records up to and including upto, once a snapshot holds
+        them. Records appended since are kept, rewritten into a fresh file
+        that replaces the log atomically.
+        """
+        with self._sync_lock, self._append_lock:
+            self._file.flush()
+            kept = [(lsn, payload) for lsn, payload, _ in read_file(self.path) if lsn > upto]
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "wb") as f:
+                for lsn, payload in kept:
+                    f.write(frame(lsn, payload))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            _fsync_directory(self.path)
+            self._file = open(self.path, "ab")
+            self._durable = self._lsn
+
+    def close(self):
+        with self._append_lock:
+            self._file.close()
@@ -1,27 +1,101 @@
+import atexit
+import copy
+import functools
 import inspect
-from typing import Callable
+from typing import Callable, Optional
 from allocation.adapters import orm, redis_eventpublisher
-from allocation.adapters.notifications import AbstractNotifications, EmailNotifications
-from allocation.service_layer import handlers, messagebus, unit_of_work
+from allocation.adapters.notifications import (
+    AbstractAsyncNotifications,
+    AbstractNotifications,
+    AsyncEmailNotifications,
+    EmailNotifications,
+)
+from allocation.domain import commands
+from allocation.service_layer import (
+    async_handlers,
+    dispatcher,
+    group_commit,
+    handlers,
+    messagebus,
+    unit_of_work,
+)
+from allocation.service_layer.availability import (
+    AbstractAsyncAvailabilityIndex,
+    AbstractAvailabilityIndex,
+    AsyncAvailabilityIndex,
+    AvailabilityIndex,
+    StoreAvailability,
+)
+from allocation.service_layer.projector import AbstractProjector, AllocationsProjector
 
 
 def bootstarp(
         start_orm: bool = True,
-        uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
-        notifications: AbstractNotifications = None,
+        uow: Optional[unit_of_work.AbstractUnitOfWork] = None,
+        notifications: Optional[AbstractNotifications] = None,
         publish: Callable = redis_eventpublisher.publish,
+        group_commit_window: Optional[float] = None,
+        background_workers: int = 0,
+        projector: Optional[AbstractProjector] = None,
+        availability: Optional[AbstractAvailabilityIndex] = None,
 ) -> messagebus.MessageBus:
-    
+    if uow is None:
+        uow = unit_of_work.SqlAlchemyUnitOfWork()
+
     if notifications is None:
         notifications = EmailNotifications()
 
     if start_orm:
         orm.start_mappers()
-    
-    dependencies = { "uow": uow, "notifications": notifications, "publish": publish }
+
+    if projector is None:
+        # writes each read model change straight away, with its own uow, so
+        # there is no worker to shut down; callers passing one shut it down
+        projector = AllocationsProjector(_read_model_uow(uow))
+
+    if availability is None:
+        if isinstance(uow, unit_of_work.InMemoryUnitOfWork):
+            # the store answers availability from its own products
+            availability = StoreAvailability()
+        else:
+            availability = AvailabilityIndex(_read_model_uow(uow))
+
+    event_dispatcher = None
+    if background_workers:
+        # a unit of work holds one session at a time, so every worker gets its own
+        event_dispatcher = dispatcher.BackgroundEventDispatcher([
+            _build_bus(copy.copy(uow), notifications, publish, projector, availability)
+            for _ in range(background_workers)
+        ])
+        atexit.register(event_dispatcher.shutdown)
+
+    bus = _build_bus(uow, notifications, publish, projector, availability, event_dispatcher)
+    if group_commit_window is not None:
+        def allocate_many(command: commands.AllocateMany):
+            # leaders of different skus commit concurrently, a unit of work
+            # holds one session, so every group runs on a bus of its own
+            group_bus = _build_bus(
+                copy.copy(uow), notifications, publish, projector, availability, event_dispatcher,
+            )
+            return group_bus.handle(command)[0]
+
+        bus.command_handlers[commands.Allocate] = group_commit.GroupCommitAllocator(
+            allocate_many,
+            window=group_commit_window,
+        )
+    return bus
+
+
+def _build_bus(
+        uow, notifications, publish, projector, availability, event_dispatcher=None,
+) -> messagebus.MessageBus:
+    dependencies = {
+        "uow": uow, "notifications": notifications, "publish": publish,
+        "projector": projector, "availability": availability,
+    }
     injected_event_handlers = {
         event_type: [
-            inject_dependencies(handler, dependencies)
+            _inject_event_handler(handler, dependencies)
             for handler in event_handlers
         ]
         for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
@@ -34,6 +108,70 @@ def bootstarp(
     return messagebus.MessageBus(
         uow=uow,
         event_handlers = injected_event_handlers,
+        command_handlers=injected_command_handlers,
+        dispatcher=event_dispatcher,
+    )
+
+def _inject_event_handler(handler, dependencies):
+    if not getattr(handler, "independent", False):
+        return inject_dependencies(handler, dependencies)
+    # runs alongside the other handlers, so it can't share their unit of work
+    uow = copy.copy(dependencies["uow"])
+    injected = inject_dependencies(handler, dict(dependencies, uow=uow))
+    # the bus collects the handler's new events from it
+    injected.uow = uow
+    return injected
+
+
+def _read_model_uow(uow: unit_of_work.AbstractUnitOfWork) -> unit_of_work.SqlAlchemyUnitOfWork:
+    if isinstance(uow, unit_of_work.SqlAlchemyUnitOfWork):
+        return copy.copy(uow)
+    # the products live elsewhere, the read models stay in the database
+    return unit_of_work.SqlAlchemyUnitOfWork()
+
+
+def async_bootstrap(
+        start_orm: bool = True,
+        uow: Optional[unit_of_work.AbstractAsyncUnitOfWork] = None,
+        notifications: Optional[AbstractAsyncNotifications] = None,
+        publish: Callable = redis_eventpublisher.publish_async,
+        availability: Optional[AbstractAsyncAvailabilityIndex] = None,
+) -> messagebus.AsyncMessageBus:
+
+    if uow is None:
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork()
+
+    if notifications is None:
+        notifications = AsyncEmailNotifications()
+
+    if start_orm:
+        orm.start_mappers()
+
+    if availability is None:
+        if not isinstance(uow, unit_of_work.AsyncSqlAlchemyUnitOfWork):
+            # the index lives in the database, a uow without one can't keep it
+            raise TypeError(f"pass an availability index to use {type(uow).__name__}")
+        availability = AsyncAvailabilityIndex(uow)
+
+    dependencies = {
+        "uow": uow, "notifications": notifications, "publish": publish,
+        "availability": availability,
+    }
+    injected_event_handlers = {
+        event_type: [
+            inject_dependencies(handler, dependencies)
+            for handler in event_handlers
+        ]
+        for event_type, event_handlers in async_handlers.EVENT_HANDLERS.items()
+    }
+    injected_command_handlers = {
+        command_type: inject_dependencies(handler, dependencies)
+        for command_type, handler in async_handlers.COMMAND_HANDLERS.items()
+    }
+
+    return messagebus.AsyncMessageBus(
+        uow=uow,
+        event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers
     )
 
@@ -44,4 +182,9 @@ def inject_dependencies(handler, dependencies):
         for name, dependency in dependencies.items()
         if name in params
     }
-    return lambda message: handler(message, **deps)
\ No newline at end of file
+
+    @functools.wraps(handler)
+    def injected(message):
+        return handler(message, **deps)
+
+    return injected
\ No newline at end of file
@@ -1,15 +1,23 @@
 import os
 
 
-def get_postgres_uri():
-    host = os.environ.get("DB_HOST", "localhost")
+def get_postgres_uri(host=None):
+    host = host or os.environ.get("DB_HOST", "localhost")
     port = 54321 if host == "localhost" else 5432
     password = os.environ.get("DB_PASSWORD", "abc123")
     user, db_name = "allocation", "allocation"
-    print(f"postgresql://{user}:{password}@{host}:{port}/{db_name}")
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_postgres_read_uri():
+    # a read replica when one is configured, the primary otherwise
+    return get_postgres_uri(os.environ.get("DB_READ_HOST"))
+
+
+def get_async_postgres_uri():
+    return get_postgres_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
@@ -27,3 +35,99 @@ def get_email_host_and_port():
     port = 11025 if host == "localhost" else 1025
     http_port = 18025 if host == "localhost" else 8025
     return dict(host=host, port=port, http_port=http_port)
+
+
+def get_group_commit_window():
+    window_ms = os.environ.get("GROUP_COMMIT_WINDOW_MS")
+    return float(window_ms) / 1000 if window_ms else None
+
+
+def get_background_event_workers():
+    return int(os.environ.get("BACKGROUND_EVENT_WORKERS", 0))
+
+
+def get_outbox_batch_size():
+    return int(os.environ.get("OUTBOX_BATCH_SIZE", 500))
+
+
+def get_outbox_poll_interval():
+    return float(os.environ.get("OUTBOX_POLL_INTERVAL", 0.1))
+
+
+def get_stream_partitions():
+    return int(os.environ.get("STREAM_PARTITIONS", 4))
+
+
+def get_stream_max_deliveries():
+    return int(os.environ.get("STREAM_MAX_DELIVERIES", 5))
+
+
+def get_stream_claim_idle_ms():
+    return int(os.environ.get("STREAM_CLAIM_IDLE_MS", 10000))
+
+
+
+def get_product_cache_size():
+    return int(os.environ.get("PRODUCT_CACHE_SIZE", 0))
+
+
+def get_concurrency_strategy():
+    return os.environ.get("CONCURRENCY_STRATEGY", "repeatable_read")
+
+
+def get_allocation_policy():
+    return os.environ.get("ALLOCATION_POLICY", "earliest_eta")
+
+
+def get_conflict_attempts():
+    return int(os.environ.get("CONFLICT_ATTEMPTS", 3))
+
+
+def get_db_pool_settings():
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+    )
+
+
+def get_db_statement_timeout_ms():
+    return int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
+
+
+def get_allocations_cache_size():
+    return int(os.environ.get("ALLOCATIONS_CACHE_SIZE", 1024))
+
+
+def get_allocations_cache_ttl():
+    return float(os.environ.get("ALLOCATIONS_CACHE_TTL", 5))
+
+
+def get_projector_max_batch():
+    return int(os.environ.get("PROJECTOR_MAX_BATCH", 500))
+
+
+def get_projector_max_delay():
+    delay_ms = os.environ.get("PROJECTOR_MAX_DELAY_MS", "50")
+    return float(delay_ms) / 1000
+
+
+def get_projector_max_pending():
+    return int(os.environ.get("PROJECTOR_MAX_PENDING", 10000))
+
+
+def get_unit_of_work():
+    # "sqlalchemy", or "in_memory" for an InMemoryStore owned by this process
+    return os.environ.get("UNIT_OF_WORK", "sqlalchemy")
+
+
+def get_in_memory_store_settings():
+    return dict(
+        directory=os.environ.get("IN_MEMORY_STORE_DIR", "/var/lib/allocation"),
+        shard=int(os.environ.get("IN_MEMORY_SHARD", 0)),
+        shards=int(os.environ.get("IN_MEMORY_SHARDS", 1)),
+        snapshot_every=int(os.environ.get("IN_MEMORY_SNAPSHOT_EVERY", 10000)),
+        sync_window=float(os.environ.get("IN_MEMORY_SYNC_WINDOW_MS", 0)) / 1000,
+    )
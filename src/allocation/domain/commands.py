@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import List, Optional, Tuple
 
 
 class Command:
@@ -14,6 +14,17 @@ class Allocate(Command):
     qty: int
 
 
+@dataclass
+class AllocateMany(Command):
+    lines: List[Allocate]
+
+
+@dataclass
+class AllocateOrder(Command):
+    order_id: str
+    lines: List[Tuple[str, int]]  # (sku, qty)
+
+
 @dataclass
 class Deallocate(Command):
     ref: str
@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import List, Optional
 
 
+@dataclass
 class Event:
     pass
 
@@ -20,8 +21,31 @@ class Allocated(Event):
     batchref: str
 
 
+@dataclass
+class OrderAllocated(Event):
+    orderid: str
+    allocations: List[Allocated]
+
+
 @dataclass
 class Deallocated(Event):
     orderid: str
     sku: str
     qty: int
+    batchref: str
+
+
+@dataclass
+class BatchCreated(Event):
+    ref: str
+    sku: str
+    qty: int
+    eta: Optional[date] = None
+
+
+@dataclass
+class BatchQuantityChanged(Event):
+    ref: str
+    sku: str
+    delta: int
+    eta: Optional[date] = None
@@ -1,9 +1,17 @@
+import bisect
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional, List
+from typing import Dict, Optional, List, Set, Tuple, Union
+
+import numpy as np
 from sqlalchemy import orm
 
 from allocation.domain import events, commands
+from allocation.domain.policies import AllocationPolicy, EarliestEta
+
+
+class OutOfStock(Exception):
+    pass
 
 
 @dataclass(unsafe_hash=True)
@@ -19,7 +27,9 @@ class Batch:
         self.sku = sku
         self.eta = eta
         self._purchased_quantity = qty
-        self._allocations = set()
+        self._allocations = set()  # type: Set[OrderLine]
+        self._allocated_quantity = 0
+        self._product = None  # type: Optional[Product]
 
     def __eq__(self, other):
         if not isinstance(other, Batch):
@@ -36,24 +46,67 @@ class Batch:
             return True
         return self.eta > other.eta
 
-    def allocate(self, line: OrderLine):
+    def allocate(self, line: OrderLine) -> bool:
+        """True if the line was added, False if it didn't fit or was already here."""
         print(f"Try allocate {line}")
-        if self.can_allocate(line):
+        if self.can_allocate(line) and not self._holds(line):
             print(f"{line} can be allocated")
-            self._allocations.add(line)
+            self._allocated_quantity = self.allocated_quantity + line.qty
+            self._add_allocation(line)
+            self._changed()
+            return True
+        return False
+
+    # allocating only needs these two; the ORM replaces them with versions
+    # that don't load every line the batch has ever held
+    def _holds(self, line: OrderLine) -> bool:
+        return line in self._allocations
+
+    def _add_allocation(self, line: OrderLine):
+        self._allocations.add(line)
 
     def deallocate(self, line: OrderLine):
         print(f"Try deallocate {line}")
         if line in self._allocations:
             print(f"{line} can be deallocated")
+            self._allocated_quantity = self.allocated_quantity - line.qty
             self._allocations.remove(line)
+            self._changed()
+
+    def deallocate_to_fit(self) -> List[OrderLine]:
+        """
+        Deallocates the fewest lines that bring available quantity back to
+        zero or above: largest lines first, in a single pass.
+        """
+        shortfall = -self.available_quantity
+        evicted = []
+        for line in sorted(self._allocations, key=lambda l: (l.qty, l.orderId), reverse=True):
+            if shortfall <= 0:
+                break
+            evicted.append(line)
+            shortfall -= line.qty
+        for line in evicted:
+            self.deallocate(line)
+        return evicted
 
     def deallocate_one(self) -> OrderLine:
-        return self._allocations.pop()
+        allocated = self.allocated_quantity
+        line = self._allocations.pop()
+        self._allocated_quantity = allocated - line.qty
+        self._changed()
+        return line
+
+    def _changed(self):
+        # keeps the owning product's index of available quantities in step,
+        # whether the batch was changed through the product or not
+        product = getattr(self, "_product", None)
+        if product is not None:
+            product._sync(self)
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        # persisted with the batch, so reading it never loads _allocations
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
@@ -63,49 +116,185 @@ class Batch:
         return self.sku == line.sku and self.available_quantity >= line.qty
 
 
+def eta_sort_key(batch: Batch):
+    # warehouse stock (no eta) sorts before any shipment
+    return (batch.eta is not None, batch.eta or date.min)
+
+
 class Product:
-    def __init__(self, sku: str, batches: [Batch], version_number: int = 0):
+    # not persisted; a repository may hand its products another policy
+    policy = EarliestEta() # type: AllocationPolicy
+
+    def __init__(
+            self,
+            sku: str,
+            batches: List[Batch],
+            version_number: int = 0,
+            policy: Optional[AllocationPolicy] = None,
+    ):
         self.sku = sku
         self.batches = batches
         self.version_number = version_number
-        self.events = [] # type: List[events.Event]
+        if policy is not None:
+            self.policy = policy
+        # commands too: lines a quantity change evicts go back to the bus
+        self.events = [] # type: List[Union[events.Event, commands.Command]]
+        self._reindex_batches()
 
     @orm.reconstructor
     def init_on_load(self):
-        self.events = [] # type: List[events.Event]
-
-    def allocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
-            print(f"Next batch is {batch.reference} with sku {batch.sku}")
-            batch.allocate(line)
-            self.version_number += 1
-            self.events.append(
-                events.Allocated(
-                    orderid=line.orderId,
-                    sku=line.sku,
-                    qty=line.qty,
-                    batchref=batch.reference,
-                )
+        self.events = []
+        # built on first use so that loading a product doesn't load its batches
+        self._batches_by_eta = None # type: Optional[List[Batch]]
+
+    def _reindex_batches(self) -> List[Batch]:
+        batches = sorted(self.batches, key=eta_sort_key)
+        self._batches_by_eta = batches
+        self._eta_keys = [eta_sort_key(b) for b in batches]
+        self._batches_by_ref = {b.reference: b for b in batches}
+        self._reindex_available(batches)
+        return batches
+
+    def _reindex_available(self, batches: List[Batch]):
+        # available quantities in eta order, for the policy to score in one go;
+        # every batch reports its changes to _sync, so the array stays current
+        self._positions = {b.reference: i for i, b in enumerate(batches)}
+        for batch in batches:
+            batch._product = self
+        self._available = np.fromiter(
+            (b.available_quantity for b in batches),
+            dtype=np.int64,
+            count=len(batches),
+        )
+
+    def _sync(self, batch: Batch):
+        position = self._positions.get(batch.reference) if self._batches_by_eta is not None else None
+        if position is not None:
+            self._available[position] = batch.available_quantity
+
+    def _indexed_batches(self) -> List[Batch]:
+        # batches appended to self.batches directly bypass add_batch, so a
+        # size mismatch means the index is stale
+        if self._batches_by_eta is None or len(self._batches_by_eta) != len(self.batches):
+            return self._reindex_batches()
+        return self._batches_by_eta
+
+    def _get_batch(self, ref: str) -> Optional[Batch]:
+        self._indexed_batches()
+        return self._batches_by_ref.get(ref)
+
+    def add_batch(self, batch: Batch):
+        batches = self._indexed_batches()
+        self.batches.append(batch)
+        key = eta_sort_key(batch)
+        position = bisect.bisect_right(self._eta_keys, key)
+        self._eta_keys.insert(position, key)
+        batches.insert(position, batch)
+        self._batches_by_ref[batch.reference] = batch
+        self._positions = {b.reference: i for i, b in enumerate(batches)}
+        self._available = np.insert(self._available, position, batch.available_quantity)
+        batch._product = self
+        self.version_number += 1
+        self.events.append(
+            events.BatchCreated(batch.reference, batch.sku, batch._purchased_quantity, batch.eta)
+        )
+
+    def _batch_for(self, line: OrderLine) -> Optional[Batch]:
+        batches = self._indexed_batches()
+        batch = self._chosen(batches, line)
+        return batch if batch is not None and batch.can_allocate(line) else None
+
+    def _chosen(self, batches: List[Batch], line: OrderLine) -> Optional[Batch]:
+        position = self.policy.choose(self._available, line.qty)
+        return batches[position] if position is not None else None
+
+    def _allocate_to(self, batch: Batch, line: OrderLine):
+        batch.allocate(line)
+        self.events.append(
+            events.Allocated(
+                orderid=line.orderId,
+                sku=line.sku,
+                qty=line.qty,
+                batchref=batch.reference,
             )
-            print(f"Batch with id {batch.reference} and sku {batch.sku} is successfully allocated")
-            return batch.reference
-        except StopIteration:
+        )
+
+    def allocate(self, line: OrderLine) -> Optional[str]:
+        batch = self._batch_for(line)
+        if batch is None:
             self.events.append(events.OutOfStock(line.sku))
+            return None
+        print(f"Next batch is {batch.reference} with sku {batch.sku}")
+        self._allocate_to(batch, line)
+        self.version_number += 1
+        print(f"Batch with id {batch.reference} and sku {batch.sku} is successfully allocated")
+        return batch.reference
 
     def deallocate(self, batch_ref: str, line: OrderLine):
-        try:
-            batch = next(b for b in sorted(self.batches) if b.reference == batch_ref)
-            batch.deallocate(line)
-            self.version_number += 1
-        except StopIteration:
+        batch = self._get_batch(batch_ref)
+        if batch is None:
             self.events.append(events.OutOfStock(line.sku))
+            return
+        if line in batch._allocations:
+            batch.deallocate(line)
+            self.events.append(events.Deallocated(line.orderId, line.sku, line.qty, batch.reference))
+        self.version_number += 1
 
     def change_batch_quantity(self, ref: str, qty: int):
-        batch = next(b for b in self.batches if b.reference == ref)
+        # eta is unchanged, so the batch keeps its place in the eta index
+        batch = self._get_batch(ref)
+        if batch is None:
+            raise KeyError(ref)
+        delta = qty - batch._purchased_quantity
         batch._purchased_quantity = qty
-        while batch.available_quantity < 0:
-            line = batch.deallocate_one()
-            self.events.append(
-                commands.Allocate(line.orderId, line.sku, line.qty)
+        self.version_number += 1
+        if delta:
+            self.events.append(events.BatchQuantityChanged(ref, batch.sku, delta, batch.eta))
+        evicted = batch.deallocate_to_fit()
+        self._sync(batch)
+        for line in evicted:
+            self.events.append(events.Deallocated(line.orderId, line.sku, line.qty, ref))
+        # evicted lines move to other batches of this product in the same
+        # transaction; only the ones that fit nowhere go back to the bus
+        for line in evicted:
+            target = self._batch_for(line)
+            if target is None:
+                self.events.append(commands.Allocate(line.orderId, line.sku, line.qty))
+            else:
+                self._allocate_to(target, line)
+
+
+def allocate_order(order_id: str, lines: List[OrderLine], products: Dict[str, Product]) -> List[str]:
+    """
+    Allocates every line of an order or none of them. On success a single
+    OrderAllocated event is raised, on the product of the first line, for
+    the lines this call added: lines allocated before are left as they were,
+    whether the order succeeds or not.
+    """
+    allocations = []  # type: List[Tuple[Batch, OrderLine]]
+    added = []  # type: List[Tuple[Batch, OrderLine]]
+    for line in lines:
+        product = products[line.sku]
+        batch = product._batch_for(line)
+        if batch is None:
+            for added_batch, added_line in added:
+                added_batch.deallocate(added_line)
+            raise OutOfStock(f"Out of stock for {line.sku}")
+        if batch.allocate(line):
+            added.append((batch, line))
+        allocations.append((batch, line))
+
+    for product in {products[line.sku] for line in lines}:
+        product.version_number += 1
+    if added:
+        products[lines[0].sku].events.append(
+            events.OrderAllocated(
+                orderid=order_id,
+                allocations=[
+                    events.Allocated(line.orderId, line.sku, line.qty, batch.reference)
+                    for batch, line in added
+                ],
             )
+        )
+    return [batch.reference for batch, _ in allocations]
+
@@ -0,0 +1,67 @@
+import abc
+from typing import Dict, Optional, Type
+
+import numpy as np
+
+# score of a batch the line doesn't fit in, so it never wins
+UNFIT = np.iinfo(np.int64).max
+
+
+class AllocationPolicy(abc.ABC):
+    """
+    Picks the batch a line is allocated from. A policy sees the available
+    quantities of a product's batches as one array, in eta order with
+    warehouse stock first, and scores all of them in a single pass: the
+    batch with the lowest score wins, the earliest one on a tie.
+    """
+
+    def choose(self, available: np.ndarray, qty: int) -> Optional[int]:
+        """Position of the chosen batch, None if the line fits in none."""
+        fits = available >= qty
+        if not fits.any():
+            return None
+        return int(np.where(fits, self.score(available, qty), UNFIT).argmin())
+
+    @abc.abstractmethod
+    def score(self, available: np.ndarray, qty: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class EarliestEta(AllocationPolicy):
+    """The earliest batch the line fits in."""
+
+    def choose(self, available: np.ndarray, qty: int) -> Optional[int]:
+        fits = available >= qty
+        if not fits.any():
+            return None
+        # argmax of a boolean array is the first True
+        return int(fits.argmax())
+
+    def score(self, available: np.ndarray, qty: int) -> np.ndarray:
+        # every batch scores the same, so the earliest that fits wins
+        return np.zeros_like(available)
+
+
+class BestFit(AllocationPolicy):
+    """The batch left with the least stock once the line is taken from it."""
+
+    def score(self, available: np.ndarray, qty: int) -> np.ndarray:
+        return available - qty
+
+
+class FewestSplits(AllocationPolicy):
+    """
+    The batch with the most stock. Remaining stock stays in a few large
+    batches, so a big line later on still fits in one of them rather than
+    finding every batch too small.
+    """
+
+    def score(self, available: np.ndarray, qty: int) -> np.ndarray:
+        return -available
+
+
+POLICIES = {
+    "earliest_eta": EarliestEta,
+    "best_fit": BestFit,
+    "fewest_splits": FewestSplits,
+}  # type: Dict[str, Type[AllocationPolicy]]
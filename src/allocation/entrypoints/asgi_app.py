@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from quart import request, Quart, jsonify
+from allocation import bootstrap, metrics
+from allocation.adapters.view_cache import cached_view
+from allocation.domain import commands
+from allocation.service_layer import messagebus, unit_of_work, views
+from allocation.domain import model
+from allocation.service_layer import handlers
+
+app = Quart(__name__)
+# both set by start_bus, before the app serves any request
+uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+bus: messagebus.AsyncMessageBus
+
+
+@app.before_serving
+async def start_bus():
+    global bus, uow
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork()
+    bus = bootstrap.async_bootstrap(uow=uow)
+
+
+@app.route("/allocate", methods=["POST"])
+async def allocate_endpoint():
+    data = await request.get_json()
+    try:
+        cmd = commands.Allocate(data["orderid"], data["sku"], data["qty"])
+        results = await bus.handle(cmd)
+        batch_ref = results.pop(0)
+    except (model.OutOfStock, handlers.InvalidSku) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({"batch_ref": batch_ref}), 201
+
+
+@app.route("/allocate/bulk", methods=["POST"])
+async def allocate_bulk_endpoint():
+    data = await request.get_json()
+    lines = [
+        commands.Allocate(line["orderid"], line["sku"], line["qty"])
+        for line in data
+    ]
+    try:
+        results = await bus.handle(commands.AllocateMany(lines))
+        batch_refs = results.pop(0)
+    except (model.OutOfStock, handlers.InvalidSku) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify([
+        {"orderid": line.order_id, "sku": line.sku, "batch_ref": batch_ref}
+        for line, batch_ref in zip(lines, batch_refs)
+    ]), 201
+
+
+@app.route("/allocate/order", methods=["POST"])
+async def allocate_order_endpoint():
+    data = await request.get_json()
+    cmd = commands.AllocateOrder(
+        data["orderid"],
+        [(line["sku"], line["qty"]) for line in data["lines"]],
+    )
+    try:
+        results = await bus.handle(cmd)
+        batch_refs = results.pop(0)
+    except (model.OutOfStock, handlers.InvalidSku, handlers.InvalidOrder) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify([
+        {"sku": sku, "batch_ref": batch_ref}
+        for (sku, _), batch_ref in zip(cmd.lines, batch_refs)
+    ]), 201
+
+
+@app.route("/add_batch", methods=["POST"])
+async def add_batch():
+    data = await request.get_json()
+    eta = data["eta"]
+    if eta is not None:
+        eta = datetime.fromisoformat(eta).date()
+    cmd = commands.CreateBatch(data["ref"], data["sku"], data["qty"], eta)
+    await bus.handle(cmd)
+    return "OK", 201
+
+
+@app.route("/allocations/<orderid>", methods=["GET"])
+async def allocations_view_endpoint(orderid):
+    result = await views.allocations_async(orderid, uow)
+    if not result:
+        return "not found", 404
+    # no server-side cache here, the async bus has nothing to invalidate it,
+    # but a poll whose ETag still matches gets a 304 without the body
+    response = jsonify(result)
+    response.set_etag(cached_view(result).etag)
+    return await response.make_conditional(request)
+
+
+@app.route("/availability/<sku>", methods=["GET"])
+async def availability_endpoint(sku):
+    by = request.args.get("by")
+    if by is not None:
+        try:
+            by_date = datetime.fromisoformat(by).date()
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        available = await views.available_by_async(sku, by_date, uow)
+        return jsonify({"sku": sku, "by": by_date.isoformat(), "available": available}), 200
+    schedule = await views.availability_async(sku, uow)
+    if not schedule:
+        return "not found", 404
+    return jsonify([
+        {"eta": row["eta"] and row["eta"].isoformat(), "available": row["available"]}
+        for row in schedule
+    ]), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return jsonify(metrics.snapshot()), 200
@@ -0,0 +1,52 @@
+"""
+Adds batches._allocated_quantity to a database created before the column
+existed and fills it in from the allocations. The column defaults to 0, so
+until this has run every batch reads as unallocated.
+
+Run it before deploying the code that reads the column, with the writers
+stopped: allocations committed by the old code after the backfill would
+not be counted. It recomputes every batch, so running it again is safe.
+
+    python -m allocation.entrypoints.backfill_allocated_quantity
+"""
+import logging
+
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from allocation import config
+from allocation.adapters import orm
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(engine) -> int:
+    """Sets each batch's allocated quantity to the sum of its allocated lines."""
+    allocated = (
+        select(func.coalesce(func.sum(orm.order_lines.c.qty), 0))
+        .select_from(orm.allocations)
+        .join(orm.order_lines, orm.order_lines.c.id == orm.allocations.c.orderline_id)
+        .where(orm.allocations.c.batch_id == orm.batches.c.id)
+        .scalar_subquery()
+    )
+    with engine.begin() as conn:
+        columns = {column["name"] for column in inspect(conn).get_columns(orm.batches.name)}
+        if "_allocated_quantity" not in columns:
+            conn.execute(text(
+                f"ALTER TABLE {orm.batches.name} "
+                "ADD COLUMN _allocated_quantity INTEGER NOT NULL DEFAULT 0"
+            ))
+        return conn.execute(orm.batches.update().values(_allocated_quantity=allocated)).rowcount
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    engine = create_engine(config.get_postgres_uri())
+    try:
+        batches = backfill(engine)
+    finally:
+        engine.dispose()
+    logger.info("backfilled _allocated_quantity for %s batches", batches)
+
+
+if __name__ == "__main__":
+    main()
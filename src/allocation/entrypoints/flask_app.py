@@ -1,20 +1,65 @@
+import atexit
 from datetime import datetime
+from typing import Optional
 
 from flask import request, Flask, jsonify
-from allocation import bootstrap
-from allocation.domain import commands
-from allocation.service_layer import views
+from allocation import bootstrap, config, metrics
+from allocation.adapters import concurrency
+from allocation.adapters.in_memory_store import InMemoryStore
+from allocation.adapters.product_cache import ProductCache
+from allocation.adapters.view_cache import ViewCache
+from allocation.domain import commands, policies
+from allocation.entrypoints import outbox_relay
+from allocation.service_layer import unit_of_work, views
+from allocation.service_layer.projector import AllocationsProjector
 from allocation.domain import model
 from allocation.service_layer import handlers
 
 app = Flask(__name__)
-bus = bootstrap.bootstarp()
+product_cache_size = config.get_product_cache_size()
+view_cache = ViewCache(config.get_allocations_cache_size(), config.get_allocations_cache_ttl())
+projector = AllocationsProjector(
+    unit_of_work.SqlAlchemyUnitOfWork(),
+    max_batch=config.get_projector_max_batch(),
+    max_delay=config.get_projector_max_delay(),
+    view_cache=view_cache,
+    max_pending=config.get_projector_max_pending(),
+)
+# registered before bootstrap's, so it runs after the event workers have stopped
+atexit.register(projector.shutdown)
+store = None  # type: Optional[InMemoryStore]
+if config.get_unit_of_work() == "in_memory":
+    store = InMemoryStore.open(**config.get_in_memory_store_settings())
+    atexit.register(store.close)
+    # only this process can read the store, so it relays the store's outbox too
+    outbox_relay.relay_store_in_background(store)
+    uow = unit_of_work.InMemoryUnitOfWork(
+        store,
+        conflict_attempts=config.get_conflict_attempts(),
+        policy=policies.POLICIES[config.get_allocation_policy()](),
+    )  # type: unit_of_work.AbstractUnitOfWork
+else:
+    uow = unit_of_work.SqlAlchemyUnitOfWork(
+        product_cache=ProductCache(product_cache_size) if product_cache_size else None,
+        concurrency=concurrency.STRATEGIES[config.get_concurrency_strategy()](),
+        conflict_attempts=config.get_conflict_attempts(),
+        policy=policies.POLICIES[config.get_allocation_policy()](),
+    )
+bus = bootstrap.bootstarp(
+    uow=uow,
+    group_commit_window=config.get_group_commit_window(),
+    background_workers=config.get_background_event_workers(),
+    projector=projector,
+)
+# queries go through their own, possibly replica, engine
+read_uow = unit_of_work.ReadOnlyUnitOfWork()
 
 
 @app.route("/allocate", methods=["POST"])
 def allocate_endpoint():
+    data = request.get_json()
     try:
-        cmd = commands.Allocate(request.json["orderid"], request.json["sku"], request.json["qty"])
+        cmd = commands.Allocate(data["orderid"], data["sku"], data["qty"])
         results = bus.handle(cmd)
         batch_ref = results.pop(0)
     except (model.OutOfStock, handlers.InvalidSku) as e:
@@ -23,19 +68,89 @@ def allocate_endpoint():
     return jsonify({"batch_ref": batch_ref}), 201
 
 
+@app.route("/allocate/bulk", methods=["POST"])
+def allocate_bulk_endpoint():
+    lines = [
+        commands.Allocate(line["orderid"], line["sku"], line["qty"])
+        for line in request.get_json()
+    ]
+    try:
+        results = bus.handle(commands.AllocateMany(lines))
+        batch_refs = results.pop(0)
+    except (model.OutOfStock, handlers.InvalidSku) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify([
+        {"orderid": line.order_id, "sku": line.sku, "batch_ref": batch_ref}
+        for line, batch_ref in zip(lines, batch_refs)
+    ]), 201
+
+
+@app.route("/allocate/order", methods=["POST"])
+def allocate_order_endpoint():
+    data = request.get_json()
+    cmd = commands.AllocateOrder(
+        data["orderid"],
+        [(line["sku"], line["qty"]) for line in data["lines"]],
+    )
+    try:
+        results = bus.handle(cmd)
+        batch_refs = results.pop(0)
+    except (model.OutOfStock, handlers.InvalidSku, handlers.InvalidOrder) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify([
+        {"sku": sku, "batch_ref": batch_ref}
+        for (sku, _), batch_ref in zip(cmd.lines, batch_refs)
+    ]), 201
+
+
 @app.route("/add_batch", methods=["POST"])
 def add_batch():
-    eta = request.json["eta"]
+    data = request.get_json()
+    eta = data["eta"]
     if eta is not None:
         eta = datetime.fromisoformat(eta).date()
-    cmd = commands.CreateBatch(request.json["ref"], request.json["sku"], request.json["qty"], eta)
+    cmd = commands.CreateBatch(data["ref"], data["sku"], data["qty"], eta)
     bus.handle(cmd)
     return "OK", 201
 
 
 @app.route("/allocations/<orderid>", methods=["GET"])
 def allocations_view_endpoint(orderid):
-    result  = views.allocations(orderid, bus.uow)
-    if not result:
+    view = views.cached_allocations(orderid, read_uow, view_cache)
+    if not view.value:
+        return "not found", 404
+    response = jsonify(view.value)
+    response.set_etag(view.etag)
+    response.last_modified = view.last_modified
+    # a poll whose ETag still matches gets a 304 without touching the database
+    return response.make_conditional(request)
+
+
+@app.route("/availability/<sku>", methods=["GET"])
+def availability_endpoint(sku):
+    by = request.args.get("by")
+    if by is not None:
+        try:
+            by_date = datetime.fromisoformat(by).date()
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if store is not None:
+            available = store.available_by(sku, by_date)
+        else:
+            available = views.available_by(sku, by_date, read_uow)
+        return jsonify({"sku": sku, "by": by_date.isoformat(), "available": available}), 200
+    # the in-memory engine keeps no availability index, its store answers instead
+    schedule = store.availability(sku) if store is not None else views.availability(sku, read_uow)
+    if not schedule:
         return "not found", 404
-    return jsonify(result), 200
\ No newline at end of file
+    return jsonify([
+        {"eta": row["eta"] and row["eta"].isoformat(), "available": row["available"]}
+        for row in schedule
+    ]), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return jsonify(metrics.snapshot()), 200
@@ -0,0 +1,51 @@
+import logging
+import threading
+import time
+
+from allocation import config
+from allocation.adapters import outbox, redis_eventpublisher
+from allocation.adapters.in_memory_store import InMemoryStore
+from allocation.service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    batch_size = config.get_outbox_batch_size()
+    poll_interval = config.get_outbox_poll_interval()
+    while True:
+        relayed = outbox.relay(
+            unit_of_work.DEFAULT_SESSION_FACTORY,
+            redis_eventpublisher.publish_many,
+            batch_size=batch_size,
+        )
+        if relayed < batch_size:
+            time.sleep(poll_interval)
+
+
+def relay_store_in_background(store: InMemoryStore) -> threading.Thread:
+    """
+    The relay for an in-memory engine, whose outbox lives in its store and
+    so can only be relayed by the process that owns it.
+    """
+    batch_size = config.get_outbox_batch_size()
+    poll_interval = config.get_outbox_poll_interval()
+
+    def run():
+        while True:
+            try:
+                relayed = store.relay(redis_eventpublisher.publish_many, batch_size=batch_size)
+            except Exception:
+                # the rows stay in the outbox and are published on a later pass
+                logger.exception("Failed to relay the in-memory outbox")
+                relayed = 0
+            if relayed < batch_size:
+                time.sleep(poll_interval)
+
+    thread = threading.Thread(target=run, name="in-memory-outbox-relay", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    main()
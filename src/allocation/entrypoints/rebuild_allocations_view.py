@@ -0,0 +1,313 @@
+"""
+Rebuilds allocations_view from the write model without replaying traffic.
+
+The allocations are streamed with server-side cursors, split into sku
+ranges across a pool of worker processes, into a shadow table that is
+swapped in for the live view in a single transaction. On Postgres every
+worker reads the one snapshot exported when the rebuild starts.
+
+The projector keeps running meanwhile: a trigger on the live view records
+each change it makes, and the recorded changes are replayed onto the
+shadow in the transaction that swaps it in.
+
+    python -m allocation.entrypoints.rebuild_allocations_view --workers 8
+"""
+import argparse
+import logging
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, Integer, MetaData, String, Table, create_engine, delete, func, select, text, tuple_,
+)
+
+from allocation import config
+from allocation.adapters import orm
+
+logger = logging.getLogger(__name__)
+
+SHADOW = "allocations_view_shadow"
+RETIRED = "allocations_view_old"
+CHANGES = "allocations_view_changes"
+CAPTURE = "allocations_view_capture"
+
+# a trigger per dialect that copies every row inserted into or deleted from
+# the live view into the changes table, in order
+CAPTURE_DDL = {
+    "postgresql": [
+        f"""
+        CREATE OR REPLACE FUNCTION {CAPTURE}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO {CHANGES} (op, orderid, sku, batchref)
+                VALUES ('insert', NEW.orderid, NEW.sku, NEW.batchref);
+            ELSE
+                INSERT INTO {CHANGES} (op, orderid, sku, batchref)
+                VALUES ('delete', OLD.orderid, OLD.sku, OLD.batchref);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE TRIGGER {CAPTURE} AFTER INSERT OR DELETE ON {orm.allocations_view.name}
+        FOR EACH ROW EXECUTE FUNCTION {CAPTURE}()
+        """,
+    ],
+    "sqlite": [
+        f"""
+        CREATE TRIGGER {CAPTURE}_insert AFTER INSERT ON {orm.allocations_view.name}
+        BEGIN
+            INSERT INTO {CHANGES} (op, orderid, sku, batchref)
+            VALUES ('insert', NEW.orderid, NEW.sku, NEW.batchref);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {CAPTURE}_delete AFTER DELETE ON {orm.allocations_view.name}
+        BEGIN
+            INSERT INTO {CHANGES} (op, orderid, sku, batchref)
+            VALUES ('delete', OLD.orderid, OLD.sku, OLD.batchref);
+        END
+        """,
+    ],
+}
+
+DROP_CAPTURE_DDL = {
+    "postgresql": [
+        f"DROP TRIGGER IF EXISTS {CAPTURE} ON {orm.allocations_view.name}",
+        f"DROP FUNCTION IF EXISTS {CAPTURE}()",
+    ],
+    "sqlite": [
+        f"DROP TRIGGER IF EXISTS {CAPTURE}_insert",
+        f"DROP TRIGGER IF EXISTS {CAPTURE}_delete",
+    ],
+}
+
+SkuRange = Tuple[Optional[str], Optional[str]]
+
+
+@dataclass
+class RebuildStats:
+    rows: int
+    seconds: float
+    replayed: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def shadow_table():
+    return orm.allocations_view.to_metadata(MetaData(), name=SHADOW)
+
+
+def changes_table():
+    return Table(
+        CHANGES,
+        MetaData(),
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("op", String(6), nullable=False),
+        Column("orderid", String(255)),
+        Column("sku", String(255)),
+        Column("batchref", String(255)),
+    )
+
+
+def start_capture(engine):
+    """From here on every change to the live view is also kept in the changes table."""
+    changes = changes_table()
+    changes.drop(engine, checkfirst=True)
+    changes.create(engine)
+    # the trigger waits for writers already in flight, so every change
+    # committed after it is in place is captured
+    with engine.begin() as conn:
+        for statement in CAPTURE_DDL[engine.dialect.name]:
+            conn.execute(text(statement))
+
+
+def stop_capture(conn):
+    for statement in DROP_CAPTURE_DDL[conn.dialect.name]:
+        conn.execute(text(statement))
+    changes_table().drop(conn, checkfirst=True)
+
+
+def replay_changes(conn, chunk_size: int) -> int:
+    """Applies the captured changes to the shadow table, in the order they were made."""
+    shadow, changes = shadow_table(), changes_table()
+    result = conn.execute(
+        select(changes.c.op, changes.c.orderid, changes.c.sku, changes.c.batchref)
+        .order_by(changes.c.id)
+    )
+    replayed = 0
+    for chunk in result.partitions(chunk_size):
+        for op, rows in _runs(chunk):
+            conn.execute(
+                delete(shadow).where(
+                    tuple_(shadow.c.orderid, shadow.c.sku).in_(
+                        [(row["orderid"], row["sku"]) for row in rows]
+                    )
+                )
+            )
+            if op == "insert":
+                conn.execute(shadow.insert(), rows)
+            replayed += len(rows)
+    return replayed
+
+
+def _runs(chunk) -> List[Tuple[str, List[dict]]]:
+    # consecutive changes of one kind become one statement
+    runs = []  # type: List[Tuple[str, List[dict]]]
+    for op, orderid, sku, batchref in chunk:
+        row = dict(orderid=orderid, sku=sku, batchref=batchref)
+        if runs and runs[-1][0] == op:
+            runs[-1][1].append(row)
+        else:
+            runs.append((op, [row]))
+    return runs
+
+
+def sku_ranges(engine, parts: int) -> List[SkuRange]:
+    """Splits the skus into at most `parts` contiguous ranges of similar size."""
+    with engine.connect() as conn:
+        skus = conn.execute(select(func.count()).select_from(orm.products)).scalar()
+        step = -(-skus // parts) if skus else 1
+        bounds = [
+            conn.execute(
+                select(orm.products.c.sku).order_by(orm.products.c.sku).offset(offset).limit(1)
+            ).scalar()
+            for offset in range(step, skus, step)
+        ]
+    starts = [None] + bounds
+    ends = bounds + [None]
+    return list(zip(starts, ends))
+
+
+def copy_range(uri: str, sku_range: SkuRange, chunk_size: int, snapshot: Optional[str] = None) -> int:
+    """Streams one sku range into the shadow table; runs in a worker process."""
+    engine = create_engine(uri)
+    shadow = shadow_table()
+    low, high = sku_range
+    query = (
+        select(orm.order_lines.c.orderId, orm.order_lines.c.sku, orm.batches.c.reference)
+        .select_from(orm.allocations)
+        .join(orm.order_lines, orm.order_lines.c.id == orm.allocations.c.orderline_id)
+        .join(orm.batches, orm.batches.c.id == orm.allocations.c.batch_id)
+    )
+    if low is not None:
+        query = query.where(orm.batches.c.sku >= low)
+    if high is not None:
+        query = query.where(orm.batches.c.sku < high)
+
+    rows = 0
+    try:
+        # the reader is closed before the writer commits
+        with engine.begin() as writer, engine.connect() as reader:
+            if snapshot is not None:
+                # every worker reads the write model as of the same moment
+                reader = reader.execution_options(isolation_level="REPEATABLE READ")
+                reader.begin()
+                reader.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+            # a server-side cursor, so memory holds one chunk at a time
+            result = reader.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+            for chunk in result.partitions():
+                writer.execute(
+                    shadow.insert(),
+                    [dict(orderid=orderid, sku=sku, batchref=batchref) for orderid, sku, batchref in chunk],
+                )
+                rows += len(chunk)
+    finally:
+        engine.dispose()
+    return rows
+
+
+def swap_in_shadow(engine, chunk_size: int = 10_000) -> int:
+    """Replays the captured changes onto the shadow and swaps it in; returns the changes replayed."""
+    # Postgres DDL is transactional, so readers see either the old view or
+    # the new one, never neither
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # readers carry on, the projector waits for the new view
+            conn.execute(text(f"LOCK TABLE {orm.allocations_view.name} IN EXCLUSIVE MODE"))
+        replayed = replay_changes(conn, chunk_size)
+        stop_capture(conn)
+        conn.execute(text(f"ALTER TABLE {orm.allocations_view.name} RENAME TO {RETIRED}"))
+        conn.execute(text(f"ALTER TABLE {SHADOW} RENAME TO {orm.allocations_view.name}"))
+        conn.execute(text(f"DROP TABLE {RETIRED}"))
+    return replayed
+
+
+def rebuild(
+        uri: str,
+        workers: int = 4,
+        parts: Optional[int] = None,
+        chunk_size: int = 10_000,
+) -> RebuildStats:
+    # several ranges per worker, so one large sku doesn't hold up the rest
+    parts = parts or workers * 4
+    engine = create_engine(uri)
+    shadow = shadow_table()
+    started = time.perf_counter()
+    try:
+        shadow.drop(engine, checkfirst=True)
+        shadow.create(engine)
+        # capture starts before the snapshot, so no change falls between them
+        start_capture(engine)
+        with exported_snapshot(engine) as snapshot:
+            ranges = sku_ranges(engine, parts)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rows = sum(pool.map(
+                    copy_range,
+                    [uri] * len(ranges),
+                    ranges,
+                    [chunk_size] * len(ranges),
+                    [snapshot] * len(ranges),
+                ))
+        replayed = swap_in_shadow(engine, chunk_size)
+    except Exception:
+        with engine.begin() as conn:
+            stop_capture(conn)
+        shadow.drop(engine, checkfirst=True)
+        raise
+    finally:
+        engine.dispose()
+    return RebuildStats(rows=rows, seconds=time.perf_counter() - started, replayed=replayed)
+
+
+@contextmanager
+def exported_snapshot(engine) -> Iterator[Optional[str]]:
+    """
+    On Postgres, the id of a snapshot the workers can share, kept valid by
+    holding its transaction open until they are done. Elsewhere None, and
+    each worker reads as of its own start.
+    """
+    if engine.dialect.name != "postgresql":
+        yield None
+        return
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            yield conn.execute(text("SELECT pg_export_snapshot()")).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild allocations_view from the write model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--parts", type=int, default=None, help="sku ranges, 4 per worker by default")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stats = rebuild(
+        config.get_postgres_uri(), workers=args.workers, parts=args.parts, chunk_size=args.chunk_size,
+    )
+    logger.info(
+        "rebuilt allocations_view: %s rows in %.1fs (%.0f rows/s), %s changes replayed",
+        stats.rows, stats.seconds, stats.rows_per_second, stats.replayed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Fills availability_view, the available-to-promise index, from the batches.
+The index is only adjusted as batches change, so a database that had
+batches before the index existed starts with it empty: run this once when
+deploying the version that keeps it. It also repairs an index that has
+drifted, the whole of it or, with --sku, a single sku.
+
+Allocations committed while it runs whose events are still waiting to be
+handled are counted once here and once more when handled, so run the full
+rebuild with the writers stopped. Running it again is safe.
+
+    python -m allocation.entrypoints.rebuild_availability [--sku SKU]
+"""
+import argparse
+import logging
+from typing import Optional
+
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.availability import AvailabilityIndex
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(session_factory=unit_of_work.DEFAULT_SESSION_FACTORY, sku: Optional[str] = None):
+    AvailabilityIndex(unit_of_work.SqlAlchemyUnitOfWork(session_factory)).rebuild(sku)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild availability_view from the batches")
+    parser.add_argument("--sku", default=None, help="rebuild only this sku")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rebuild(sku=args.sku)
+    logger.info("rebuilt availability_view%s", f" for {args.sku}" if args.sku else "")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,65 @@
 import json
 import logging
+import time
+from typing import Dict, Iterable, List, Tuple
 
 import redis
-from allocation.bootstrap import bootstarp
+from allocation import bootstrap
 
 from allocation import config
 from allocation.domain import commands
 
 logger = logging.getLogger(__name__)
 
-r = redis.Redis(**config.get_redis_host_and_port())
-
 
 def main():
-    bus = bootstarp.bootstarp()
+    r = redis.Redis(**config.get_redis_host_and_port())
+    bus = bootstrap.bootstarp()
     pubsub = r.pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe("change_batch_quantity")
 
-    for m in pubsub.listen():
-        hand_change_batch_quantity(m, bus)
+    while True:
+        messages = read_micro_batch(pubsub)
+        if messages:
+            handle_change_batch_quantities(messages, bus)
+
+
+def read_micro_batch(pubsub, max_size: int = 500, window: float = 0.05) -> list:
+    first = pubsub.get_message(timeout=1.0)
+    if first is None:
+        return []
+    messages = [first]
+    deadline = time.monotonic() + window
+    while len(messages) < max_size and time.monotonic() < deadline:
+        m = pubsub.get_message(timeout=max(deadline - time.monotonic(), 0))
+        if m is not None:
+            messages.append(m)
+    return messages
+
+
+def coalesce_change_batch_quantity(
+        messages: Iterable[dict],
+) -> Tuple[List[commands.ChangeBatchQuantity], int]:
+    """
+    Keeps only the latest quantity per batchref, since each update replaces
+    the previous one. Returns the remaining commands, in the order of each
+    batch's last update, and how many messages were skipped.
+    """
+    latest = {}  # type: Dict[str, int]
+    received = 0
+    for data in messages:
+        received += 1
+        latest.pop(data["batchref"], None)
+        latest[data["batchref"]] = int(data["qty"])
+    cmds = [commands.ChangeBatchQuantity(ref=ref, qty=qty) for ref, qty in latest.items()]
+    return cmds, received - len(cmds)
+
 
+def handle_change_batch_quantities(messages, bus) -> int:
+    cmds, skipped = coalesce_change_batch_quantity(json.loads(m["data"]) for m in messages)
+    if skipped:
+        logger.info("skipped %s superseded change_batch_quantity messages", skipped)
+    for cmd in cmds:
+        bus.handle(cmd)
+    return skipped
 
-def hand_change_batch_quantity(m, bus):
-    logger.debug("handling %s", m)
-    data = json.load(m["data"])
-    cmd = commands.ChangeBatchQuantity(ref=data["batchref"], qty=data["qty"])
-    bus.handle(cmd)
-    
\ No newline at end of file
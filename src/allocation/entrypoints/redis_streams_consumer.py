@@ -0,0 +1,154 @@
+import logging
+import multiprocessing
+import zlib
+from collections import defaultdict
+from typing import Optional
+
+import redis
+
+from allocation import bootstrap, config
+from allocation.entrypoints.redis_eventconsumer import coalesce_change_batch_quantity
+
+logger = logging.getLogger(__name__)
+
+STREAM = "change_batch_quantity"
+GROUP = "allocation"
+
+
+def partition_for(batchref: str, partitions: int) -> int:
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(batchref.encode()) % partitions
+
+
+def stream_for(partition: int) -> str:
+    return f"{STREAM}:{partition}"
+
+
+def dead_letter_for(stream: str) -> str:
+    return f"{stream}:dead"
+
+
+def add_change_batch_quantity(r: redis.Redis, batchref: str, qty: int, partitions: int):
+    """Producer side: every update for a batch goes to that batch's partition."""
+    r.xadd(stream_for(partition_for(batchref, partitions)), {"batchref": batchref, "qty": qty})
+
+
+def main():
+    partitions = config.get_stream_partitions()
+    workers = [
+        multiprocessing.Process(target=run_partition, args=(partition,), name=f"{STREAM}-{partition}")
+        for partition in range(partitions)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_partition(partition: int):
+    # the bus and redis client are created in the worker, after the fork
+    r = redis.Redis(**config.get_redis_host_and_port(), decode_responses=True)
+    bus = bootstrap.bootstarp()
+    consume(
+        r,
+        bus,
+        partition,
+        max_deliveries=config.get_stream_max_deliveries(),
+        claim_idle_ms=config.get_stream_claim_idle_ms(),
+    )
+
+
+def ensure_group(r: redis.Redis, stream: str):
+    try:
+        r.xgroup_create(stream, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def consume(
+        r: redis.Redis,
+        bus,
+        partition: int,
+        batch_size: int = 100,
+        block_ms: int = 1000,
+        max_batches: Optional[int] = None,
+        max_deliveries: int = 5,
+        claim_idle_ms: int = 10000,
+) -> int:
+    """
+    Handles the partition's stream batch by batch. Messages left pending,
+    by a failed command or a worker that died, are claimed again once they
+    have waited claim_idle_ms, so a brief outage doesn't use up their
+    deliveries within milliseconds; until then new messages go first.
+    """
+    stream = stream_for(partition)
+    consumer = f"worker-{partition}"
+    ensure_group(r, stream)
+    batches = 0
+    skipped = 0
+    while max_batches is None or batches < max_batches:
+        _, messages, _ = r.xautoclaim(
+            stream, GROUP, consumer, min_idle_time=claim_idle_ms, start_id="0-0", count=batch_size,
+        )
+        if not messages:
+            response = r.xreadgroup(GROUP, consumer, {stream: ">"}, count=batch_size, block=block_ms)
+            messages = response[0][1] if response else []
+        if messages:
+            batch_skipped, _ = handle_batch(r, bus, stream, messages, max_deliveries)
+            skipped += batch_skipped
+        batches += 1
+    return skipped
+
+
+def handle_batch(r: redis.Redis, bus, stream: str, messages, max_deliveries: int = 5):
+    """
+    Handles a batch and acknowledges what was handled. A command that fails
+    is logged and its messages left pending to be redelivered, until they
+    have been delivered max_deliveries times: then they are moved to the
+    dead-letter stream, so one poison message can't hold up the partition.
+    Returns the number of superseded messages skipped and of commands failed.
+    """
+    ids_by_ref = defaultdict(list)
+    for message_id, data in messages:
+        ids_by_ref[data["batchref"]].append(message_id)
+    cmds, skipped = coalesce_change_batch_quantity(data for _, data in messages)
+    if skipped:
+        logger.info("skipped %s superseded messages on %s", skipped, stream)
+
+    handled = []
+    failed = 0
+    for cmd in cmds:
+        logger.debug("handling %s", cmd)
+        try:
+            bus.handle(cmd)
+        except Exception:
+            logger.exception("Exception handling %s from %s", cmd, stream)
+            failed += 1
+            ids = ids_by_ref[cmd.ref]
+            deliveries = delivery_count(r, stream, ids[-1])
+            if deliveries >= max_deliveries:
+                logger.error(
+                    "dead-lettering %s after %s deliveries", ids, deliveries,
+                )
+                dead_letter(r, stream, [m for m in messages if m[0] in ids])
+                handled.extend(ids)
+        else:
+            handled.extend(ids_by_ref[cmd.ref])
+    if handled:
+        r.xack(stream, GROUP, *handled)
+    return skipped, failed
+
+
+def delivery_count(r: redis.Redis, stream: str, message_id: str) -> int:
+    [pending] = r.xpending_range(stream, GROUP, min=message_id, max=message_id, count=1)
+    return pending["times_delivered"]
+
+
+def dead_letter(r: redis.Redis, stream: str, messages):
+    for message_id, data in messages:
+        r.xadd(dead_letter_for(stream), dict(data, message_id=message_id))
+
+
+if __name__ == "__main__":
+    main()
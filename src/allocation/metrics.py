@@ -0,0 +1,60 @@
+import threading
+from typing import Any, Callable, Dict
+
+
+class Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            total=self.total,
+            max=self.max,
+            mean=self.total / self.count if self.count else 0.0,
+        )
+
+
+_lock = threading.Lock()
+_counters = {}  # type: Dict[str, int]
+_summaries = {}  # type: Dict[str, Summary]
+_gauges = {}  # type: Dict[str, Callable[[], float]]
+
+
+def incr(name: str, by: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + by
+
+
+def observe(name: str, value: float):
+    with _lock:
+        _summaries.setdefault(name, Summary()).observe(value)
+
+
+def gauge(name: str, read: Callable[[], float]):
+    """Registers a gauge that is read when a snapshot is taken."""
+    with _lock:
+        _gauges[name] = read
+
+
+def snapshot() -> dict:
+    with _lock:
+        values = dict(_counters)  # type: Dict[str, Any]
+        values.update((name, summary.as_dict()) for name, summary in _summaries.items())
+        gauges = dict(_gauges)
+    values.update((name, read()) for name, read in gauges.items())
+    return values
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
+        _gauges.clear()
@@ -0,0 +1,226 @@
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from allocation.adapters import notifications
+from allocation.domain import model, events, commands
+from allocation.domain.model import OrderLine
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.availability import AbstractAsyncAvailabilityIndex
+from allocation.service_layer.handlers import InvalidSku, check_order_lines, independent
+
+
+async def add_batch(
+        command: commands.CreateBatch,
+        uow: unit_of_work.AbstractAsyncUnitOfWork
+):
+    async with uow:
+        product = await uow.products.get(sku=command.sku)
+        if product is None:
+            product = model.Product(command.sku, batches=[])
+            uow.products.add(product)
+        product.add_batch(model.Batch(command.ref, command.sku, command.qty, command.eta))
+        await uow.commit()
+
+
+async def allocate(
+        command: commands.Allocate,
+        uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> Optional[str]:
+    line = OrderLine(command.order_id, command.sku, command.qty)
+    async with uow:
+        product = await uow.products.get(sku=line.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {line.sku}")
+        batch_ref = product.allocate(line)
+        await uow.commit()
+        return batch_ref
+
+
+async def allocate_many(
+        command: commands.AllocateMany,
+        uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> List[Optional[str]]:
+    async with uow:
+        products = {}
+        for sku in dict.fromkeys(line.sku for line in command.lines):
+            product = await uow.products.get(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+            products[sku] = product
+        batch_refs = [
+            products[line.sku].allocate(OrderLine(line.order_id, line.sku, line.qty))
+            for line in command.lines
+        ]
+        await uow.commit()
+        return batch_refs
+
+
+async def allocate_order(
+        command: commands.AllocateOrder,
+        uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> List[str]:
+    check_order_lines(command)
+    lines = [OrderLine(command.order_id, sku, qty) for sku, qty in command.lines]
+    async with uow:
+        products = {}
+        for sku in dict.fromkeys(line.sku for line in lines):
+            product = await uow.products.get(sku=sku)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+            products[sku] = product
+        batch_refs = model.allocate_order(command.order_id, lines, products)
+        await uow.commit()
+        return batch_refs
+
+
+async def change_batch_quantity(
+        command: commands.ChangeBatchQuantity,
+        uow: unit_of_work.AbstractAsyncUnitOfWork,
+):
+    async with uow:
+        product = await uow.products.get_by_batch_ref(batch_ref=command.ref)
+        product.change_batch_quantity(ref=command.ref, qty=command.qty)
+        await uow.commit()
+
+
+async def deallocate(
+        command: commands.Deallocate,
+        uow: unit_of_work.AbstractAsyncUnitOfWork
+) -> None:
+    async with uow:
+        product = await uow.products.get(sku=command.sku)
+        if product is None:
+            raise InvalidSku(f"Invalid sku {command.sku}")
+        product.deallocate(command.ref, OrderLine(command.order_id, command.sku, command.qty))
+        await uow.commit()
+
+
+async def send_out_of_stock_notification(
+        event: events.OutOfStock,
+        notifications: notifications.AbstractAsyncNotifications,
+):
+    await notifications.send(
+        "stock@made.com",
+        f"Out of stock for {event.sku}",
+    )
+
+
+@independent
+async def add_allocations_to_read_model(
+    event: events.Allocated,
+    uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        await uow.session.execute(
+            text(
+                """
+                INSERT INTO allocations_view (orderid, sku, batchref)
+                values (:orderid, :sku, :batchref)
+                """
+            ),
+            dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref)
+        )
+        await uow.commit()
+
+
+async def add_order_allocations_to_read_model(
+    event: events.OrderAllocated,
+    uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        await uow.session.execute(
+            text(
+                """
+                INSERT INTO allocations_view (orderid, sku, batchref)
+                values (:orderid, :sku, :batchref)
+                """
+            ),
+            [
+                dict(orderid=allocated.orderid, sku=allocated.sku, batchref=allocated.batchref)
+                for allocated in event.allocations
+            ]
+        )
+        await uow.commit()
+
+
+async def remove_allocation_from_read_model(
+    event: events.Deallocated,
+    uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        await uow.session.execute(
+            text(
+                """
+                DELETE FROM allocations_view
+                WHERE orderid = :orderid AND sku = :sku
+                """
+            ),
+            dict(orderid=event.orderid, sku=event.sku)
+        )
+        await uow.commit()
+
+
+
+async def add_batch_to_availability(
+    event: events.BatchCreated,
+    availability: AbstractAsyncAvailabilityIndex,
+):
+    await availability.adjust(event.sku, event.eta, event.qty)
+
+
+async def change_batch_availability(
+    event: events.BatchQuantityChanged,
+    availability: AbstractAsyncAvailabilityIndex,
+):
+    await availability.adjust(event.sku, event.eta, event.delta)
+
+
+async def remove_allocation_from_availability(
+    event: events.Allocated,
+    availability: AbstractAsyncAvailabilityIndex,
+):
+    await availability.adjust_batch(event.batchref, -event.qty)
+
+
+async def remove_order_allocations_from_availability(
+    event: events.OrderAllocated,
+    availability: AbstractAsyncAvailabilityIndex,
+):
+    for allocated in event.allocations:
+        await availability.adjust_batch(allocated.batchref, -allocated.qty)
+
+
+async def return_deallocation_to_availability(
+    event: events.Deallocated,
+    availability: AbstractAsyncAvailabilityIndex,
+):
+    await availability.adjust_batch(event.batchref, event.qty)
+
+
+COMMAND_HANDLERS = {
+    commands.Allocate: allocate,
+    commands.AllocateMany: allocate_many,
+    commands.AllocateOrder: allocate_order,
+    commands.CreateBatch: add_batch,
+    commands.Deallocate: deallocate,
+    commands.ChangeBatchQuantity: change_batch_quantity,
+}
+
+EVENT_HANDLERS = {
+    events.OutOfStock: [send_out_of_stock_notification],
+    events.Allocated: [
+        add_allocations_to_read_model,
+        remove_allocation_from_availability,
+    ],
+    events.OrderAllocated: [
+        add_order_allocations_to_read_model,
+        remove_order_allocations_from_availability,
+    ],
+    events.Deallocated: [
+        remove_allocation_from_read_model,
+        return_deallocation_to_availability,
+    ],
+    events.BatchCreated: [add_batch_to_availability],
+    events.BatchQuantityChanged: [change_batch_availability],
+}
@@ -0,0 +1,204 @@
+import abc
+import copy
+import logging
+import threading
+from datetime import date
+from itertools import groupby
+from typing import Dict, Optional, Set
+
+from sqlalchemy import delete, func, insert, select, update
+
+from allocation.adapters import orm
+from allocation.service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+# batches in the warehouse have no eta, they can ship before any shipment arrives
+WAREHOUSE = date.min
+
+
+class AbstractAvailabilityIndex(abc.ABC):
+    @abc.abstractmethod
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def adjust_batch(self, batchref: str, delta: int):
+        raise NotImplementedError
+
+
+class AvailabilityIndex(AbstractAvailabilityIndex):
+    """
+    Keeps availability_view, the available-to-promise index: one row per
+    sku and eta holding the quantity that can ship by that eta, summed over
+    every batch arriving on or before it. A change to a batch is added to
+    the row for its eta and to every later row of the sku, so answering
+    "how much can ship by date D" reads a single row: the latest eta up to D.
+
+    Every call runs on a copy of the uow, so skus are adjusted concurrently;
+    one sku's adjustments take its lock, and rows are changed by atomic
+    increments, so other processes may adjust them too. An adjustment that
+    fails rebuilds its sku from the batches instead, and a sku whose rebuild
+    fails as well is rebuilt on its next adjustment, so nothing dropped
+    leaves the index off for good.
+    """
+
+    def __init__(self, uow: unit_of_work.SqlAlchemyUnitOfWork):
+        self.uow = uow
+        self._locks = {}  # type: Dict[str, threading.Lock]
+        self._locks_lock = threading.Lock()
+        self._stale = set()  # type: Set[str]
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        with self._lock_for(sku):
+            if sku not in self._stale:
+                try:
+                    with copy.copy(self.uow) as uow:
+                        _adjust(uow.session, sku, eta or WAREHOUSE, delta)
+                        uow.commit()
+                    return
+                except Exception:
+                    logger.exception("Failed to adjust availability of %s, rebuilding it", sku)
+                    self._stale.add(sku)
+            # raises if it fails too, and the sku stays stale
+            self._rebuild(sku)
+            self._stale.discard(sku)
+
+    def adjust_batch(self, batchref: str, delta: int):
+        """Adjusts by batch reference, for events that don't carry the eta."""
+        with copy.copy(self.uow) as uow:
+            row = uow.session.execute(_batch_sku_and_eta(batchref)).first()
+        if row is not None:
+            self.adjust(row.sku, row.eta, delta)
+
+    def rebuild(self, sku: Optional[str] = None):
+        """
+        Recomputes the index, or the rows of one sku, from the batches, e.g.
+        to fill it the first time.
+        """
+        if sku is None:
+            self._rebuild(None)
+            return
+        with self._lock_for(sku):
+            self._rebuild(sku)
+            self._stale.discard(sku)
+
+    def _lock_for(self, sku: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(sku, threading.Lock())
+
+    def _rebuild(self, sku: Optional[str]):
+        batches, view = orm.batches, orm.availability_view
+        totals_query = select(
+            batches.c.sku,
+            batches.c.eta,
+            func.sum(batches.c._purchased_quantity - batches.c._allocated_quantity),
+        ).group_by(batches.c.sku, batches.c.eta)
+        clear = delete(view)
+        if sku is not None:
+            totals_query = totals_query.where(batches.c.sku == sku)
+            clear = clear.where(view.c.sku == sku)
+        with copy.copy(self.uow) as uow:
+            totals = uow.session.execute(totals_query).all()
+            rows = []
+            by_sku = sorted(((sku, eta or WAREHOUSE, qty) for sku, eta, qty in totals))
+            for sku_of_rows, group in groupby(by_sku, key=lambda row: row[0]):
+                available = 0
+                for _, eta, qty in group:
+                    available += qty
+                    rows.append(dict(sku=sku_of_rows, eta=eta, available=available))
+            uow.session.execute(clear)
+            if rows:
+                uow.session.execute(insert(view), rows)
+            uow.commit()
+
+
+class StoreAvailability(AbstractAvailabilityIndex):
+    """
+    Availability of products held by an InMemoryStore, which works it out
+    from the batches it holds, so there is no index to keep up to date and
+    no database to reach on the write path.
+    """
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        pass
+
+    def adjust_batch(self, batchref: str, delta: int):
+        pass
+
+
+class AbstractAsyncAvailabilityIndex(abc.ABC):
+    @abc.abstractmethod
+    async def adjust(self, sku: str, eta: Optional[date], delta: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def adjust_batch(self, batchref: str, delta: int):
+        raise NotImplementedError
+
+
+class AsyncAvailabilityIndex(AbstractAsyncAvailabilityIndex):
+    """AvailabilityIndex for the async bus, through the async unit of work."""
+
+    def __init__(self, uow: unit_of_work.AsyncSqlAlchemyUnitOfWork):
+        # the async uow keeps its session per task, so it can be shared
+        self.uow = uow
+
+    async def adjust(self, sku: str, eta: Optional[date], delta: int):
+        async with self.uow:
+            await self._adjust(sku, eta or WAREHOUSE, delta)
+            await self.uow.commit()
+
+    async def adjust_batch(self, batchref: str, delta: int):
+        async with self.uow:
+            row = (await self.uow.session.execute(_batch_sku_and_eta(batchref))).first()
+            if row is not None:
+                await self._adjust(row.sku, row.eta or WAREHOUSE, delta)
+                await self.uow.commit()
+
+    async def _adjust(self, sku: str, eta: date, delta: int):
+        session = self.uow.session
+        if (await session.execute(_row(sku, eta))).first() is None:
+            earlier = (await session.execute(_available_before(sku, eta))).scalar_one_or_none()
+            await session.execute(_insert_row(sku, eta, earlier or 0))
+        await session.execute(_add_from(sku, eta, delta))
+
+
+def _adjust(session, sku: str, eta: date, delta: int):
+    if session.execute(_row(sku, eta)).first() is None:
+        # a new eta starts from what could already ship by the one before it
+        earlier = session.execute(_available_before(sku, eta)).scalar_one_or_none()
+        session.execute(_insert_row(sku, eta, earlier or 0))
+    session.execute(_add_from(sku, eta, delta))
+
+
+def _batch_sku_and_eta(batchref: str):
+    return select(orm.batches.c.sku, orm.batches.c.eta).where(orm.batches.c.reference == batchref)
+
+
+def _row(sku: str, eta: date):
+    view = orm.availability_view
+    return select(view.c.available).where(view.c.sku == sku, view.c.eta == eta)
+
+
+def _available_before(sku: str, eta: date):
+    view = orm.availability_view
+    return (
+        select(view.c.available)
+            .where(view.c.sku == sku, view.c.eta < eta)
+            .order_by(view.c.eta.desc())
+            .limit(1)
+    )
+
+
+def _insert_row(sku: str, eta: date, available: int):
+    return insert(orm.availability_view).values(sku=sku, eta=eta, available=available)
+
+
+def _add_from(sku: str, eta: date, delta: int):
+    view = orm.availability_view
+    return (
+        update(view)
+            .where(view.c.sku == sku, view.c.eta >= eta)
+            .values(available=view.c.available + delta)
+    )
@@ -0,0 +1,121 @@
+import logging
+import os
+import queue
+import threading
+import zlib
+from typing import List, Optional, Sequence, TYPE_CHECKING
+
+from allocation.domain import events
+
+if TYPE_CHECKING:
+    from allocation.service_layer.messagebus import MessageBus
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundEventDispatcher:
+    """
+    Handles events off the request path on a pool of worker threads, each
+    owning its own bus. Events are partitioned by sku, so every event for a
+    sku goes to the same worker and is handled in the order it was raised.
+    An OrderAllocated spanning several skus is split into one per sku.
+
+    The workers start on first use in each process, like the engines of
+    ProcessLocalSessionFactory: a prefork server that builds the dispatcher
+    before forking would otherwise leave its workers without threads.
+    """
+
+    def __init__(self, worker_buses: Sequence["MessageBus"]):
+        self.worker_buses = worker_buses
+        self._queues = []  # type: List[queue.Queue]
+        self._threads = []  # type: List[threading.Thread]
+        self._pid = None  # type: Optional[int]
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def dispatch(self, event: events.Event):
+        if self._stopped:
+            raise RuntimeError("dispatcher has been shut down")
+        queues = self._queues_for_process()
+        for part in _per_sku(event):
+            queues[self._partition(part)].put(part)
+
+    def join(self):
+        """Blocks until every event dispatched so far has been handled."""
+        if self._pid != os.getpid():
+            return
+        for events_queue in self._queues:
+            events_queue.join()
+
+    def shutdown(self):
+        """
+        Stops accepting events, drains the queues and stops the workers. Only
+        the process that started them has workers to stop.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        if self._pid != os.getpid():
+            return
+        for events_queue in self._queues:
+            events_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _queues_for_process(self) -> List[queue.Queue]:
+        queues = self._queues
+        if self._pid != os.getpid():
+            with self._lock:
+                queues = self._queues
+                if self._pid != os.getpid():
+                    queues = [queue.Queue() for _ in self.worker_buses]
+                    self._threads = [
+                        threading.Thread(
+                            target=self._work,
+                            args=(bus, events_queue),
+                            name=f"event-dispatcher-{i}",
+                            daemon=True,
+                        )
+                        for i, (bus, events_queue) in enumerate(zip(self.worker_buses, queues))
+                    ]
+                    for thread in self._threads:
+                        thread.start()
+                    self._queues = queues
+                    self._pid = os.getpid()
+        return queues
+
+    def _partition(self, event: events.Event) -> int:
+        key = _sku_of(event) or type(event).__name__
+        return zlib.crc32(key.encode()) % len(self._queues)
+
+    @staticmethod
+    def _work(bus: "MessageBus", events_queue: queue.Queue):
+        while True:
+            event = events_queue.get()
+            try:
+                if event is _STOP:
+                    return
+                bus.handle(event)
+            except Exception:
+                logger.exception("Exception handling event %s in the background", event)
+            finally:
+                events_queue.task_done()
+
+
+def _per_sku(event: events.Event) -> List[events.Event]:
+    if not isinstance(event, events.OrderAllocated):
+        return [event]
+    skus = dict.fromkeys(allocated.sku for allocated in event.allocations)
+    return [
+        events.OrderAllocated(event.orderid, [a for a in event.allocations if a.sku == sku])
+        for sku in skus
+    ]
+
+
+def _sku_of(event: events.Event) -> Optional[str]:
+    if isinstance(event, events.OrderAllocated):
+        return event.allocations[0].sku if event.allocations else None
+    return getattr(event, "sku", None)
@@ -0,0 +1,74 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from allocation.domain import commands
+
+logger = logging.getLogger(__name__)
+
+
+class _Group:
+    def __init__(self):
+        self.members = []  # type: List[Tuple[commands.Allocate, Future]]
+        self.full = threading.Event()
+
+
+class GroupCommitAllocator:
+    """
+    Coalesces Allocate commands for the same sku that arrive within `window`
+    seconds. The first caller becomes the group's leader: it waits for the
+    window to close, applies the whole group as one AllocateMany (one product
+    load, one commit) and hands every caller its own batch ref.
+
+    Leaders of different skus run at the same time, so allocate_many must be
+    safe to call concurrently: bootstrap gives every group a bus and unit of
+    work of its own.
+    """
+
+    def __init__(
+            self,
+            allocate_many: Callable[[commands.AllocateMany], List[Optional[str]]],
+            window: float = 0.005,
+            max_group_size: int = 100,
+    ):
+        self.allocate_many = allocate_many
+        self.window = window
+        self.max_group_size = max_group_size
+        self._lock = threading.Lock()
+        self._groups = {}  # type: Dict[str, _Group]
+
+    def __call__(self, command: commands.Allocate) -> Optional[str]:
+        future = Future()  # type: Future
+        with self._lock:
+            existing = self._groups.get(command.sku)
+            is_leader = existing is None
+            group = _Group() if existing is None else existing
+            if is_leader:
+                self._groups[command.sku] = group
+            group.members.append((command, future))
+            if len(group.members) >= self.max_group_size:
+                # later arrivals start a new group
+                del self._groups[command.sku]
+                group.full.set()
+
+        if is_leader:
+            self._lead(command.sku, group)
+        return future.result()
+
+    def _lead(self, sku: str, group: _Group):
+        group.full.wait(self.window)
+        with self._lock:
+            if self._groups.get(sku) is group:
+                del self._groups[sku]
+
+        lines = [command for command, _ in group.members]
+        logger.debug("committing %s allocations for sku %s as one group", len(lines), sku)
+        try:
+            batch_refs = self.allocate_many(commands.AllocateMany(lines))
+        except Exception as e:
+            for _, future in group.members:
+                future.set_exception(e)
+        else:
+            for (_, future), batch_ref in zip(group.members, batch_refs):
+                future.set_result(batch_ref)
@@ -1,10 +1,12 @@
-from typing import TYPE_CHECKING
-from allocation.adapters import notifications
+from typing import Callable, Dict, List, Optional, Type, TYPE_CHECKING
+
+from allocation.adapters import notifications, repository
 
-from allocation.adapters import redis_eventpublisher
 from allocation.domain import model, events, commands
 from allocation.domain.model import OrderLine
 from allocation.service_layer import unit_of_work
+from allocation.service_layer.availability import AbstractAvailabilityIndex
+from allocation.service_layer.projector import AbstractProjector
 
 if TYPE_CHECKING:
     from . import unit_of_work
@@ -14,6 +16,32 @@ class InvalidSku(Exception):
     pass
 
 
+class InvalidOrder(Exception):
+    pass
+
+
+def independent(handler):
+    """
+    Marks an event handler as not depending on the other handlers for the
+    same event, so the bus may run it concurrently with them. bootstrap
+    gives each independent handler a unit of work of its own.
+    """
+    handler.independent = True
+    return handler
+
+
+def check_order_lines(command: commands.AllocateOrder):
+    """An order needs at least one line, and one line per sku."""
+    if not command.lines:
+        raise InvalidOrder(f"Order {command.order_id} has no lines")
+    skus = [sku for sku, _ in command.lines]
+    duplicates = sorted({sku for sku in skus if skus.count(sku) > 1})
+    if duplicates:
+        raise InvalidOrder(
+            f"Order {command.order_id} has more than one line for {', '.join(duplicates)}"
+        )
+
+
 def is_valid_sku(sku, batches):
     return sku in {b.sku for b in batches}
 
@@ -27,31 +55,68 @@ def add_batch(
         if product is None:
             product = model.Product(command.sku, batches=[])
             uow.products.add(product)
-        product.batches.append(model.Batch(command.ref, command.sku, command.qty, command.eta))
+        product.add_batch(model.Batch(command.ref, command.sku, command.qty, command.eta))
         uow.commit()
 
 
 def allocate(
         command: commands.Allocate,
         uow: unit_of_work.AbstractUnitOfWork
-) -> str:
+) -> Optional[str]:
     line = OrderLine(command.order_id, command.sku, command.qty)
     with uow:
-        product = uow.products.get(sku=line.sku)
+        product = uow.products.get(sku=line.sku, loading=repository.COUNTS)
         if product is None:
             raise InvalidSku(f"Invalid sku {line.sku}")
         batch_ref = product.allocate(line)
         uow.commit()
         return batch_ref
+
+
+def allocate_many(
+        command: commands.AllocateMany,
+        uow: unit_of_work.AbstractUnitOfWork
+) -> List[Optional[str]]:
+    with uow:
+        products = {}
+        for sku in dict.fromkeys(line.sku for line in command.lines):
+            product = uow.products.get(sku=sku, loading=repository.COUNTS)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+            products[sku] = product
+        batch_refs = [
+            products[line.sku].allocate(OrderLine(line.order_id, line.sku, line.qty))
+            for line in command.lines
+        ]
+        uow.commit()
+        return batch_refs
     
 
+def allocate_order(
+        command: commands.AllocateOrder,
+        uow: unit_of_work.AbstractUnitOfWork
+) -> List[str]:
+    check_order_lines(command)
+    lines = [OrderLine(command.order_id, sku, qty) for sku, qty in command.lines]
+    with uow:
+        products = {}
+        for sku in dict.fromkeys(line.sku for line in lines):
+            product = uow.products.get(sku=sku, loading=repository.COUNTS)
+            if product is None:
+                raise InvalidSku(f"Invalid sku {sku}")
+            products[sku] = product
+        batch_refs = model.allocate_order(command.order_id, lines, products)
+        uow.commit()
+        return batch_refs
+
+
 def reallocate(
         cmd: commands.Allocate,
         uow: unit_of_work.AbstractUnitOfWork,
 ):
     line = OrderLine(cmd.order_id, cmd.sku, cmd.qty)
     with uow:
-        product = uow.products.get(sku=line.sku)
+        product = uow.products.get(sku=line.sku, loading=repository.COUNTS)
         if product is None:
             raise InvalidSku(f"Invalid sku {line.sku}")
         product.allocate(line)
@@ -63,7 +128,7 @@ def change_batch_quantity(
         uow: unit_of_work.AbstractUnitOfWork,
 ):
     with uow:
-        product = uow.products.get_by_batch_ref(batch_ref=command.ref)
+        product = uow.products.get_by_batch_ref(batch_ref=command.ref, loading=repository.COUNTS)
         product.change_batch_quantity(ref=command.ref, qty=command.qty)
         uow.commit()
 
@@ -89,57 +154,88 @@ def deallocate(
         uow.commit()
         
 
-def publish_allocated_event(
-        event: events.Allocated,
-        uow: unit_of_work.AbstractUnitOfWork,
+@independent
+def add_allocations_to_read_model(
+    event: events.Allocated,
+    projector: AbstractProjector,
 ):
-    redis_eventpublisher.publish("line_allocated", event)
+    projector.insert(event.orderid, event.sku, event.batchref)
 
 
-def add_allocations_to_read_model(
-    event: events.Allocated,
-    uow: unit_of_work.SqlAlchemyUnitOfWork
+def add_order_allocations_to_read_model(
+    event: events.OrderAllocated,
+    projector: AbstractProjector,
 ):
-    with uow:
-        uow.session.execute(
-            """
-            INSERT INTO allocations_view (orderid, sku, batchref)
-            values (:orderid, :sku, :batchref)
-            """,
-            dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref)
-        )
-        uow.commit()
+    for allocated in event.allocations:
+        projector.insert(allocated.orderid, allocated.sku, allocated.batchref)
 
 
 def remove_allocation_from_read_model(
     event: events.Deallocated,
-    uow: unit_of_work.SqlAlchemyUnitOfWork
+    projector: AbstractProjector,
 ):
-    with uow:
-        uow.session.execute(
-            """
-            DELETE FROM allocations_view
-            WHERE orderid = :orderid AND sku = :sku
-            """,
-            dict(orderid=event.orderid, sku=event.sku)
-        )
-        uow.commit()
+    projector.delete(event.orderid, event.sku)
+
+
+def add_batch_to_availability(
+    event: events.BatchCreated,
+    availability: AbstractAvailabilityIndex,
+):
+    availability.adjust(event.sku, event.eta, event.qty)
+
+
+def change_batch_availability(
+    event: events.BatchQuantityChanged,
+    availability: AbstractAvailabilityIndex,
+):
+    availability.adjust(event.sku, event.eta, event.delta)
+
+
+def remove_allocation_from_availability(
+    event: events.Allocated,
+    availability: AbstractAvailabilityIndex,
+):
+    availability.adjust_batch(event.batchref, -event.qty)
+
+
+def remove_order_allocations_from_availability(
+    event: events.OrderAllocated,
+    availability: AbstractAvailabilityIndex,
+):
+    for allocated in event.allocations:
+        availability.adjust_batch(allocated.batchref, -allocated.qty)
+
+
+def return_deallocation_to_availability(
+    event: events.Deallocated,
+    availability: AbstractAvailabilityIndex,
+):
+    availability.adjust_batch(event.batchref, event.qty)
 
 
 COMMAND_HANDLERS = {
     commands.Allocate: allocate,
+    commands.AllocateMany: allocate_many,
+    commands.AllocateOrder: allocate_order,
     commands.CreateBatch: add_batch,
     commands.Deallocate: deallocate,
     commands.ChangeBatchQuantity: change_batch_quantity,
-}
+}  # type: Dict[Type[commands.Command], Callable]
 
 EVENT_HANDLERS = {
     events.OutOfStock: [send_out_of_stock_notification],
     events.Allocated: [
-        publish_allocated_event,
-        add_allocations_to_read_model
+        add_allocations_to_read_model,
+        remove_allocation_from_availability,
+    ],
+    events.OrderAllocated: [
+        add_order_allocations_to_read_model,
+        remove_order_allocations_from_availability,
     ],
     events.Deallocated: [
-        remove_allocation_from_read_model
-    ]
+        remove_allocation_from_read_model,
+        return_deallocation_to_availability,
+    ],
+    events.BatchCreated: [add_batch_to_availability],
+    events.BatchQuantityChanged: [change_batch_availability],
 }
\ No newline at end of file
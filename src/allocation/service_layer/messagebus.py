@@ -1,7 +1,10 @@
+import asyncio
+import inspect
 import logging
-from typing import Callable, Dict, Type, Union, List, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Type, Union, List, Tuple, TYPE_CHECKING
 
-from tenacity import Retrying, stop_after_attempt, wait_exponential, RetryError
+from tenacity import AsyncRetrying, Retrying, stop_after_attempt, wait_exponential, RetryError
 
 from allocation.domain import events, commands
 from allocation.service_layer import unit_of_work
@@ -9,6 +12,7 @@ from . import handlers
 
 if TYPE_CHECKING:
     from . import unit_of_work
+    from .dispatcher import BackgroundEventDispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -20,51 +24,163 @@ class MessageBus:
             self,
             uow: unit_of_work.AbstractUnitOfWork,
             event_handlers: Dict[Type[events.Event], List[Callable]],
-            command_handlers: Dict[Type[commands.Command], List[Callable]],
+            command_handlers: Dict[Type[commands.Command], Callable],
+            max_workers: int = 4,
+            dispatcher: Optional["BackgroundEventDispatcher"] = None,
     ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        # threads are only started once an independent handler is submitted
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.dispatcher = dispatcher
 
     def handle(self, message: Message):
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
+        results = []
+        # local to the call, so callers on other threads keep their own messages
+        queue = [message]
+        while queue:
+            message = queue.pop(0)
+            if isinstance(message, events.Event) and self.dispatcher is not None:
+                self.dispatcher.dispatch(message)
+            elif isinstance(message, events.Event):
+                self.handle_event(message, queue)
+            elif isinstance(message, commands.Command):
+                cmd_result = self.handle_command(message, queue)
+                results.append(cmd_result)
+            else:
+                raise Exception(f"{message} was not an Event of Command")
+        return results
+
+
+    def handle_event(self, event: events.Event, queue: List[Message]):
+        sequential, independent = _split_independent(self.event_handlers[type(event)])
+        # independent handlers run on the pool while the others run in turn here
+        futures = [
+            self.executor.submit(self._run_event_handler, handler, event)
+            for handler in independent
+        ]
+        for handler in sequential:
+            queue.extend(self._run_event_handler(handler, event))
+        for future in futures:
+            queue.extend(future.result())
+
+    def _run_event_handler(self, handler: Callable, event: events.Event) -> List[Message]:
+        # an independent handler brings the unit of work it was given, the
+        # bus's one is not thread-safe
+        uow = getattr(handler, "uow", self.uow)
+        try:
+            for attempt in Retrying(
+                stop=stop_after_attempt(3),
+                wait=wait_exponential()
+            ):
+                with attempt:
+                    logger.debug("handling event %s with handler %s", event, handler)
+                    handler(event)
+                    return list(uow.collect_new_events())
+        except RetryError as retry_failure:
+            logger.exception(
+                "Failed top handle event %s times, giving up!",
+                retry_failure.last_attempt.attempt_number
+            )
+        return []
+
+
+    def handle_command(self, command: commands.Command, queue: List[Message]):
+        logger.debug("handling command %s", command)
+        try:
+            handler = self.command_handlers[type(command)]
+            # a handler that lost a write conflict is re-run from scratch,
+            # with a fresh unit of work and a fresh copy of the product
+            for attempt in self.uow.retrying():
+                with attempt:
+                    result = handler(command)
+            queue.extend(self.uow.collect_new_events())
+            return result
+        except Exception:
+            logger.exception("Exception handling command %s", command)
+            raise
+
+
+class AsyncMessageBus:
+    """
+    Same message flow as MessageBus, but handlers may be `async def`:
+    their results are awaited, while plain handlers are still called directly.
+    """
+
+    def __init__(
+            self,
+            uow: unit_of_work.AbstractAsyncUnitOfWork,
+            event_handlers: Dict[Type[events.Event], List[Callable]],
+            command_handlers: Dict[Type[commands.Command], Callable],
+    ):
+        self.uow = uow
+        self.event_handlers = event_handlers
+        self.command_handlers = command_handlers
+
+    async def handle(self, message: Message):
+        results = []
+        queue = [message]
+        while queue:
+            message = queue.pop(0)
             if isinstance(message, events.Event):
-                self.handle_event(message)
+                await self.handle_event(message, queue)
             elif isinstance(message, commands.Command):
-                cmd_result = self.handle_command(message)
+                cmd_result = await self.handle_command(message, queue)
+                results.append(cmd_result)
             else:
                 raise Exception(f"{message} was not an Event of Command")
+        return results
 
+    async def handle_event(self, event: events.Event, queue: List[Message]):
+        sequential, independent = _split_independent(self.event_handlers[type(event)])
+        for handler in sequential:
+            queue.extend(await self._run_event_handler(handler, event))
+        for new_messages in await asyncio.gather(*(
+            self._run_event_handler(handler, event) for handler in independent
+        )):
+            queue.extend(new_messages)
+
+    async def _run_event_handler(self, handler: Callable, event: events.Event) -> List[Message]:
+        # independent handlers run in their own tasks, so each one collects
+        # the events it produced before handing back to the caller's task
+        try:
+            async for attempt in AsyncRetrying(
+                stop=stop_after_attempt(3),
+                wait=wait_exponential()
+            ):
+                with attempt:
+                    logger.debug("handling event %s with handler %s", event, handler)
+                    await _call(handler, event)
+                    return list(self.uow.collect_new_events())
+        except RetryError as retry_failure:
+            logger.exception(
+                "Failed top handle event %s times, giving up!",
+                retry_failure.last_attempt.attempt_number
+            )
+        return []
 
-    def handle_event(self, event: events.Event):
-        for handler in self.event_handlers[type(event)]:
-            try:
-                for attempt in Retrying(
-                    stop=stop_after_attempt(3),
-                    wait=wait_exponential()
-                ):
-                    with attempt:
-                        logger.debug("handling event %s with handler %s", event, handler)
-                        handler(event)
-                        self.queue.extend(self.uow.collect_new_events())
-            except RetryError as retry_failure:
-                logger.exception(
-                    "Failed top handle event %s times, giving up!",
-                    retry_failure.last_attempt.attempt_number
-                )
-                continue
-
-
-    def handle_command(self, command: commands.Command):
+    async def handle_command(self, command: commands.Command, queue: List[Message]):
         logger.debug("handling command %s", command)
         try:
             handler = self.command_handlers[type(command)]
-            handler(command)
-            self.queue.extend(self.uow.collect_new_events())
+            result = await _call(handler, command)
+            queue.extend(self.uow.collect_new_events())
+            return result
         except Exception:
             logger.exception("Exception handling command %s", command)
             raise
 
 
+async def _call(handler: Callable, message: Message):
+    result = handler(message)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def _split_independent(handlers: List[Callable]) -> Tuple[List[Callable], List[Callable]]:
+    sequential = [h for h in handlers if not getattr(h, "independent", False)]
+    independent = [h for h in handlers if getattr(h, "independent", False)]
+    return sequential, independent
+
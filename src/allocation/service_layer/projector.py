@@ -0,0 +1,214 @@
+import abc
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, tuple_
+
+from allocation import metrics
+from allocation.adapters import orm
+from allocation.adapters.view_cache import ViewCache
+from allocation.service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+INSERT = "insert"
+DELETE = "delete"
+
+Change = Tuple[str, dict]
+
+
+class AbstractProjector(abc.ABC):
+    @abc.abstractmethod
+    def insert(self, orderid: str, sku: str, batchref: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, orderid: str, sku: str):
+        raise NotImplementedError
+
+
+class AllocationsProjector(AbstractProjector):
+    """
+    Applies changes to allocations_view in batches. Changes are buffered in
+    the order they arrive and written as multi-row INSERTs and DELETEs in one
+    transaction, once max_batch changes are waiting or the oldest has waited
+    max_delay seconds. With max_delay=0 every change is written straight
+    away, on the caller's thread.
+
+    Writes are idempotent: an insert replaces any row for the same order
+    line, so a change may safely be written twice. Written straight away, a
+    failed change is raised to the caller, whose handler the bus retries. In
+    the background a failed flush keeps its changes and is retried, and
+    shutdown() flushes whatever is left. At most max_pending changes wait;
+    callers beyond that block until a flush makes room.
+
+    Waiting changes are held only in memory, so a crash loses the ones not
+    yet flushed: in steady state about max_delay seconds' worth, at most
+    max_pending. The write model keeps them, and
+    allocation.entrypoints.rebuild_allocations_view restores the view.
+
+    The flush thread starts on first use in each process, like the engines
+    of ProcessLocalSessionFactory, so a prefork server that builds the
+    projector before forking still gets one in every worker.
+    """
+
+    def __init__(
+            self,
+            uow: unit_of_work.SqlAlchemyUnitOfWork,
+            max_batch: int = 500,
+            max_delay: float = 0.0,
+            view_cache: Optional[ViewCache] = None,
+            max_pending: int = 10_000,
+    ):
+        self.uow = uow
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, max_batch)
+        self.view_cache = view_cache
+        self._pending = []  # type: List[Change]
+        self._oldest = None  # type: Optional[float]
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+        self._thread_lock = threading.Lock()
+        metrics.gauge("projector.lag_seconds", self.lag)
+
+    def insert(self, orderid: str, sku: str, batchref: str):
+        self._add((INSERT, dict(orderid=orderid, sku=sku, batchref=batchref)))
+
+    def delete(self, orderid: str, sku: str):
+        self._add((DELETE, dict(orderid=orderid, sku=sku)))
+
+    def lag(self) -> float:
+        """Seconds the oldest change not yet in the view has been waiting."""
+        oldest = self._oldest
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def flush(self):
+        with self._flush_lock:
+            with self._condition:
+                changes, oldest = self._pending, self._oldest
+                self._pending, self._oldest = [], None
+                self._condition.notify_all()
+            if not changes or oldest is None:
+                return
+            try:
+                self._write(changes)
+            except Exception:
+                with self._condition:
+                    # back in front of anything that arrived meanwhile; no
+                    # caller is told, so nothing else will add them again
+                    self._pending[:0] = changes
+                    self._oldest = oldest
+                raise
+            metrics.observe("projector.flush_rows", len(changes))
+            metrics.observe("projector.lag_seconds_at_flush", time.monotonic() - oldest)
+        self._invalidate(changes)
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+
+    def _add(self, change: Change):
+        if not self.max_delay:
+            self._write_through(change)
+            return
+        self._start_for_process()
+        with self._condition:
+            while not self._stopped and len(self._pending) >= self.max_pending:
+                self._condition.wait()
+            if self._stopped:
+                raise RuntimeError("projector has been shut down")
+            self._pending.append(change)
+            if self._oldest is None:
+                # the worker sleeps until there is something to wait for
+                self._oldest = time.monotonic()
+                self._condition.notify_all()
+            elif len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+    def _start_for_process(self):
+        if self._pid != os.getpid():
+            with self._thread_lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(
+                        target=self._work, name="allocations-projector", daemon=True,
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _write_through(self, change: Change):
+        if self._stopped:
+            raise RuntimeError("projector has been shut down")
+        # only the caller's own change, and nothing kept if it fails: the
+        # error goes back to the handler and the bus retries the handler
+        with self._flush_lock:
+            self._write([change])
+            metrics.observe("projector.flush_rows", 1)
+        self._invalidate([change])
+
+    def _invalidate(self, changes: List[Change]):
+        if self.view_cache is not None:
+            for orderid in {change["orderid"] for _, change in changes}:
+                self.view_cache.invalidate(orderid)
+
+    def _write(self, changes: List[Change]):
+        view = orm.allocations_view
+        with self.uow:
+            # consecutive changes of one kind become one statement, and the
+            # runs are applied in order so a delete never overtakes its insert
+            for kind, rows in _runs(changes):
+                # an insert first drops any row for its order line, so a
+                # change written twice still leaves one row
+                self.uow.session.execute(
+                    delete(view).where(
+                        tuple_(view.c.orderid, view.c.sku).in_(
+                            [(row["orderid"], row["sku"]) for row in rows]
+                        )
+                    )
+                )
+                if kind == INSERT:
+                    self.uow.session.execute(view.insert(), rows)
+            self.uow.commit()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._due():
+                    self._condition.wait(self._wait_time())
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush allocations_view changes, will retry")
+                time.sleep(self.max_delay)
+
+    def _due(self) -> bool:
+        return len(self._pending) >= self.max_batch or (
+            self._oldest is not None and self.lag() >= self.max_delay
+        )
+
+    def _wait_time(self) -> Optional[float]:
+        if self._oldest is None:
+            return None
+        return max(self.max_delay - self.lag(), 0)
+
+
+def _runs(changes: List[Change]) -> List[Tuple[str, List[dict]]]:
+    runs = []  # type: List[Tuple[str, List[dict]]]
+    for kind, row in changes:
+        if runs and runs[-1][0] == kind:
+            runs[-1][1].append(row)
+        else:
+            runs.append((kind, [row]))
+    return runs
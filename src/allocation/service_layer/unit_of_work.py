@@ -1,14 +1,28 @@
 import abc
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.pool import QueuePool
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
-from allocation import config
-from allocation.adapters import repository
+from allocation import config, metrics
+from allocation.adapters import orm, outbox, repository
+from allocation.adapters.concurrency import ConcurrencyStrategy, RepeatableRead
+from allocation.adapters.in_memory_store import ConcurrentModification, InMemoryStore
+from allocation.adapters.product_cache import ProductCache
+from allocation.domain.policies import AllocationPolicy
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository
+    conflict_attempts = 1
 
     def __enter__(self):
         return self
@@ -20,10 +34,25 @@ class AbstractUnitOfWork(abc.ABC):
         self._commit()
 
     def collect_new_events(self):
+        # a bus whose commands all ran on other units of work never entered this one
+        if not hasattr(self, "products"):
+            return
         for product in self.products.seen:
             while product.events:
                 yield product.events.pop(0)
 
+    def is_conflict(self, error: BaseException) -> bool:
+        return False
+
+    def retrying(self) -> Retrying:
+        """Attempts of a whole handler, retried while it loses write conflicts."""
+        return Retrying(
+            retry=retry_if_exception(self.is_conflict),
+            stop=stop_after_attempt(self.conflict_attempts),
+            wait=wait_random_exponential(multiplier=0.01, max=0.2),
+            reraise=True,
+        )
+
     @abc.abstractmethod
     def _commit(self):
         raise NotImplementedError
@@ -33,21 +62,133 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_postgres_uri(),
-        isolation_level="REPEATABLE READ"
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a connection."""
+    metrics_name = "db"
+
+    @classmethod
+    def named(cls, metrics_name: str):
+        # a subclass rather than an attribute, so the pools that dispose()
+        # recreates keep reporting under the same name
+        return type(cls.__name__, (cls,), {"metrics_name": metrics_name})
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe(
+                f"{self.metrics_name}.pool.checkout_wait_seconds", time.perf_counter() - started
+            )
+
+
+def make_engine(uri: Optional[str] = None, metrics_name: str = "db", **kwargs):
+    engine_kwargs = dict(isolation_level="REPEATABLE READ", **config.get_db_pool_settings())
+    statement_timeout = config.get_db_statement_timeout_ms()
+    if statement_timeout:
+        engine_kwargs["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    engine_kwargs.update(kwargs)
+    engine = create_engine(
+        uri or config.get_postgres_uri(),
+        poolclass=InstrumentedQueuePool.named(metrics_name),
+        **engine_kwargs
     )
-)
+    metrics.gauge(f"{metrics_name}.pool.size", lambda: _queue_pool(engine).size())
+    metrics.gauge(f"{metrics_name}.pool.checked_out", lambda: _queue_pool(engine).checkedout())
+    metrics.gauge(f"{metrics_name}.pool.overflow", lambda: _queue_pool(engine).overflow())
+    return engine
+
+
+def _queue_pool(engine: Engine) -> QueuePool:
+    # read through engine.pool, which dispose() replaces
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        raise TypeError(f"{engine} has a {type(pool).__name__}, not a QueuePool")
+    return pool
+
+
+def make_read_engine():
+    # views read committed data only, so they need neither REPEATABLE READ
+    # nor a read-write transaction
+    return make_engine(
+        config.get_postgres_read_uri(),
+        metrics_name="db_read",
+        isolation_level="READ COMMITTED",
+        execution_options={"postgresql_readonly": True},
+    )
+
+
+class ProcessLocalSessionFactory:
+    """
+    Creates its engine on first use in each process. A prefork server that
+    imports the app before forking would otherwise hand the parent's pooled
+    connections to every worker.
+    """
+
+    def __init__(self, engine_factory: Callable = make_engine):
+        self.engine_factory = engine_factory
+        self._engine = None  # type: Optional[Engine]
+        self._sessionmaker = None  # type: Optional[sessionmaker]
+        self._pid = None  # type: Optional[int]
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        return self._sessionmaker_for_process().kw["bind"]
+
+    def __call__(self):
+        return self._sessionmaker_for_process()()
+
+    def _sessionmaker_for_process(self) -> sessionmaker:
+        made = self._sessionmaker
+        if made is None or self._pid != os.getpid():
+            with self._lock:
+                made = self._sessionmaker
+                if made is None or self._pid != os.getpid():
+                    if self._engine is not None:
+                        # leaves the parent's connections open for the parent
+                        self._engine.dispose(close=False)
+                    self._engine = self.engine_factory()
+                    made = self._sessionmaker = sessionmaker(bind=self._engine)
+                    self._pid = os.getpid()
+        return made
+
+
+DEFAULT_SESSION_FACTORY = ProcessLocalSessionFactory()
+DEFAULT_READ_SESSION_FACTORY = ProcessLocalSessionFactory(make_read_engine)
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+            self,
+            session_factory=DEFAULT_SESSION_FACTORY,
+            product_cache: Optional[ProductCache] = None,
+            concurrency: Optional[ConcurrencyStrategy] = None,
+            conflict_attempts: int = 3,
+            policy: Optional[AllocationPolicy] = None,
+    ):
         self.session_factory = session_factory
+        self.product_cache = product_cache
+        self.policy = policy
+        # REPEATABLE READ is what DEFAULT_SESSION_FACTORY already uses
+        self.concurrency = concurrency or RepeatableRead(isolation_level=None)
+        self.conflict_attempts = conflict_attempts
 
     def __enter__(self):
         self.session = self.session_factory()
-        self.products = repository.SqlAlchemyRepository(self.session)
+        if self.product_cache is not None:
+            # committed products are cached, so they must stay loaded
+            self.session.expire_on_commit = False
+        if self.concurrency.isolation_level is not None:
+            self.session.connection(
+                execution_options={"isolation_level": self.concurrency.isolation_level}
+            )
+        self.products = repository.SqlAlchemyRepository(
+            self.session,
+            cache=self.product_cache,
+            concurrency=self.concurrency,
+            policy=self.policy,
+        )
         return super().__enter__()
 
     def __exit__(self, *args):
@@ -55,7 +196,183 @@ class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
         self.session.close()
 
     def _commit(self):
+        # events leave through the outbox in the same transaction as the
+        # state change, and the relay publishes them afterwards
+        rows = outbox.rows_for(self.products.seen)
+        if rows:
+            self.session.execute(orm.outbox.insert(), rows)
         self.session.commit()
+        if self.product_cache is not None:
+            for product in self.products.seen:
+                self.product_cache.put(product)
 
     def rollback(self):
         self.session.rollback()
+
+    def is_conflict(self, error: BaseException) -> bool:
+        return self.concurrency.is_conflict(error)
+
+
+class ReadOnlyUnitOfWork:
+    """
+    A session for queries only: no repository, no seen products, no commit.
+    Its engine may point at a read replica.
+    """
+
+    def __init__(self, session_factory=DEFAULT_READ_SESSION_FACTORY):
+        self.session_factory = session_factory
+        # one uow serves every request thread, so the session is kept per
+        # thread and task rather than on the instance
+        self._session = contextvars.ContextVar(
+            f"read-uow-session-{id(self)}", default=None
+        )  # type: contextvars.ContextVar[Optional[Session]]
+
+    @property
+    def session(self):
+        return self._session.get()
+
+    def __enter__(self):
+        self._session.set(self.session_factory())
+        return self
+
+    def __exit__(self, *args):
+        session = self._session.get()
+        self._session.set(None)
+        if session is not None:
+            session.rollback()
+            session.close()
+
+
+class InMemoryUnitOfWork(AbstractUnitOfWork):
+    """
+    Runs handlers against an InMemoryStore instead of the database: products
+    are read as working copies and a commit installs the changed ones and
+    waits for their write-ahead log record to reach the disk.
+    """
+    products: repository.InMemoryRepository
+
+    def __init__(
+            self,
+            store: InMemoryStore,
+            conflict_attempts: int = 3,
+            policy: Optional[AllocationPolicy] = None,
+    ):
+        self.store = store
+        self.conflict_attempts = conflict_attempts
+        self.policy = policy
+
+    def __enter__(self):
+        self.products = repository.InMemoryRepository(self.store, policy=self.policy)
+        return super().__enter__()
+
+    def _commit(self):
+        # the outbox rows go into the same log record as the products
+        self.store.commit(
+            self.products.seen,
+            self.products.read_versions,
+            outbox.rows_for(self.products.seen),
+        )
+        # the store now holds these products, a second commit starts from them
+        self.products.read_versions.update(
+            {product.sku: product.version_number for product in self.products.seen}
+        )
+
+    def rollback(self):
+        # uncommitted working copies are simply dropped
+        pass
+
+    def is_conflict(self, error: BaseException) -> bool:
+        return isinstance(error, ConcurrentModification)
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    products: repository.AbstractAsyncRepository
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+
+    async def commit(self):
+        await self._commit()
+
+    def collect_new_events(self):
+        for product in self.products.seen:
+            while product.events:
+                yield product.events.pop(0)
+
+    @abc.abstractmethod
+    async def _commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+@functools.lru_cache(maxsize=None)
+def default_async_session_factory():
+    # created on first use so the sync entrypoints don't need an asyncio driver
+    statement_timeout = config.get_db_statement_timeout_ms()
+    return async_sessionmaker(
+        bind=create_async_engine(
+            config.get_async_postgres_uri(),
+            isolation_level="REPEATABLE READ",
+            connect_args=(
+                {"server_settings": {"statement_timeout": str(statement_timeout)}}
+                if statement_timeout else {}
+            ),
+            **config.get_db_pool_settings()
+        ),
+        expire_on_commit=False,
+    )
+
+
+class AsyncSqlAlchemyUnitOfWork(AbstractAsyncUnitOfWork):
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or default_async_session_factory()
+        # one uow serves every concurrent request, so the session and
+        # repository are kept per asyncio task rather than on the instance
+        self._state = contextvars.ContextVar(
+            f"uow-state-{id(self)}", default=None
+        )  # type: contextvars.ContextVar[Optional[Tuple[AsyncSession, repository.AsyncSqlAlchemyRepository]]]
+
+    @property
+    def session(self):
+        return self._current()[0]
+
+    # read-only here, the repository belongs to the current task
+    @property
+    def products(self):  # type: ignore[override]
+        return self._current()[1]
+
+    def _current(self) -> Tuple[AsyncSession, repository.AsyncSqlAlchemyRepository]:
+        state = self._state.get()
+        if state is None:
+            raise RuntimeError("the unit of work is used outside async with")
+        return state
+
+    async def __aenter__(self):
+        session = self.session_factory()
+        self._state.set((session, repository.AsyncSqlAlchemyRepository(session)))
+        return await super().__aenter__()
+
+    def collect_new_events(self):
+        if self._state.get() is None:
+            return iter(())
+        return super().collect_new_events()
+
+    async def __aexit__(self, *args):
+        await super().__aexit__()
+        await self.session.close()
+
+    async def _commit(self):
+        rows = outbox.rows_for(self.products.seen)
+        if rows:
+            await self.session.execute(orm.outbox.insert(), rows)
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
+
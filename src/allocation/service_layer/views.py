@@ -1,12 +1,88 @@
+from datetime import date
+from sqlalchemy import select, text
+
+from allocation.adapters import orm
+from allocation.adapters.view_cache import CachedView, ViewCache
 from allocation.service_layer import unit_of_work
+from allocation.service_layer.availability import WAREHOUSE
 
 
-def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork):
+def allocations(orderid: str, uow: unit_of_work.ReadOnlyUnitOfWork):
     with uow:
         results = uow.session.execute(
-            """
-            SELECT sku, batchref FROM allocations.view WHERE orderid = :orderid
-            """,
+            text(
+                """
+                SELECT sku, batchref FROM allocations_view WHERE orderid = :orderid
+                """
+            ),
             dict(orderid=orderid)
         )
-    return [dict(r) for r in results]
\ No newline at end of file
+        return [dict(r._mapping) for r in results]
+
+
+def cached_allocations(
+        orderid: str,
+        uow: unit_of_work.ReadOnlyUnitOfWork,
+        cache: ViewCache,
+) -> CachedView:
+    return cache.get_or_load(orderid, lambda: allocations(orderid, uow))
+
+
+def availability(sku: str, uow: unit_of_work.ReadOnlyUnitOfWork):
+    """What can ship by each eta of the sku; in-stock batches have eta None."""
+    with uow:
+        return [_schedule_row(r) for r in uow.session.execute(_schedule(sku))]
+
+
+def available_by(sku: str, by: date, uow: unit_of_work.ReadOnlyUnitOfWork) -> int:
+    """
+    What can ship by the given date: the row of the latest eta up to it,
+    found by a range scan of the sku's rows on the (sku, eta) primary key.
+    """
+    with uow:
+        available = uow.session.execute(_available_by(sku, by)).scalar_one_or_none()
+    return available or 0
+
+
+async def allocations_async(orderid: str, uow: unit_of_work.AsyncSqlAlchemyUnitOfWork):
+    async with uow:
+        results = await uow.session.execute(
+            text(
+                """
+                SELECT sku, batchref FROM allocations_view WHERE orderid = :orderid
+                """
+            ),
+            dict(orderid=orderid)
+        )
+    return [dict(r._mapping) for r in results]
+
+
+async def availability_async(sku: str, uow: unit_of_work.AsyncSqlAlchemyUnitOfWork):
+    async with uow:
+        results = await uow.session.execute(_schedule(sku))
+        return [_schedule_row(r) for r in results]
+
+
+async def available_by_async(sku: str, by: date, uow: unit_of_work.AsyncSqlAlchemyUnitOfWork) -> int:
+    async with uow:
+        available = (await uow.session.execute(_available_by(sku, by))).scalar_one_or_none()
+    return available or 0
+
+
+def _schedule(sku: str):
+    view = orm.availability_view
+    return select(view.c.eta, view.c.available).where(view.c.sku == sku).order_by(view.c.eta)
+
+
+def _schedule_row(row) -> dict:
+    return dict(eta=None if row.eta == WAREHOUSE else row.eta, available=row.available)
+
+
+def _available_by(sku: str, by: date):
+    view = orm.availability_view
+    return (
+        select(view.c.available)
+            .where(view.c.sku == sku, view.c.eta <= by)
+            .order_by(view.c.eta.desc())
+            .limit(1)
+    )
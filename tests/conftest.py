@@ -2,18 +2,106 @@
 import shutil
 import subprocess
 import time
+from collections import defaultdict
+from datetime import date
 from pathlib import Path
+from typing import DefaultDict, Dict, List, Optional, Tuple
 
 import pytest
 import redis
 import requests
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, clear_mappers
 from tenacity import retry, stop_after_delay
 
 from allocation import config
+from allocation.adapters import notifications
 from allocation.adapters.orm import metadata, start_mappers
+from allocation.adapters.repository import AbstractRepository
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.availability import (
+    AbstractAsyncAvailabilityIndex,
+    AbstractAvailabilityIndex,
+)
+from allocation.service_layer.projector import AbstractProjector
+
+
+class FakeRepository(AbstractRepository):
+    def __init__(self, products):
+        super().__init__()
+        self._products = set(products)
+
+    def _add(self, product):
+        self._products.add(product)
+
+    def _get(self, sku, loading=None):
+        return next((b for b in self._products if b.sku == sku), None)
+
+    def list(self):
+        return list(self._products)
+
+    def _get_by_batch_ref(self, batch_ref, loading=None) -> Optional[model.Product]:
+        return next(
+            (p for p in self._products for b in p.batches if b.reference == batch_ref),
+            None,
+        )
+
+
+class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
+    def __init__(self):
+        self.products = FakeRepository([])
+        self.committed = False
+
+    def _commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+class FakeNotifications(notifications.AbstractNotifications):
+    def __init__(self):
+        self.sent = defaultdict(list)  # type: DefaultDict[str, List[str]]
+
+    def send(self, destination, message):
+        self.sent[destination].append(message)
+
+
+class FakeProjector(AbstractProjector):
+    def __init__(self):
+        self.rows = {}  # type: Dict[Tuple[str, str], str]
+
+    def insert(self, orderid: str, sku: str, batchref: str):
+        self.rows[orderid, sku] = batchref
+
+    def delete(self, orderid: str, sku: str):
+        self.rows.pop((orderid, sku), None)
+
+
+class FakeAvailability(AbstractAvailabilityIndex):
+    def __init__(self):
+        self.adjusted = []  # type: List[Tuple[str, Optional[date], int]]
+        self.by_batch = defaultdict(int)  # type: DefaultDict[str, int]
+
+    def adjust(self, sku: str, eta: Optional[date], delta: int):
+        self.adjusted.append((sku, eta, delta))
+
+    def adjust_batch(self, batchref: str, delta: int):
+        self.by_batch[batchref] += delta
+
+
+class FakeAsyncAvailability(AbstractAsyncAvailabilityIndex):
+    def __init__(self):
+        self.adjusted = []  # type: List[Tuple[str, Optional[date], int]]
+        self.by_batch = defaultdict(int)  # type: DefaultDict[str, int]
+
+    async def adjust(self, sku: str, eta: Optional[date], delta: int):
+        self.adjusted.append((sku, eta, delta))
+
+    async def adjust_batch(self, batchref: str, delta: int):
+        self.by_batch[batchref] += delta
 
 
 @pytest.fixture
@@ -40,6 +128,30 @@ def session(session_factory):
     return session_factory()
 
 
+@pytest.fixture
+def file_session_factory(tmp_path):
+    # a connection per session and per thread, unlike :memory:
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+
+
+@pytest.fixture
+def select_statements(in_memory_db):
+    """Records every SELECT sent to the in-memory database."""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(in_memory_db, "before_cursor_execute", record)
+    yield statements
+    event.remove(in_memory_db, "before_cursor_execute", record)
+
+
 @retry(stop=stop_after_delay(10))
 def wait_for_postgres_to_come_up(engine):
     return engine.connect()
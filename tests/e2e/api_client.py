@@ -24,3 +24,38 @@ def post_to_allocate(order_id, sku, qty, expect_success=True):
     if expect_success:
         assert r.status_code == 201
     return r
+
+
+def post_to_allocate_bulk(lines, expect_success=True):
+    url = config.get_api_url()
+    r = requests.post(
+        f"{url}/allocate/bulk",
+        json=[
+            {"orderid": order_id, "sku": sku, "qty": qty}
+            for order_id, sku, qty in lines
+        ],
+    )
+    if expect_success:
+        assert r.status_code == 201
+    return r
+
+
+def post_to_allocate_order(order_id, lines, expect_success=True):
+    url = config.get_api_url()
+    r = requests.post(
+        f"{url}/allocate/order",
+        json={"orderid": order_id, "lines": [{"sku": sku, "qty": qty} for sku, qty in lines]},
+    )
+    if expect_success:
+        assert r.status_code == 201
+    return r
+
+
+def get_allocation(orderid, headers=None):
+    url = config.get_api_url()
+    return requests.get(f"{url}/allocations/{orderid}", headers=headers)
+
+
+def get_availability(sku, by=None):
+    url = config.get_api_url()
+    return requests.get(f"{url}/availability/{sku}", params={"by": by} if by else None)
@@ -2,6 +2,7 @@ import pytest
 import requests as requests
 
 from allocation import config
+from tests.e2e import api_client
 from tests.random_refs import random_batch_ref, random_sku, random_order_id
 
 
@@ -42,3 +43,66 @@ def test_unhappy_path_returns_400_and_error_message():
     r = requests.post(f"{url}/allocate", json=data)
     assert r.status_code == 400
     assert r.json()["message"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocate_returns_a_batch_ref_per_line():
+    sku, other_sku = random_sku(), random_sku("other")
+    batch, other_batch = random_batch_ref(1), random_batch_ref(2)
+    order1, order2 = random_order_id(1), random_order_id(2)
+    post_to_add_batch(batch, sku, 100, None)
+    post_to_add_batch(other_batch, other_sku, 100, None)
+
+    r = api_client.post_to_allocate_bulk([
+        (order1, sku, 3),
+        (order1, other_sku, 3),
+        (order2, sku, 3),
+    ])
+
+    assert [line["batch_ref"] for line in r.json()] == [batch, other_batch, batch]
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_orders_without_lines_or_with_a_repeated_sku_are_rejected():
+    sku, order = random_sku(), random_order_id()
+    post_to_add_batch(random_batch_ref(), sku, 100, None)
+
+    empty = api_client.post_to_allocate_order(order, [], expect_success=False)
+    repeated = api_client.post_to_allocate_order(order, [(sku, 1), (sku, 2)], expect_success=False)
+
+    assert empty.status_code == 400
+    assert empty.json()["message"] == f"Order {order} has no lines"
+    assert repeated.status_code == 400
+    assert repeated.json()["message"] == f"Order {order} has more than one line for {sku}"
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_repeat_polls_of_an_unchanged_allocation_get_304():
+    sku, batch, order = random_sku(), random_batch_ref(), random_order_id()
+    post_to_add_batch(batch, sku, 100, None)
+    api_client.post_to_allocate(order, sku, 3)
+
+    first = api_client.get_allocation(order)
+    assert first.status_code == 200
+
+    repeat = api_client.get_allocation(order, headers={"If-None-Match": first.headers["ETag"]})
+    assert repeat.status_code == 304
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_availability_by_date():
+    sku, order = random_sku(), random_order_id()
+    post_to_add_batch(random_batch_ref(1), sku, 100, None)
+    post_to_add_batch(random_batch_ref(2), sku, 50, "2011-01-02")
+    api_client.post_to_allocate(order, sku, 30)
+
+    r = api_client.get_availability(sku)
+    assert r.json() == [
+        {"eta": None, "available": 70},
+        {"eta": "2011-01-02", "available": 120},
+    ]
+    assert api_client.get_availability(sku, by="2011-01-01").json()["available"] == 70
@@ -0,0 +1,16 @@
+from allocation.adapters.view_cache import ViewCache
+from allocation.service_layer import unit_of_work, views
+from allocation.service_layer.projector import AllocationsProjector
+
+
+def test_read_model_updates_invalidate_the_cached_allocations(session_factory):
+    cache = ViewCache()
+    read_uow = unit_of_work.ReadOnlyUnitOfWork(session_factory)
+    projector = AllocationsProjector(unit_of_work.SqlAlchemyUnitOfWork(session_factory), view_cache=cache)
+    assert views.cached_allocations("o1", read_uow, cache).value == []
+
+    projector.insert("o1", "sku1", "b1")
+
+    assert views.cached_allocations("o1", read_uow, cache).value == [
+        {"sku": "sku1", "batchref": "b1"},
+    ]
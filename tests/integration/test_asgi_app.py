@@ -0,0 +1,76 @@
+import asyncio
+from datetime import date, timedelta
+from unittest import mock
+
+import pytest
+
+from allocation import bootstrap
+from allocation.entrypoints import asgi_app
+from allocation.service_layer import unit_of_work
+from tests.integration.test_async_uow import async_session_factory  # noqa: F401
+
+tomorrow = date.today() + timedelta(1)
+
+
+@pytest.fixture
+def client(async_session_factory, monkeypatch):
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+    monkeypatch.setattr(asgi_app, "uow", uow, raising=False)
+    monkeypatch.setattr(asgi_app, "bus", bootstrap.async_bootstrap(
+        start_orm=False, uow=uow, notifications=mock.AsyncMock(), publish=mock.AsyncMock(),
+    ), raising=False)
+    return asgi_app.app.test_client()
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def add_batches(client):
+    async def scenario():
+        for ref, qty, eta in (("in-stock", 10, None), ("tomorrow", 30, tomorrow.isoformat())):
+            await client.post("/add_batch", json=dict(ref=ref, sku="OAK-DESK", qty=qty, eta=eta))
+        await client.post("/allocate", json=dict(orderid="o1", sku="OAK-DESK", qty=4))
+    run(scenario)
+
+
+def test_availability_is_served_from_the_index(client):
+    add_batches(client)
+
+    async def scenario():
+        schedule = await client.get("/availability/OAK-DESK")
+        by = await client.get(f"/availability/OAK-DESK?by={tomorrow.isoformat()}")
+        missing = await client.get("/availability/NO-SUCH-SKU")
+        return await schedule.get_json(), await by.get_json(), missing.status_code
+
+    schedule, by, missing = run(scenario)
+    assert schedule == [
+        {"eta": None, "available": 6},
+        {"eta": tomorrow.isoformat(), "available": 36},
+    ]
+    assert by["available"] == 36
+    assert missing == 404
+
+
+def test_allocations_answer_a_matching_etag_with_304(client):
+    add_batches(client)
+
+    async def scenario():
+        first = await client.get("/allocations/o1")
+        again = await client.get("/allocations/o1", headers={"If-None-Match": first.headers["ETag"]})
+        return first.status_code, await first.get_json(), again.status_code
+
+    status, body, again = run(scenario)
+    assert status == 200
+    assert body == [{"sku": "OAK-DESK", "batchref": "in-stock"}]
+    assert again == 304
+
+
+def test_metrics_are_served(client):
+    async def scenario():
+        response = await client.get("/metrics")
+        return response.status_code, await response.get_json()
+
+    status, body = run(scenario)
+    assert status == 200
+    assert isinstance(body, dict)
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import clear_mappers
+
+from allocation.adapters.orm import metadata, start_mappers
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'allocation.db'}")
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+
+    asyncio.run(create_all())
+    start_mappers()
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    clear_mappers()
+
+
+def test_async_uow_can_add_a_product_and_allocate_to_it(async_session_factory):
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+
+    async def scenario():
+        async with uow:
+            uow.products.add(model.Product("ASYNC-TABLE", [model.Batch("b1", "ASYNC-TABLE", 100, None)]))
+            await uow.commit()
+
+        async with uow:
+            product = await uow.products.get("ASYNC-TABLE")
+            batch_ref = product.allocate(model.OrderLine("o1", "ASYNC-TABLE", 10))
+            await uow.commit()
+
+        async with uow:
+            [[allocated]] = await uow.session.execute(
+                text("SELECT count(*) FROM allocations")
+            )
+            product = await uow.products.get_by_batch_ref("b1")
+            return batch_ref, allocated, product.batches[0].available_quantity
+
+    assert asyncio.run(scenario()) == ("b1", 1, 90)
+
+
+def test_async_uow_rolls_back_uncommitted_work(async_session_factory):
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+
+    async def scenario():
+        async with uow:
+            uow.products.add(model.Product("ASYNC-CHAIR", []))
+
+        async with uow:
+            return await uow.products.get("ASYNC-CHAIR")
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,147 @@
+import asyncio
+from datetime import date, timedelta
+from unittest import mock
+
+import pytest
+from sqlalchemy import delete, select
+
+from allocation import bootstrap
+from allocation.adapters import orm
+from allocation.domain import commands
+from allocation.service_layer import availability, unit_of_work, views
+from allocation.service_layer.availability import AvailabilityIndex
+from tests.integration.test_async_uow import async_session_factory  # noqa: F401
+
+today = date.today()
+tomorrow = today + timedelta(1)
+later = today + timedelta(2)
+
+
+@pytest.fixture
+def bus(session_factory):
+    return bootstrap.bootstarp(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+    )
+
+
+@pytest.fixture
+def read_uow(session_factory):
+    return unit_of_work.ReadOnlyUnitOfWork(session_factory)
+
+
+def test_availability_is_cumulative_by_eta(bus, read_uow):
+    # created out of eta order, so earlier etas are added under later ones
+    bus.handle(commands.CreateBatch("later", "OAK-DESK", 20, later))
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 50, None))
+    bus.handle(commands.CreateBatch("other", "PINE-DESK", 5, None))
+
+    assert views.availability("OAK-DESK", read_uow) == [
+        {"eta": None, "available": 50},
+        {"eta": tomorrow, "available": 80},
+        {"eta": later, "available": 100},
+    ]
+
+
+def test_allocations_and_quantity_changes_adjust_availability(bus, read_uow):
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 10, None))
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+    bus.handle(commands.Allocate("o1", "OAK-DESK", 10))
+    bus.handle(commands.Allocate("o2", "OAK-DESK", 5))
+    bus.handle(commands.AllocateOrder("o3", [("OAK-DESK", 5)]))
+    bus.handle(commands.Deallocate("tomorrow", "o2", "OAK-DESK", 5))
+
+    assert views.available_by("OAK-DESK", today, read_uow) == 0
+    assert views.available_by("OAK-DESK", tomorrow, read_uow) == 25
+
+    bus.handle(commands.ChangeBatchQuantity("tomorrow", 20))
+
+    assert views.available_by("OAK-DESK", later, read_uow) == 15
+
+
+def test_available_by_a_date_before_any_eta(bus, read_uow):
+    bus.handle(commands.CreateBatch("later", "OAK-DESK", 20, later))
+
+    assert views.available_by("OAK-DESK", today, read_uow) == 0
+    assert views.available_by("OAK-DESK", later, read_uow) == 20
+    assert views.available_by("NO-SUCH-SKU", later, read_uow) == 0
+
+
+def test_rebuild_matches_the_incremental_index(bus, read_uow, session_factory):
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 10, None))
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+    bus.handle(commands.CreateBatch("later", "PINE-DESK", 7, later))
+    bus.handle(commands.Allocate("o1", "OAK-DESK", 15))
+    expected = {sku: views.availability(sku, read_uow) for sku in ["OAK-DESK", "PINE-DESK"]}
+    with session_factory() as session:
+        session.execute(delete(orm.availability_view))
+        session.commit()
+
+    AvailabilityIndex(unit_of_work.SqlAlchemyUnitOfWork(session_factory)).rebuild()
+
+    assert {sku: views.availability(sku, read_uow) for sku in expected} == expected
+
+
+def test_a_failed_adjustment_rebuilds_its_sku(bus, read_uow, monkeypatch):
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 10, None))
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+    monkeypatch.setattr(availability, "_adjust", mock.Mock(side_effect=ConnectionError))
+
+    bus.handle(commands.Allocate("o1", "OAK-DESK", 15))
+
+    assert views.availability("OAK-DESK", read_uow) == [
+        {"eta": None, "available": 10},
+        {"eta": tomorrow, "available": 25},
+    ]
+
+
+def test_a_sku_whose_rebuild_failed_is_rebuilt_on_its_next_adjustment(session_factory, read_uow):
+    index = AvailabilityIndex(unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+    bus = bootstrap.bootstarp(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        availability=index,
+    )
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 10, None))
+    with mock.patch.object(availability, "_adjust", side_effect=ConnectionError), \
+            mock.patch.object(index, "_rebuild", side_effect=ConnectionError):
+        # the bus retries the handler, then gives up
+        bus.handle(commands.Allocate("o1", "OAK-DESK", 4))
+    assert views.availability("OAK-DESK", read_uow) == [{"eta": None, "available": 10}]
+
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+
+    assert views.availability("OAK-DESK", read_uow) == [
+        {"eta": None, "available": 6},
+        {"eta": tomorrow, "available": 36},
+    ]
+
+
+def test_async_bus_keeps_the_index(async_session_factory):
+    uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+    bus = bootstrap.async_bootstrap(
+        start_orm=False,
+        uow=uow,
+        notifications=mock.AsyncMock(),
+        publish=mock.AsyncMock(),
+    )
+
+    async def scenario():
+        await bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 10, None))
+        await bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, tomorrow))
+        await bus.handle(commands.Allocate("o1", "OAK-DESK", 4))
+        await bus.handle(commands.ChangeBatchQuantity("tomorrow", 20))
+        async with uow:
+            rows = await uow.session.execute(
+                select(orm.availability_view.c.eta, orm.availability_view.c.available)
+                .where(orm.availability_view.c.sku == "OAK-DESK")
+                .order_by(orm.availability_view.c.eta)
+            )
+            return rows.all()
+
+    assert asyncio.run(scenario()) == [(date.min, 6), (tomorrow, 26)]
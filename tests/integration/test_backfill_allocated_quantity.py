@@ -0,0 +1,49 @@
+from sqlalchemy import select, text
+
+from allocation.adapters import orm
+from allocation.entrypoints.backfill_allocated_quantity import backfill
+
+
+def insert_allocations(conn, batch_id, *qtys):
+    for qty in qtys:
+        line_id = conn.execute(
+            orm.order_lines.insert().values(sku="RED-CHAIR", qty=qty, orderId=f"o{batch_id}-{qty}")
+        ).inserted_primary_key[0]
+        conn.execute(orm.allocations.insert().values(orderline_id=line_id, batch_id=batch_id))
+
+
+def allocated_quantities(conn):
+    rows = conn.execute(select(orm.batches.c.reference, orm.batches.c._allocated_quantity))
+    return dict(rows.all())
+
+
+def test_adds_the_missing_column_and_sums_each_batch(in_memory_db):
+    with in_memory_db.begin() as conn:
+        conn.execute(text("ALTER TABLE batches DROP COLUMN _allocated_quantity"))
+        conn.execute(orm.products.insert().values(sku="RED-CHAIR"))
+        for batch_id, ref in ((1, "b1"), (2, "b2")):
+            conn.execute(text(
+                "INSERT INTO batches (id, reference, sku, _purchased_quantity) "
+                "VALUES (:id, :ref, 'RED-CHAIR', 100)"
+            ), dict(id=batch_id, ref=ref))
+        insert_allocations(conn, 1, 10, 5)
+
+    assert backfill(in_memory_db) == 2
+
+    with in_memory_db.connect() as conn:
+        assert allocated_quantities(conn) == {"b1": 15, "b2": 0}
+
+
+def test_fixes_stale_counts_and_can_run_again(in_memory_db):
+    with in_memory_db.begin() as conn:
+        conn.execute(orm.products.insert().values(sku="RED-CHAIR"))
+        conn.execute(orm.batches.insert().values(
+            id=1, reference="b1", sku="RED-CHAIR", _purchased_quantity=100, _allocated_quantity=0,
+        ))
+        insert_allocations(conn, 1, 7)
+
+    backfill(in_memory_db)
+    backfill(in_memory_db)
+
+    with in_memory_db.connect() as conn:
+        assert allocated_quantities(conn) == {"b1": 7}
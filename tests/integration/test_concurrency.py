@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm.exc import StaleDataError
+
+from allocation.adapters import concurrency
+from allocation.domain import commands, events, model
+from allocation.service_layer import handlers, messagebus, unit_of_work
+from tests.integration.test_uow import insert_batch
+from tests.random_refs import random_sku, random_batch_ref, random_order_id
+
+
+def compare_and_set_uow(session_factory):
+    # sqlite has no READ COMMITTED, its own isolation is enough here
+    return unit_of_work.SqlAlchemyUnitOfWork(
+        session_factory, concurrency=concurrency.CompareAndSet(isolation_level=None),
+    )
+
+
+def allocate(uow, orderid, sku, qty):
+    with uow:
+        uow.products.get(sku=sku).allocate(model.OrderLine(orderid, sku, qty))
+        uow.commit()
+
+
+def test_stale_product_update_is_a_conflict(file_session_factory):
+    sku = random_sku()
+    session = file_session_factory()
+    insert_batch(session, random_batch_ref(), sku, 100, None)
+    session.commit()
+    uow = compare_and_set_uow(file_session_factory)
+
+    with pytest.raises(StaleDataError) as conflict:
+        with uow:
+            product = uow.products.get(sku=sku)
+            allocate(compare_and_set_uow(file_session_factory), random_order_id(), sku, 10)
+            product.allocate(model.OrderLine(random_order_id(), sku, 10))
+            uow.commit()
+
+    assert uow.is_conflict(conflict.value)
+
+
+def test_bus_retries_the_writer_that_lost_the_conflict(file_session_factory):
+    sku = random_sku()
+    session = file_session_factory()
+    insert_batch(session, random_batch_ref(), sku, 100, None, product_version=1)
+    session.commit()
+    uow = compare_and_set_uow(file_session_factory)
+    attempts = []
+
+    def allocate_while_another_writer_commits(command):
+        attempts.append(command)
+        with uow:
+            product = uow.products.get(sku=command.sku)
+            if len(attempts) == 1:
+                allocate(compare_and_set_uow(file_session_factory), "other-order", sku, 10)
+            product.allocate(model.OrderLine(command.order_id, command.sku, command.qty))
+            uow.commit()
+
+    bus = messagebus.MessageBus(
+        uow=uow,
+        event_handlers={events.Allocated: []},
+        command_handlers={commands.Allocate: allocate_while_another_writer_commits},
+    )
+    bus.handle(commands.Allocate("order", sku, 20))
+
+    assert len(attempts) == 2
+    [[version, allocated]] = session.execute(
+        text(
+            "SELECT version_number, _allocated_quantity FROM products"
+            " JOIN batches ON batches.sku = products.sku WHERE products.sku = :sku"
+        ),
+        dict(sku=sku),
+    )
+    assert (version, allocated) == (3, 30)
+
+
+@pytest.mark.parametrize("strategy", sorted(concurrency.STRATEGIES))
+def test_concurrent_allocations_all_succeed_with_retries(postgres_session_factory, strategy):
+    sku, batch = random_sku(), random_batch_ref()
+    session = postgres_session_factory()
+    insert_batch(session, batch, sku, 100, eta=None, product_version=1)
+    session.commit()
+    exceptions = []
+
+    def try_to_allocate(orderid):
+        uow = unit_of_work.SqlAlchemyUnitOfWork(
+            concurrency=concurrency.STRATEGIES[strategy](), conflict_attempts=5,
+        )
+        try:
+            for attempt in uow.retrying():
+                with attempt:
+                    handlers.allocate(commands.Allocate(orderid, sku, 10), uow)
+        except Exception as e:
+            exceptions.append(e)
+
+    threads = [
+        threading.Thread(target=try_to_allocate, args=(random_order_id(str(i)),))
+        for i in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert exceptions == []
+    [[version]] = session.execute(
+        text("SELECT version_number FROM products WHERE sku=:sku"), dict(sku=sku)
+    )
+    assert version == 3
@@ -0,0 +1,50 @@
+import threading
+from unittest import mock
+
+from allocation import bootstrap
+from allocation.service_layer import dispatcher, unit_of_work
+from tests.conftest import FakeProjector
+
+
+def test_bootstrap_gives_each_worker_its_own_session(file_session_factory):
+    worker_buses = []
+
+    class RecordingDispatcher(dispatcher.BackgroundEventDispatcher):
+        def __init__(self, buses):
+            worker_buses.extend(buses)
+            super().__init__(buses)
+
+    with mock.patch.object(dispatcher, "BackgroundEventDispatcher", RecordingDispatcher):
+        bus = bootstrap.bootstarp(
+            start_orm=False,
+            uow=unit_of_work.SqlAlchemyUnitOfWork(file_session_factory),
+            notifications=mock.Mock(),
+            publish=lambda *args: None,
+            background_workers=2,
+            projector=FakeProjector(),
+        )
+    assert bus.dispatcher is not None
+    bus.dispatcher.shutdown()
+    all_open = threading.Barrier(len(worker_buses) + 1, timeout=5)
+    all_read = threading.Barrier(len(worker_buses) + 1, timeout=5)
+    sessions = {}
+
+    def hold_session(name, uow):
+        with uow:
+            # read once every uow is open, a shared one would show the last session
+            all_open.wait()
+            sessions[name] = (uow.session, uow.session.connection().connection.dbapi_connection)
+            all_read.wait()
+
+    threads = [
+        threading.Thread(target=hold_session, args=(name, worker.uow))
+        for name, worker in enumerate(worker_buses)
+    ] + [threading.Thread(target=hold_session, args=("request", bus.uow))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sessions) == 3
+    assert len({id(session) for session, _ in sessions.values()}) == 3
+    assert len({id(connection) for _, connection in sessions.values()}) == 3
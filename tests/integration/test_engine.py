@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from sqlalchemy import text
+
+from allocation import metrics
+from allocation.service_layer import unit_of_work
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def sqlite_engine_factory(tmp_path):
+    return lambda: unit_of_work.make_engine(
+        f"sqlite:///{tmp_path / 'allocation.db'}",
+        isolation_level="SERIALIZABLE",
+        pool_size=2,
+        max_overflow=0,
+    )
+
+
+def test_engine_uses_the_configured_pool(sqlite_engine_factory):
+    engine = sqlite_engine_factory()
+
+    assert isinstance(engine.pool, unit_of_work.InstrumentedQueuePool)
+    assert engine.pool.size() == 2
+    assert engine.pool._pre_ping
+
+
+def test_pool_checkouts_are_measured(sqlite_engine_factory):
+    session_factory = unit_of_work.ProcessLocalSessionFactory(sqlite_engine_factory)
+    session = session_factory()
+    session.execute(text("SELECT 1"))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["db.pool.checkout_wait_seconds"]["count"] == 1
+    assert snapshot["db.pool.checked_out"] == 1
+    session.close()
+    assert metrics.snapshot()["db.pool.checked_out"] == 0
+
+
+def test_each_process_gets_its_own_engine(sqlite_engine_factory, monkeypatch):
+    session_factory = unit_of_work.ProcessLocalSessionFactory(sqlite_engine_factory)
+    parent_engine = session_factory.engine
+    assert session_factory.engine is parent_engine
+
+    child_pid = os.getpid() + 1
+    monkeypatch.setattr(os, "getpid", lambda: child_pid)
+
+    child_engine = session_factory.engine
+    assert child_engine is not parent_engine
+    assert session_factory().get_bind() is child_engine
@@ -0,0 +1,42 @@
+import threading
+from unittest import mock
+
+from allocation import bootstrap
+from allocation.domain import commands, model
+from allocation.service_layer import unit_of_work
+from tests.conftest import FakeProjector
+
+
+def test_groups_for_different_skus_commit_on_their_own_units_of_work(file_session_factory):
+    bus = bootstrap.bootstarp(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(file_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        group_commit_window=0.2,
+        projector=FakeProjector(),
+    )
+    skus = ["SKU-A", "SKU-B", "SKU-C"]
+    for sku in skus:
+        bus.handle(commands.CreateBatch(f"{sku}-batch", sku, 100, None))
+    cmds = [commands.Allocate(f"{sku}-o{i}", sku, 1) for sku in skus for i in range(4)]
+    results, errors = {}, []
+
+    def allocate(cmd):
+        try:
+            results[cmd.order_id] = bus.handle(cmd)[0]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=allocate, args=(cmd,)) for cmd in cmds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == {cmd.order_id: f"{cmd.sku}-batch" for cmd in cmds}
+    with file_session_factory() as session:
+        for sku in skus:
+            [batch] = session.query(model.Batch).filter_by(sku=sku).all()
+            assert batch.available_quantity == 96
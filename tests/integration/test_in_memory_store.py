@@ -0,0 +1,239 @@
+import json
+import threading
+from typing import List, Tuple
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from allocation import bootstrap, metrics
+from allocation.adapters import wal
+from allocation.adapters.in_memory_store import (
+    ConcurrentModification,
+    InMemoryStore,
+    WrongShard,
+    shard_for,
+)
+from allocation.domain import commands, model
+from allocation.service_layer import handlers, unit_of_work
+
+
+def available(store, sku):
+    return sorted(b.available_quantity for b in store.get(sku).batches)
+
+
+def product(products, sku) -> model.Product:
+    found = products.get(sku)
+    assert found is not None
+    return found
+
+
+def test_commits_survive_a_restart(tmp_path):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+    handlers.change_batch_quantity(commands.ChangeBatchQuantity("b1", 50), uow)
+    store.close()
+
+    recovered = InMemoryStore.open(str(tmp_path))
+
+    assert available(recovered, "RED-CHAIR") == [40]
+    assert product(recovered, "RED-CHAIR").version_number == 3
+    assert recovered.sku_for_batch("b1") == "RED-CHAIR"
+
+
+def test_recovery_replays_the_log_on_top_of_the_snapshot(tmp_path):
+    store = InMemoryStore.open(str(tmp_path), snapshot_every=2)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    handlers.add_batch(commands.CreateBatch("b2", "BLUE-CHAIR", 100, None), uow)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+    store.close()
+
+    assert len(wal.read_file(store.snapshot_path)) == 2
+    assert len(wal.read_file(store.wal_path)) == 1
+    recovered = InMemoryStore.open(str(tmp_path))
+    assert available(recovered, "RED-CHAIR") == [90]
+    assert available(recovered, "BLUE-CHAIR") == [100]
+
+
+def test_a_torn_record_at_the_end_of_the_log_is_dropped(tmp_path):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    store.close()
+    with open(store.wal_path, "ab") as f:
+        f.write(wal.frame(2, b'[{"sku": "RED-CHAIR"')[:-5])
+
+    recovered = InMemoryStore.open(str(tmp_path))
+    recovered_uow = unit_of_work.InMemoryUnitOfWork(recovered)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), recovered_uow)
+    recovered.close()
+
+    assert available(InMemoryStore.open(str(tmp_path)), "RED-CHAIR") == [90]
+
+
+def test_a_product_changed_since_it_was_read_fails_the_commit(tmp_path):
+    store = InMemoryStore.open(str(tmp_path))
+    handlers.add_batch(
+        commands.CreateBatch("b1", "RED-CHAIR", 100, None), unit_of_work.InMemoryUnitOfWork(store)
+    )
+    first, second = unit_of_work.InMemoryUnitOfWork(store), unit_of_work.InMemoryUnitOfWork(store)
+
+    with first, second:
+        product(first.products, "RED-CHAIR").change_batch_quantity("b1", 50)
+        product(second.products, "RED-CHAIR").change_batch_quantity("b1", 60)
+        first.commit()
+        with pytest.raises(ConcurrentModification) as error:
+            second.commit()
+
+    assert second.is_conflict(error.value)
+    assert available(store, "RED-CHAIR") == [50]
+
+
+def test_uncommitted_changes_are_dropped(tmp_path):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+
+    with uow:
+        product(uow.products, "RED-CHAIR").allocate(model.OrderLine("o1", "RED-CHAIR", 10))
+
+    assert available(store, "RED-CHAIR") == [100]
+
+
+def test_products_of_another_shard_are_refused(tmp_path):
+    store = InMemoryStore.open(str(tmp_path), shard=0, shards=2)
+    sku = next(sku for sku in (f"SKU-{i}" for i in range(100)) if shard_for(sku, 2) == 1)
+
+    with pytest.raises(WrongShard):
+        handlers.add_batch(
+            commands.CreateBatch("b1", sku, 100, None), unit_of_work.InMemoryUnitOfWork(store)
+        )
+
+
+def test_commits_waiting_together_share_an_fsync(tmp_path):
+    metrics.reset()
+    store = InMemoryStore.open(str(tmp_path), sync_window=0.05)
+    start = threading.Barrier(8)
+
+    def add(i):
+        start.wait()
+        uow = unit_of_work.InMemoryUnitOfWork(store)
+        handlers.add_batch(commands.CreateBatch(f"b{i}", f"CHAIR-{i}", 10, None), uow)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = metrics.snapshot()["wal.group_size"]
+    assert summary["total"] == 8
+    assert summary["count"] < 8
+
+
+def test_events_are_relayed_from_the_outbox_in_the_log(tmp_path):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+    store.close()
+
+    recovered = InMemoryStore.open(str(tmp_path))
+    published = []  # type: List[Tuple[str, str]]
+    assert recovered.relay(published.extend) == 1
+    [(channel, payload)] = published
+    assert channel == "line_allocated"
+    assert json.loads(payload)["orderid"] == "o1"
+    recovered.close()
+
+    assert InMemoryStore.open(str(tmp_path)).relay(published.extend) == 0
+    assert len(published) == 1
+
+
+def test_rows_of_a_commit_not_yet_on_disk_are_not_relayed(tmp_path, monkeypatch):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    sync = store._log.sync
+    monkeypatch.setattr(store._log, "sync", lambda lsn: None)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+
+    published = []  # type: List[Tuple[str, str]]
+    assert store.relay(published.extend) == 0
+    assert len(store.pending_outbox()) == 1
+
+    sync(store._log.lsn)
+    assert store.relay(published.extend) == 1
+    assert len(published) == 1
+
+
+def test_commits_go_on_while_a_snapshot_is_written(tmp_path, monkeypatch):
+    store = InMemoryStore.open(str(tmp_path))
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    writing, release = threading.Event(), threading.Event()
+    write_snapshot = wal.write_snapshot
+
+    def slow_write(*args):
+        writing.set()
+        release.wait(5)
+        write_snapshot(*args)
+
+    monkeypatch.setattr(wal, "write_snapshot", slow_write)
+    snapshot = threading.Thread(target=store.snapshot)
+    snapshot.start()
+    assert writing.wait(5)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+    release.set()
+    snapshot.join()
+    store.close()
+
+    # the snapshot holds the batch, the log keeps the allocation made meanwhile
+    assert len(wal.read_file(store.wal_path)) == 1
+    assert available(InMemoryStore.open(str(tmp_path)), "RED-CHAIR") == [90]
+
+
+def test_rows_stay_in_the_outbox_when_publishing_fails(tmp_path):
+    store = InMemoryStore.open(str(tmp_path), snapshot_every=1)
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    handlers.add_batch(commands.CreateBatch("b1", "RED-CHAIR", 100, None), uow)
+    handlers.allocate(commands.Allocate("o1", "RED-CHAIR", 10), uow)
+
+    def fail(rows):
+        raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        store.relay(fail)
+    store.close()
+
+    # the snapshot carries the pending rows too
+    assert len(InMemoryStore.open(str(tmp_path)).pending_outbox()) == 1
+
+
+def test_the_store_answers_availability_from_its_batches(tmp_path):
+    today = date(2026, 1, 1)
+    store = InMemoryStore.open(str(tmp_path))
+    bus = bootstrap.bootstarp(
+        start_orm=False,
+        uow=unit_of_work.InMemoryUnitOfWork(store),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        projector=mock.Mock(),
+    )
+    bus.handle(commands.CreateBatch("in-stock", "OAK-DESK", 5, None))
+    bus.handle(commands.CreateBatch("later", "OAK-DESK", 30, date(2026, 1, 3)))
+    bus.handle(commands.CreateBatch("tomorrow", "OAK-DESK", 30, date(2026, 1, 2)))
+    bus.handle(commands.Allocate("o1", "OAK-DESK", 10))
+    bus.handle(commands.ChangeBatchQuantity("tomorrow", 25))
+
+    assert store.availability("OAK-DESK") == [
+        dict(eta=None, available=5),
+        dict(eta=date(2026, 1, 2), available=20),
+        dict(eta=date(2026, 1, 3), available=50),
+    ]
+    assert store.available_by("OAK-DESK", today) == 5
+    assert store.available_by("OAK-DESK", date(2026, 1, 2)) == 20
+    assert store.available_by("NO-SUCH-SKU", today) == 0
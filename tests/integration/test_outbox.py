@@ -0,0 +1,85 @@
+import json
+from typing import List, Tuple
+
+import pytest
+from sqlalchemy import text
+
+from allocation.adapters import outbox
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+from tests.integration.test_uow import insert_batch
+
+
+def allocate_in_uow(session_factory, orderid, sku, qty):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get(sku)
+        assert product is not None
+        product.allocate(model.OrderLine(orderid, sku, qty))
+        uow.commit()
+
+
+def outbox_rows(session):
+    return list(session.execute(text("SELECT channel, payload FROM outbox ORDER BY id")))
+
+
+def test_commit_writes_allocated_events_to_the_outbox(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 100, None)
+    session.commit()
+
+    allocate_in_uow(session_factory, "o1", "HIPSTER-WORKBENCH", 10)
+
+    [(channel, payload)] = outbox_rows(session)
+    assert channel == "line_allocated"
+    assert json.loads(payload) == {
+        "orderid": "o1", "sku": "HIPSTER-WORKBENCH", "qty": 10, "batchref": "batch1",
+    }
+
+
+def test_rolled_back_work_leaves_nothing_in_the_outbox(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "MEDIUM-PLINTH", 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get("MEDIUM-PLINTH")
+        assert product is not None
+        product.allocate(model.OrderLine("o1", "MEDIUM-PLINTH", 10))
+
+    assert outbox_rows(session) == []
+
+
+def test_relay_publishes_in_batches_and_deletes_what_it_sent(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "LARGE-FORK", 100, None)
+    session.commit()
+    for i in range(3):
+        allocate_in_uow(session_factory, f"o{i}", "LARGE-FORK", 1)
+    published = []  # type: List[List[Tuple[str, str]]]
+
+    assert outbox.relay(session_factory, published.append, batch_size=2) == 2
+    assert outbox.relay(session_factory, published.append, batch_size=2) == 1
+    assert outbox.relay(session_factory, published.append, batch_size=2) == 0
+
+    assert [len(batch) for batch in published] == [2, 1]
+    assert [json.loads(payload)["orderid"] for batch in published for _, payload in batch] == [
+        "o0", "o1", "o2",
+    ]
+    assert outbox_rows(session) == []
+
+
+def test_relay_keeps_messages_if_publishing_fails(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "SMALL-SPOON", 100, None)
+    session.commit()
+    allocate_in_uow(session_factory, "o1", "SMALL-SPOON", 1)
+
+    def failing_publish(messages):
+        raise ConnectionError("redis is down")
+
+    with pytest.raises(ConnectionError):
+        outbox.relay(session_factory, failing_publish)
+
+    assert len(outbox_rows(session)) == 1
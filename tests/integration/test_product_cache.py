@@ -0,0 +1,84 @@
+from sqlalchemy import text
+
+from allocation.adapters.product_cache import ProductCache
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+from tests.integration.test_uow import insert_batch
+from tests.random_refs import random_sku, random_batch_ref, random_order_id
+
+
+def allocate(uow, orderid, sku, qty):
+    with uow:
+        product = uow.products.get(sku=sku)
+        assert product is not None
+        batchref = product.allocate(model.OrderLine(orderid, sku, qty))
+        uow.commit()
+        return batchref
+
+
+def test_cache_hit_only_checks_the_version(session_factory, select_statements):
+    sku, batch = random_sku(), random_batch_ref()
+    session = session_factory()
+    insert_batch(session, batch, sku, 100, None)
+    session.commit()
+    cache = ProductCache()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, product_cache=cache)
+    allocate(uow, random_order_id(), sku, 10)
+
+    select_statements.clear()
+    with uow:
+        product = uow.products.get(sku=sku)
+        assert product is not None
+        assert product.batches[0].available_quantity == 90
+
+    assert cache.hits == 1
+    assert len(select_statements) == 1
+
+
+def test_cached_product_can_be_changed_and_committed(session_factory):
+    sku, batch = random_sku(), random_batch_ref()
+    session = session_factory()
+    insert_batch(session, batch, sku, 100, None)
+    session.commit()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, product_cache=ProductCache())
+    allocate(uow, random_order_id(), sku, 10)
+
+    allocate(uow, random_order_id(), sku, 20)
+
+    [[allocated]] = session_factory().execute(text("SELECT count(*) FROM allocations"))
+    assert allocated == 2
+    with uow:
+        product = uow.products.get(sku=sku)
+        assert product is not None
+        assert product.batches[0].available_quantity == 70
+
+
+def test_version_change_from_another_writer_forces_a_reload(session_factory):
+    sku, batch = random_sku(), random_batch_ref()
+    session = session_factory()
+    insert_batch(session, batch, sku, 100, None)
+    session.commit()
+    cache = ProductCache()
+    cached_uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, product_cache=cache)
+    allocate(cached_uow, random_order_id(), sku, 10)
+
+    allocate(unit_of_work.SqlAlchemyUnitOfWork(session_factory), random_order_id(), sku, 30)
+
+    with cached_uow:
+        product = cached_uow.products.get(sku=sku)
+        assert product is not None
+        assert product.batches[0].available_quantity == 60
+    assert cache.misses == 2
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ProductCache(max_size=2)
+    products = [model.Product(sku, batches=[]) for sku in ("a", "b", "c")]
+    cache.put(products[0])
+    cache.put(products[1])
+    cache.get("a", 0)
+
+    cache.put(products[2])
+
+    assert cache.get("a", 0) is products[0]
+    assert cache.get("b", 0) is None
@@ -0,0 +1,167 @@
+import threading
+import time
+from typing import List
+
+import pytest
+from sqlalchemy import text
+
+from allocation import metrics
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.projector import AllocationsProjector
+
+
+def view_rows(session_factory):
+    with session_factory() as session:
+        return list(session.execute(
+            text("SELECT orderid, sku, batchref FROM allocations_view ORDER BY orderid")
+        ))
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_projector(file_session_factory):
+    projectors = []
+
+    def make(**kwargs):
+        projector = AllocationsProjector(unit_of_work.SqlAlchemyUnitOfWork(file_session_factory), **kwargs)
+        projectors.append(projector)
+        return projector
+
+    yield make
+    for projector in projectors:
+        projector.shutdown()
+
+
+def test_write_through_by_default(file_session_factory, make_projector):
+    projector = make_projector()
+
+    projector.insert("o1", "sku1", "b1")
+
+    assert view_rows(file_session_factory) == [("o1", "sku1", "b1")]
+
+
+def test_changes_are_batched_until_the_batch_is_full(file_session_factory, make_projector):
+    projector = make_projector(max_batch=3, max_delay=60)
+
+    projector.insert("o1", "sku1", "b1")
+    projector.insert("o2", "sku1", "b1")
+    assert view_rows(file_session_factory) == []
+
+    projector.insert("o3", "sku1", "b1")
+    wait_for(lambda: len(view_rows(file_session_factory)) == 3)
+
+
+def test_changes_are_flushed_once_they_are_old_enough(file_session_factory, make_projector):
+    metrics.reset()
+    projector = make_projector(max_batch=100, max_delay=0.05)
+
+    projector.insert("o1", "sku1", "b1")
+    assert projector.lag() >= 0
+
+    wait_for(lambda: view_rows(file_session_factory) == [("o1", "sku1", "b1")])
+    wait_for(lambda: metrics.snapshot()["projector.lag_seconds"] == 0)
+
+
+def test_the_flush_thread_starts_on_first_use_in_each_process(file_session_factory, make_projector):
+    projector = make_projector(max_batch=1, max_delay=60)
+    assert projector._thread is None
+
+    projector.insert("o1", "sku1", "b1")
+    wait_for(lambda: len(view_rows(file_session_factory)) == 1)
+    # as if the projector had been built before a prefork server forked
+    projector._pid = None
+    projector.insert("o2", "sku1", "b1")
+
+    wait_for(lambda: len(view_rows(file_session_factory)) == 2)
+
+
+def test_changes_are_applied_in_order_within_a_flush(file_session_factory, make_projector):
+    projector = make_projector(max_batch=100, max_delay=60)
+    projector.insert("o1", "sku1", "b1")
+    projector.delete("o1", "sku1")
+    projector.insert("o1", "sku1", "b2")
+    projector.insert("o2", "sku1", "b1")
+    projector.delete("o2", "sku1")
+
+    projector.flush()
+
+    assert view_rows(file_session_factory) == [("o1", "sku1", "b2")]
+
+
+def flaky(session_factory, failures=1):
+    attempts = []  # type: List[None]
+
+    def flaky_session_factory():
+        attempts.append(None)
+        if len(attempts) <= failures:
+            raise ConnectionError("database unavailable")
+        return session_factory()
+
+    return flaky_session_factory
+
+
+def test_a_failed_write_through_is_raised_and_not_kept(file_session_factory):
+    projector = AllocationsProjector(unit_of_work.SqlAlchemyUnitOfWork(flaky(file_session_factory)))
+
+    with pytest.raises(ConnectionError):
+        projector.insert("o1", "sku1", "b1")
+    assert projector.lag() == 0
+
+    # what the bus does when it retries the handler
+    projector.insert("o1", "sku1", "b1")
+    projector.flush()
+    assert view_rows(file_session_factory) == [("o1", "sku1", "b1")]
+
+
+def test_failed_background_flushes_keep_their_changes(file_session_factory):
+    projector = AllocationsProjector(
+        unit_of_work.SqlAlchemyUnitOfWork(flaky(file_session_factory)), max_batch=1, max_delay=0.01,
+    )
+    try:
+        projector.insert("o1", "sku1", "b1")
+
+        wait_for(lambda: view_rows(file_session_factory) == [("o1", "sku1", "b1")])
+    finally:
+        projector.shutdown()
+
+
+def test_writing_a_change_twice_leaves_one_row(file_session_factory, make_projector):
+    projector = make_projector()
+
+    projector.insert("o1", "sku1", "b1")
+    projector.insert("o1", "sku1", "b1")
+    projector.insert("o1", "sku1", "b2")
+
+    assert view_rows(file_session_factory) == [("o1", "sku1", "b2")]
+
+
+def test_callers_wait_while_too_many_changes_are_pending(file_session_factory, make_projector):
+    projector = make_projector(max_batch=2, max_delay=60, max_pending=2)
+    third = threading.Thread(target=projector.insert, args=("o3", "sku1", "b1"))
+
+    with projector._flush_lock:
+        # the worker can't flush meanwhile, so the third change has to wait
+        projector.insert("o1", "sku1", "b1")
+        projector.insert("o2", "sku1", "b1")
+        third.start()
+        third.join(timeout=0.2)
+        assert third.is_alive()
+    third.join(timeout=2)
+
+    assert not third.is_alive()
+    wait_for(lambda: len(view_rows(file_session_factory)) == 2)
+
+
+def test_shutdown_flushes_what_is_left(file_session_factory, make_projector):
+    projector = make_projector(max_batch=100, max_delay=60)
+    projector.insert("o1", "sku1", "b1")
+
+    projector.shutdown()
+
+    assert view_rows(file_session_factory) == [("o1", "sku1", "b1")]
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import clear_mappers, sessionmaker
+
+from allocation.adapters.orm import metadata, start_mappers
+from allocation.service_layer import unit_of_work, views
+
+
+def sqlite_file_session_factory(path):
+    engine = create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def primary_and_replica(tmp_path):
+    start_mappers()
+    yield (
+        sqlite_file_session_factory(tmp_path / "primary.db"),
+        sqlite_file_session_factory(tmp_path / "replica.db"),
+    )
+    clear_mappers()
+
+
+def add_to_read_model(session_factory, orderid, sku, batchref):
+    session = session_factory()
+    session.execute(
+        text("INSERT INTO allocations_view (orderid, sku, batchref) VALUES (:orderid, :sku, :batchref)"),
+        dict(orderid=orderid, sku=sku, batchref=batchref),
+    )
+    session.commit()
+
+
+def test_allocations_are_read_from_the_replica(primary_and_replica):
+    primary, replica = primary_and_replica
+    add_to_read_model(primary, "order1", "sku1", "primary-batch")
+    add_to_read_model(replica, "order1", "sku1", "replica-batch")
+
+    results = views.allocations("order1", unit_of_work.ReadOnlyUnitOfWork(replica))
+
+    assert results == [{"sku": "sku1", "batchref": "replica-batch"}]
+
+
+def test_read_only_uow_tracks_no_products(primary_and_replica):
+    _, replica = primary_and_replica
+    uow = unit_of_work.ReadOnlyUnitOfWork(replica)
+
+    with uow:
+        uow.session.execute(text("SELECT 1"))
+
+    assert not hasattr(uow, "products")
+    assert not hasattr(uow, "commit")
+
+
+def test_read_only_uow_gives_each_thread_its_own_session(primary_and_replica):
+    _, replica = primary_and_replica
+    uow = unit_of_work.ReadOnlyUnitOfWork(replica)
+    both_open = threading.Barrier(2, timeout=5)
+    sessions = []
+
+    def read():
+        with uow:
+            both_open.wait()
+            sessions.append(uow.session)
+            uow.session.execute(text("SELECT 1"))
+            both_open.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+    assert uow.session is None
@@ -0,0 +1,87 @@
+from unittest import mock
+
+from sqlalchemy import inspect, text
+
+from allocation.domain import model
+from allocation.entrypoints import rebuild_allocations_view
+from allocation.service_layer import unit_of_work
+from allocation.service_layer.projector import AllocationsProjector
+
+
+def view_rows(session_factory):
+    with session_factory() as session:
+        return sorted(session.execute(text("SELECT orderid, sku, batchref FROM allocations_view")))
+
+
+def test_rebuild_replaces_a_drifted_view(file_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    with uow:
+        for sku in ("sku-a", "sku-b", "sku-c"):
+            product = model.Product(sku, batches=[])
+            product.add_batch(model.Batch(f"{sku}-batch", sku, 100, None))
+            for order in range(3):
+                product.allocate(model.OrderLine(f"order{order}", sku, 10))
+            uow.products.add(product)
+        uow.commit()
+    with file_session_factory() as session:
+        session.execute(text("INSERT INTO allocations_view VALUES ('stale', 'sku-a', 'gone')"))
+        session.commit()
+    engine = file_session_factory.kw["bind"]
+
+    # one worker: sqlite can't take concurrent writers from several processes
+    stats = rebuild_allocations_view.rebuild(str(engine.url), workers=1, parts=3, chunk_size=2)
+
+    assert stats.rows == 9
+    assert view_rows(file_session_factory) == sorted(
+        (f"order{order}", sku, f"{sku}-batch")
+        for sku in ("sku-a", "sku-b", "sku-c")
+        for order in range(3)
+    )
+    assert rebuild_allocations_view.SHADOW not in inspect(engine).get_table_names()
+
+
+def test_changes_made_while_the_rebuild_runs_are_replayed(file_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+    with uow:
+        product = model.Product("sku-a", batches=[])
+        product.add_batch(model.Batch("batch-1", "sku-a", 100, None))
+        for order in ("order1", "order2"):
+            product.allocate(model.OrderLine(order, "sku-a", 10))
+        uow.products.add(product)
+        uow.commit()
+    engine = file_session_factory.kw["bind"]
+    projector = AllocationsProjector(unit_of_work.SqlAlchemyUnitOfWork(file_session_factory))
+    projector.insert("order1", "sku-a", "batch-1")
+    projector.insert("order2", "sku-a", "batch-1")
+    sku_ranges = rebuild_allocations_view.sku_ranges
+
+    def projector_keeps_writing(*args):
+        # after the capture started, like a projector catching up meanwhile
+        projector.delete("order1", "sku-a")
+        projector.insert("order3", "sku-a", "batch-1")
+        projector.insert("order2", "sku-a", "batch-2")
+        return sku_ranges(*args)
+
+    with mock.patch.object(rebuild_allocations_view, "sku_ranges", projector_keeps_writing):
+        stats = rebuild_allocations_view.rebuild(str(engine.url), workers=1, parts=1)
+
+    assert stats.replayed == 4
+    assert view_rows(file_session_factory) == [
+        ("order2", "sku-a", "batch-2"),
+        ("order3", "sku-a", "batch-1"),
+    ]
+    tables = inspect(engine).get_table_names()
+    assert rebuild_allocations_view.CHANGES not in tables
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).all() == []
+
+
+def test_sku_ranges_cover_every_sku_once(file_session_factory):
+    with file_session_factory() as session:
+        for sku in ("a", "b", "c", "d", "e"):
+            session.execute(text("INSERT INTO products (sku, version_number) VALUES (:sku, 0)"), dict(sku=sku))
+        session.commit()
+
+    ranges = rebuild_allocations_view.sku_ranges(file_session_factory.kw["bind"], 2)
+
+    assert ranges == [(None, "d"), ("d", None)]
@@ -0,0 +1,57 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from allocation.adapters import orm
+from allocation.entrypoints.rebuild_availability import rebuild
+
+
+def add_batch(conn, ref, sku, qty, eta=None, allocated=0):
+    conn.execute(orm.batches.insert().values(
+        reference=ref, sku=sku, _purchased_quantity=qty, eta=eta, _allocated_quantity=allocated,
+    ))
+
+
+def index_rows(session_factory):
+    view = orm.availability_view
+    with session_factory() as session:
+        return session.execute(
+            select(view.c.sku, view.c.eta, view.c.available).order_by(view.c.sku, view.c.eta)
+        ).all()
+
+
+def test_fills_an_empty_index_from_existing_batches(session_factory):
+    with session_factory() as session:
+        for sku in ("OAK-DESK", "PINE-DESK"):
+            session.execute(orm.products.insert().values(sku=sku))
+        conn = session.connection()
+        add_batch(conn, "in-stock", "OAK-DESK", 10, allocated=4)
+        add_batch(conn, "soon", "OAK-DESK", 20, eta=date(2026, 1, 2))
+        add_batch(conn, "pine", "PINE-DESK", 5)
+        session.commit()
+
+    rebuild(session_factory)
+
+    assert index_rows(session_factory) == [
+        ("OAK-DESK", date.min, 6),
+        ("OAK-DESK", date(2026, 1, 2), 26),
+        ("PINE-DESK", date.min, 5),
+    ]
+
+
+def test_rebuilding_one_sku_leaves_the_others_alone(session_factory):
+    with session_factory() as session:
+        for sku in ("OAK-DESK", "PINE-DESK"):
+            session.execute(orm.products.insert().values(sku=sku))
+        conn = session.connection()
+        add_batch(conn, "oak", "OAK-DESK", 10)
+        add_batch(conn, "pine", "PINE-DESK", 5)
+        session.execute(orm.availability_view.insert().values(sku="PINE-DESK", eta=date.min, available=1))
+        session.commit()
+
+    rebuild(session_factory, sku="OAK-DESK")
+
+    assert index_rows(session_factory) == [
+        ("OAK-DESK", date.min, 10),
+        ("PINE-DESK", date.min, 1),
+    ]
@@ -0,0 +1,114 @@
+import time
+
+import fakeredis
+import pytest
+
+from allocation.domain import commands
+from allocation.entrypoints import redis_streams_consumer as consumer
+
+
+class RecordingBus:
+    def __init__(self, fail_on=None, failures=None):
+        self.handled = []
+        self.fail_on = fail_on
+        # fails that many times, then recovers; None fails for good
+        self.failures = failures
+
+    def handle(self, cmd):
+        if cmd.ref == self.fail_on and self.failures != 0:
+            if self.failures is not None:
+                self.failures -= 1
+            raise RuntimeError(f"can't handle {cmd.ref}")
+        self.handled.append(cmd)
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def pending_count(r, partition):
+    return r.xpending(consumer.stream_for(partition), consumer.GROUP)["pending"]
+
+
+def test_updates_for_a_batch_always_land_on_the_same_partition():
+    partitions = {consumer.partition_for("batch-1", 8) for _ in range(10)}
+    assert len(partitions) == 1
+
+
+def test_consumes_its_partition_in_order_and_acks_the_batch(r):
+    for batchref in ("batch-1", "batch-2", "batch-3"):
+        consumer.add_change_batch_quantity(r, batchref, 10, partitions=1)
+    bus = RecordingBus()
+
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=1)
+
+    assert [cmd.ref for cmd in bus.handled] == ["batch-1", "batch-2", "batch-3"]
+    assert pending_count(r, 0) == 0
+
+
+def test_superseded_updates_are_skipped_but_acknowledged(r):
+    for qty in (30, 20, 10):
+        consumer.add_change_batch_quantity(r, "batch-1", qty, partitions=1)
+    consumer.add_change_batch_quantity(r, "batch-2", 7, partitions=1)
+    bus = RecordingBus()
+
+    skipped = consumer.consume(r, bus, 0, block_ms=10, max_batches=1)
+
+    assert bus.handled == [
+        commands.ChangeBatchQuantity("batch-1", 10),
+        commands.ChangeBatchQuantity("batch-2", 7),
+    ]
+    assert skipped == 2
+    assert pending_count(r, 0) == 0
+
+
+def test_a_failed_message_stays_pending_and_is_redelivered(r):
+    consumer.add_change_batch_quantity(r, "good-batch", 5, partitions=1)
+    consumer.add_change_batch_quantity(r, "bad-batch", 5, partitions=1)
+    consumer.add_change_batch_quantity(r, "other-batch", 3, partitions=1)
+
+    failing = RecordingBus(fail_on="bad-batch")
+    consumer.consume(r, failing, 0, block_ms=10, max_batches=1)
+    assert [cmd.ref for cmd in failing.handled] == ["good-batch", "other-batch"]
+    assert pending_count(r, 0) == 1
+
+    bus = RecordingBus()
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=1, claim_idle_ms=0)
+
+    assert [(cmd.ref, cmd.qty) for cmd in bus.handled] == [("bad-batch", 5)]
+    assert pending_count(r, 0) == 0
+
+
+def test_a_poison_message_is_dead_lettered_after_max_deliveries(r):
+    consumer.add_change_batch_quantity(r, "bad-batch", 5, partitions=1)
+    consumer.add_change_batch_quantity(r, "good-batch", 5, partitions=1)
+    bus = RecordingBus(fail_on="bad-batch")
+
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=3, max_deliveries=3, claim_idle_ms=0)
+
+    assert [cmd.ref for cmd in bus.handled] == ["good-batch"]
+    assert pending_count(r, 0) == 0
+    [(_, dead)] = r.xrange(consumer.dead_letter_for(consumer.stream_for(0)))
+    assert (dead["batchref"], dead["qty"]) == ("bad-batch", "5")
+
+    consumer.add_change_batch_quantity(r, "next-batch", 1, partitions=1)
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=2)
+    assert [cmd.ref for cmd in bus.handled] == ["good-batch", "next-batch"]
+
+
+def test_a_message_failing_during_a_brief_outage_is_handled_once_it_recovers(r):
+    consumer.add_change_batch_quantity(r, "batch-1", 5, partitions=1)
+    bus = RecordingBus(fail_on="batch-1", failures=1)
+
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=3, max_deliveries=2, claim_idle_ms=200)
+    # not redelivered straight away, so its deliveries aren't used up
+    assert bus.handled == []
+    assert pending_count(r, 0) == 1
+
+    time.sleep(0.25)
+    consumer.consume(r, bus, 0, block_ms=10, max_batches=1, max_deliveries=2, claim_idle_ms=200)
+
+    assert [cmd.ref for cmd in bus.handled] == ["batch-1"]
+    assert pending_count(r, 0) == 0
+    assert r.xlen(consumer.dead_letter_for(consumer.stream_for(0))) == 0
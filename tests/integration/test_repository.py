@@ -1,5 +1,8 @@
+import pytest
+
 from allocation.adapters import repository
-from allocation.domain import model
+from allocation.domain import commands, model
+from allocation.service_layer import handlers, unit_of_work
 
 
 def test_get_by_batchref(session):
@@ -12,4 +15,104 @@ def test_get_by_batchref(session):
     repo.add(p1)
     repo.add(p2)
     assert repo.get_by_batch_ref("b2") == p1
-    assert repo.get_by_batch_ref("b3") == p2
\ No newline at end of file
+    assert repo.get_by_batch_ref("b3") == p2
+
+def product_with_allocated_batches(session, sku, batches=3):
+    repo = repository.SqlAlchemyRepository(session)
+    product = model.Product(sku=sku, batches=[])
+    for i in range(batches):
+        product.add_batch(model.Batch(ref=f"{sku}-b{i}", sku=sku, qty=100, eta=None))
+    for i in range(batches):
+        product.batches[i].allocate(model.OrderLine(f"o{i}", sku, 10))
+    repo.add(product)
+    session.commit()
+
+
+@pytest.mark.parametrize("loading, expected_selects", [
+    (repository.LAZY, 2),
+    (repository.SELECTIN, 3),
+    (repository.JOINED, 1),
+    (repository.COUNTS, 2),
+])
+def test_loading_profiles_read_all_quantities_without_n_plus_one(
+        session_factory, select_statements, loading, expected_selects
+):
+    product_with_allocated_batches(session_factory(), "sku1")
+    select_statements.clear()
+
+    product = repository.SqlAlchemyRepository(session_factory()).get("sku1", loading=loading)
+
+    assert product is not None
+    assert [b.available_quantity for b in product.batches] == [90, 90, 90]
+    assert len(select_statements) == expected_selects
+
+
+def test_available_quantity_does_not_load_order_line_history(session_factory, select_statements):
+    session = session_factory()
+    product = model.Product(sku="sku1", batches=[model.Batch(ref="b1", sku="sku1", qty=1000, eta=None)])
+    for i in range(50):
+        product.allocate(model.OrderLine(f"o{i}", "sku1", 1))
+    repository.SqlAlchemyRepository(session).add(product)
+    session.commit()
+    select_statements.clear()
+
+    loaded = repository.SqlAlchemyRepository(session_factory()).get("sku1", loading=repository.COUNTS)
+
+    assert loaded is not None
+    assert loaded.batches[0].available_quantity == 950
+    assert not any("order_lines" in statement for statement in select_statements)
+
+
+@pytest.mark.parametrize("command, expected_selects", [
+    # product, batches, and a keyed lookup of the line in the chosen batch
+    (commands.Allocate("o9", "sku1", 10), 3),
+    # ... one lookup per line, however many lines the batch already holds
+    (commands.AllocateMany([commands.Allocate("o9", "sku1", 10), commands.Allocate("o10", "sku1", 10)]), 4),
+    (commands.AllocateOrder("o9", [("sku1", 10)]), 3),
+    # ... plus the order lines of the batch the evicted line moves to
+    (commands.ChangeBatchQuantity("sku1-b1", 5), 4),
+    # product, batches, and the order lines of the one batch that changes
+    (commands.Deallocate("sku1-b1", "o1", "sku1", 10), 3),
+    (commands.CreateBatch("sku1-b9", "sku1", 100, None), 2),
+])
+def test_queries_issued_by_each_handler_do_not_grow_with_batches(
+        session_factory, select_statements, command, expected_selects
+):
+    product_with_allocated_batches(session_factory(), "sku1", batches=5)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    select_statements.clear()
+
+    handlers.COMMAND_HANDLERS[type(command)](command, uow)
+
+    assert len(select_statements) == expected_selects
+
+
+def test_allocating_looks_the_line_up_instead_of_loading_the_batch_history(
+        session_factory, select_statements
+):
+    session = session_factory()
+    product = model.Product(sku="sku1", batches=[model.Batch(ref="b1", sku="sku1", qty=1000, eta=None)])
+    for i in range(50):
+        product.allocate(model.OrderLine(f"o{i}", "sku1", 1))
+    repository.SqlAlchemyRepository(session).add(product)
+    session.commit()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    select_statements.clear()
+
+    with uow:
+        loaded = uow.products.get("sku1")
+        assert loaded is not None
+        assert loaded.allocate(model.OrderLine("o50", "sku1", 1)) == "b1"
+        # already there, so the batch is left as it is
+        assert not loaded.batches[0].allocate(model.OrderLine("o3", "sku1", 1))
+        assert not loaded.batches[0].allocate(model.OrderLine("o50", "sku1", 1))
+        assert "_allocations" not in vars(loaded.batches[0])
+        uow.commit()
+
+    assert not any("order_lines.id AS" in statement for statement in select_statements)
+    with uow:
+        loaded = uow.products.get("sku1")
+        assert loaded is not None
+        [batch] = loaded.batches
+        assert batch.allocated_quantity == 51
+        assert len(batch._allocations) == 51
@@ -50,6 +50,7 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(session_factory):
     uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
     with uow:
         product = uow.products.get("HIPSTER-WORKBENCH")
+        assert product is not None
         line = model.OrderLine("o1", "HIPSTER-WORKBENCH", 10)
         product.allocate(line)
         uow.commit()
@@ -58,6 +59,30 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(session_factory):
     assert batchref == "batch1"
 
 
+def test_allocated_quantity_is_kept_on_the_batch_row(session_factory):
+    session = session_factory()
+    insert_batch(session, "batch1", "HIPSTER-WORKBENCH", 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get("HIPSTER-WORKBENCH")
+        assert product is not None
+        product.allocate(model.OrderLine("o1", "HIPSTER-WORKBENCH", 10))
+        product.allocate(model.OrderLine("o2", "HIPSTER-WORKBENCH", 20))
+        uow.commit()
+    with uow:
+        product = uow.products.get("HIPSTER-WORKBENCH")
+        assert product is not None
+        product.deallocate("batch1", model.OrderLine("o1", "HIPSTER-WORKBENCH", 10))
+        uow.commit()
+
+    [[allocated]] = session.execute(
+        text("SELECT _allocated_quantity FROM batches WHERE reference = 'batch1'")
+    )
+    assert allocated == 20
+
+
 def test_rolls_back_uncommitted_work_by_default(session_factory):
     uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
     with uow:
@@ -88,6 +113,7 @@ def try_to_allocation(orderid, sku, exceptions):
     try:
         with unit_of_work.SqlAlchemyUnitOfWork() as uow:
             product = uow.products.get(sku=sku)
+            assert product is not None
             product.allocate(line)
             time.sleep(0.2)
             uow.commit()
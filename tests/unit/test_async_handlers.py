@@ -0,0 +1,135 @@
+import asyncio
+from collections import defaultdict
+from typing import List, Optional
+
+import pytest
+from allocation import bootstrap
+from allocation.adapters import notifications
+
+from allocation.domain import model, commands
+from allocation.service_layer import handlers, unit_of_work
+
+from allocation.adapters.repository import AbstractAsyncRepository
+from tests.conftest import FakeAsyncAvailability
+
+
+class FakeAsyncRepository(AbstractAsyncRepository):
+    def __init__(self, products):
+        super().__init__()
+        self._products = set(products)
+
+    def _add(self, product):
+        self._products.add(product)
+
+    async def _get(self, sku):
+        return next((b for b in self._products if b.sku == sku), None)
+
+    async def _get_by_batch_ref(self, batch_ref) -> Optional[model.Product]:
+        return next(
+            (p for p in self._products for b in p.batches if b.reference == batch_ref),
+            None,
+        )
+
+
+class FakeAsyncUnitOfWork(unit_of_work.AbstractAsyncUnitOfWork):
+    def __init__(self):
+        self.products = FakeAsyncRepository([])
+        self.committed = False
+
+    async def _commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        pass
+
+
+class FakeAsyncNotifications(notifications.AbstractAsyncNotifications):
+    def __init__(self):
+        self.sent = defaultdict(list)
+
+    async def send(self, destination, message):
+        self.sent[destination].append(message)
+
+
+async def fake_publish(channel, event):
+    pass
+
+
+def bootstrap_test_app(notifications=None, availability=None):
+    return bootstrap.async_bootstrap(
+        start_orm=False,
+        uow=FakeAsyncUnitOfWork(),
+        notifications=notifications or FakeAsyncNotifications(),
+        publish=fake_publish,
+        availability=availability or FakeAsyncAvailability(),
+    )
+
+
+def handle_all(bus, *messages):
+    async def handle():
+        return [await bus.handle(message) for message in messages]
+    return asyncio.run(handle())
+
+
+def test_allocate_returns_batch_ref():
+    bus = bootstrap_test_app()
+    [_, [batch_ref]] = handle_all(
+        bus,
+        commands.CreateBatch("batch1", "COMPLICATED-LAMP", 100, None),
+        commands.Allocate("o1", "COMPLICATED-LAMP", 10),
+    )
+    assert batch_ref == "batch1"
+    assert bus.uow.committed
+
+
+def test_error_for_invalid_sku():
+    bus = bootstrap_test_app()
+    with pytest.raises(handlers.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+        handle_all(bus, commands.Allocate("o1", "NONEXISTENTSKU", 10))
+
+
+def test_sends_email_on_out_of_stock_error():
+    fake_notifications = FakeAsyncNotifications()
+    bus = bootstrap_test_app(fake_notifications)
+    handle_all(
+        bus,
+        commands.CreateBatch("b1", "POPULAR-CURTAINS", 9, None),
+        commands.Allocate("o1", "POPULAR-CURTAINS", 10),
+    )
+    assert fake_notifications.sent["stock@made.com"] == [
+        "Out of stock for POPULAR-CURTAINS"
+    ]
+
+
+def test_sync_handlers_are_still_supported():
+    bus = bootstrap_test_app()
+    calls = []  # type: List[commands.Command]
+    bus.command_handlers[commands.Deallocate] = calls.append
+    command = commands.Deallocate("b1", "o1", "ANY-SKU", 1)
+    handle_all(bus, command)
+    assert calls == [command]
+
+
+def test_batch_changes_and_allocations_adjust_availability():
+    availability = FakeAsyncAvailability()
+    bus = bootstrap_test_app(availability=availability)
+    handle_all(
+        bus,
+        commands.CreateBatch("b1", "SOFT-SOFA", 100, None),
+        commands.Allocate("o1", "SOFT-SOFA", 30),
+        commands.AllocateOrder("o2", [("SOFT-SOFA", 20)]),
+        commands.ChangeBatchQuantity("b1", 80),
+    )
+
+    assert availability.adjusted == [("SOFT-SOFA", None, 100), ("SOFT-SOFA", None, -20)]
+    assert availability.by_batch == {"b1": -50}
+
+
+def test_a_unit_of_work_without_a_database_needs_an_availability_index():
+    with pytest.raises(TypeError, match="FakeAsyncUnitOfWork"):
+        bootstrap.async_bootstrap(
+            start_orm=False,
+            uow=FakeAsyncUnitOfWork(),
+            notifications=FakeAsyncNotifications(),
+            publish=fake_publish,
+        )
@@ -1,5 +1,7 @@
 from datetime import date
 
+from hypothesis import given, strategies as st
+
 from allocation.domain.model import Batch, OrderLine
 
 
@@ -50,3 +52,32 @@ def test_allocation_is_idempotent():
     batch.allocate(line)
     assert batch.available_quantity == 18
 
+
+def slow_allocated_quantity(batch):
+    return sum(line.qty for line in batch._allocations)
+
+
+order_lines = st.builds(
+    OrderLine,
+    orderId=st.sampled_from(["o1", "o2", "o3", "o4", "o5"]),
+    sku=st.just("FANCY-SOFA"),
+    qty=st.integers(min_value=1, max_value=30),
+)
+batch_operations = st.lists(
+    st.tuples(st.sampled_from(["allocate", "deallocate", "deallocate_one"]), order_lines),
+    max_size=50,
+)
+
+
+@given(purchased=st.integers(min_value=0, max_value=100), operations=batch_operations)
+def test_running_allocated_quantity_matches_sum_of_lines(purchased, operations):
+    batch = Batch("batch-001", "FANCY-SOFA", purchased, eta=None)
+    for operation, line in operations:
+        if operation == "allocate":
+            batch.allocate(line)
+        elif operation == "deallocate":
+            batch.deallocate(line)
+        elif batch._allocations:
+            batch.deallocate_one()
+        assert batch.allocated_quantity == slow_allocated_quantity(batch)
+        assert batch.available_quantity == purchased - slow_allocated_quantity(batch)
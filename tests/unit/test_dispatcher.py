@@ -0,0 +1,114 @@
+import threading
+from typing import Any, List, Tuple
+
+from allocation.domain import commands, events, model
+from allocation.service_layer import messagebus
+from allocation.service_layer.dispatcher import BackgroundEventDispatcher
+from tests.conftest import FakeUnitOfWork
+
+
+class RecordingBus(messagebus.MessageBus):
+    def __init__(self):
+        super().__init__(uow=FakeUnitOfWork(), event_handlers={}, command_handlers={})
+        self.handled = []  # type: List[Tuple[str, Any]]
+
+    def handle(self, message):
+        self.handled.append((threading.current_thread().name, message))
+        return []
+
+
+def test_events_for_a_sku_are_handled_in_order_by_one_worker():
+    buses = [RecordingBus() for _ in range(4)]
+    dispatcher = BackgroundEventDispatcher(buses)
+    sent = [events.OutOfStock(sku) for _ in range(20) for sku in ("SKU-A", "SKU-B", "SKU-C")]
+
+    for event in sent:
+        dispatcher.dispatch(event)
+    dispatcher.join()
+
+    handled = [entry for bus in buses for entry in bus.handled]
+    assert len(handled) == len(sent)
+    for sku in ("SKU-A", "SKU-B", "SKU-C"):
+        workers = {name for name, event in handled if event.sku == sku}
+        assert len(workers) == 1
+
+
+def test_order_allocations_keep_the_order_of_each_sku_with_its_deallocations():
+    buses = [RecordingBus() for _ in range(4)]
+    dispatcher = BackgroundEventDispatcher(buses)
+    skus = ("SKU-A", "SKU-B", "SKU-C")
+    for i in range(10):
+        dispatcher.dispatch(events.OrderAllocated(
+            f"o{i}", [events.Allocated(f"o{i}", sku, 1, f"{sku}-batch") for sku in skus],
+        ))
+        for sku in skus:
+            dispatcher.dispatch(events.Deallocated(f"o{i}", sku, 1, f"{sku}-batch"))
+    dispatcher.join()
+
+    handled = [entry for bus in buses for entry in bus.handled]
+    for sku in skus:
+        of_sku = [
+            (name, event) for name, event in handled
+            if getattr(event, "sku", None) == sku
+            or isinstance(event, events.OrderAllocated) and event.allocations[0].sku == sku
+        ]
+        assert len({name for name, _ in of_sku}) == 1
+        assert [type(event).__name__ for _, event in of_sku] == ["OrderAllocated", "Deallocated"] * 10
+        assert [event.orderid for _, event in of_sku] == [f"o{i}" for i in range(10) for _ in "ad"]
+    assert all(
+        len(event.allocations) == 1
+        for _, event in handled if isinstance(event, events.OrderAllocated)
+    )
+
+
+def test_shutdown_drains_pending_events():
+    bus = RecordingBus()
+    dispatcher = BackgroundEventDispatcher([bus])
+    for i in range(50):
+        dispatcher.dispatch(events.OutOfStock(f"SKU-{i}"))
+
+    dispatcher.shutdown()
+
+    assert len(bus.handled) == 50
+
+
+def test_workers_start_on_first_use_in_each_process():
+    bus = RecordingBus()
+    dispatcher = BackgroundEventDispatcher([bus])
+    assert not dispatcher._threads
+
+    dispatcher.dispatch(events.OutOfStock("SKU-A"))
+    dispatcher.join()
+    parents_workers = dispatcher._threads
+    # as if the dispatcher had been built before a prefork server forked
+    dispatcher._pid = None
+    dispatcher.dispatch(events.OutOfStock("SKU-B"))
+    dispatcher.shutdown()
+
+    assert dispatcher._threads != parents_workers
+    assert [event.sku for _, event in bus.handled] == ["SKU-A", "SKU-B"]
+
+
+def test_bus_hands_events_to_background_workers():
+    uow = FakeUnitOfWork()
+
+    def allocate(command):
+        product = model.Product(command.sku, batches=[])
+        product.events.append(events.OutOfStock(command.sku))
+        uow.products.add(product)
+        return "handled"
+
+    worker = RecordingBus()
+    dispatcher = BackgroundEventDispatcher([worker])
+    bus = messagebus.MessageBus(
+        uow=uow,
+        event_handlers={},
+        command_handlers={commands.Allocate: allocate},
+        dispatcher=dispatcher,
+    )
+
+    assert bus.handle(commands.Allocate("o1", "POPULAR-CURTAINS", 10)) == ["handled"]
+    dispatcher.shutdown()
+
+    assert [event for _, event in worker.handled] == [events.OutOfStock("POPULAR-CURTAINS")]
+
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from allocation.domain import commands
+from allocation.service_layer.group_commit import GroupCommitAllocator
+
+
+class FakeAllocateMany:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, command):
+        self.calls.append(command.lines)
+        return [f"batch-for-{line.order_id}" for line in command.lines]
+
+
+def allocate_concurrently(allocator, cmds):
+    results = {}
+
+    def allocate(cmd):
+        results[cmd.order_id] = allocator(cmd)
+
+    threads = [threading.Thread(target=allocate, args=(cmd,)) for cmd in cmds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_allocations_for_a_sku_are_committed_together():
+    allocate_many = FakeAllocateMany()
+    allocator = GroupCommitAllocator(allocate_many, window=0.2)
+    cmds = [commands.Allocate(f"o{i}", "HOT-SKU", 1) for i in range(5)]
+
+    results = allocate_concurrently(allocator, cmds)
+
+    assert len(allocate_many.calls) == 1
+    assert results == {f"o{i}": f"batch-for-o{i}" for i in range(5)}
+
+
+def test_groups_are_per_sku():
+    allocate_many = FakeAllocateMany()
+    allocator = GroupCommitAllocator(allocate_many, window=0.2)
+    cmds = [commands.Allocate("o1", "SKU-A", 1), commands.Allocate("o2", "SKU-B", 1)]
+
+    allocate_concurrently(allocator, cmds)
+
+    assert sorted(len(lines) for lines in allocate_many.calls) == [1, 1]
+    assert all(len({line.sku for line in lines}) == 1 for lines in allocate_many.calls)
+
+
+def test_full_group_is_committed_without_waiting_for_the_window():
+    allocate_many = FakeAllocateMany()
+    allocator = GroupCommitAllocator(allocate_many, window=60, max_group_size=1)
+
+    assert allocator(commands.Allocate("o1", "HOT-SKU", 1)) == "batch-for-o1"
+
+
+def test_errors_are_raised_to_every_caller_in_the_group():
+    def failing_allocate_many(command):
+        raise ValueError("boom")
+
+    allocator = GroupCommitAllocator(failing_allocate_many, window=0)
+
+    with pytest.raises(ValueError, match="boom"):
+        allocator(commands.Allocate("o1", "HOT-SKU", 1))
@@ -1,5 +1,4 @@
 # pylint: disable=no-self-use
-from collections import defaultdict
 from datetime import date
 from unittest import mock
 
@@ -8,58 +7,19 @@ from allocation import bootstrap
 from allocation.adapters import notifications
 
 from allocation.domain import model, commands
-from allocation.service_layer import handlers, unit_of_work, messagebus
+from allocation.service_layer import handlers, messagebus
 
-from allocation.adapters.repository import AbstractRepository
+from tests.conftest import FakeAvailability, FakeNotifications, FakeProjector, FakeUnitOfWork
 
 
-class FakeRepository(AbstractRepository):
-    def __init__(self, products):
-        super().__init__()
-        self._products = set(products)
-
-    def _add(self, product):
-        self._products.add(product)
-
-    def _get(self, sku):
-        return next((b for b in self._products if b.sku == sku), None)
-
-    def list(self):
-        return list(self._products)
-
-    def _get_by_batch_ref(self, batch_ref) -> model.Product:
-        return next(
-            (p for p in self._products for b in p.batches if b.reference == batch_ref),
-            None,
-        )
-
-
-class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
-    def __init__(self):
-        self.products = FakeRepository([])
-        self.committed = False
-
-    def _commit(self):
-        self.committed = True
-
-    def rollback(self):
-        pass
-
-
-class FakeNotifications(notifications.AbstractNotifications):
-    def __init__(self):
-        self.sent = defaultdict(list)
-
-    def send(self, destination, message):
-        self.sent[destination].append(message)
-
-
-def bootstrap_test_app():
+def bootstrap_test_app(availability=None):
     return bootstrap.bootstarp(
         start_orm=False,
         uow=FakeUnitOfWork(),
         notifications=FakeNotifications(),
         publish=lambda *args: None,
+        projector=FakeProjector(),
+        availability=availability or FakeAvailability(),
     )
 
 
@@ -105,6 +65,8 @@ class TestAllocation:
             uow=FakeUnitOfWork(),
             notifications=fakeNotifications,
             publish=lambda *args: None,
+            projector=FakeProjector(),
+            availability=FakeAvailability(),
         )
         bus.handle(commands.CreateBatch("b1", "POPULAR-CURTAINS", 9, None))
         bus.handle(commands.Allocate("o1", "POPULAR-CURTAINS", 10))
@@ -122,6 +84,103 @@ class TestAllocation:
         assert batch.available_quantity == 100
 
 
+    def test_returns_allocation_with_group_commit(self):
+        bus = bootstrap.bootstarp(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=FakeNotifications(),
+            publish=lambda *args: None,
+            projector=FakeProjector(),
+            availability=FakeAvailability(),
+            group_commit_window=0,
+        )
+        bus.handle(commands.CreateBatch("batch1", "HOT-LAMP", 100, None))
+        [batch_ref] = bus.handle(commands.Allocate("o1", "HOT-LAMP", 10))
+        assert batch_ref == "batch1"
+
+
+class TestAllocateMany:
+    def test_returns_a_batch_ref_per_line(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "HEAVY-BENCH", 10, None))
+        bus.handle(commands.CreateBatch("b2", "LIGHT-STOOL", 10, None))
+        [batch_refs] = bus.handle(commands.AllocateMany([
+            commands.Allocate("o1", "HEAVY-BENCH", 5),
+            commands.Allocate("o1", "LIGHT-STOOL", 5),
+            commands.Allocate("o2", "HEAVY-BENCH", 5),
+            commands.Allocate("o3", "HEAVY-BENCH", 5),
+        ]))
+        assert batch_refs == ["b1", "b2", "b1", None]
+        assert bus.uow.committed
+
+    def test_error_for_invalid_sku(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "AREALSKU", 100, None))
+
+        with pytest.raises(handlers.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+            bus.handle(commands.AllocateMany([
+                commands.Allocate("o1", "AREALSKU", 10),
+                commands.Allocate("o1", "NONEXISTENTSKU", 10),
+            ]))
+        [batch] = bus.uow.products.get("AREALSKU").batches
+        assert batch.available_quantity == 100
+
+
+class TestAllocateOrder:
+    def test_allocates_every_line(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "ROUND-TABLE", 10, None))
+        bus.handle(commands.CreateBatch("b2", "SQUARE-CHAIR", 10, None))
+
+        [batch_refs] = bus.handle(commands.AllocateOrder("o1", [("ROUND-TABLE", 5), ("SQUARE-CHAIR", 5)]))
+
+        assert batch_refs == ["b1", "b2"]
+        assert bus.uow.committed
+
+    def test_allocates_nothing_if_any_line_is_out_of_stock(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "ROUND-TABLE", 10, None))
+        bus.handle(commands.CreateBatch("b2", "SQUARE-CHAIR", 1, None))
+
+        with pytest.raises(model.OutOfStock, match="Out of stock for SQUARE-CHAIR"):
+            bus.handle(commands.AllocateOrder("o1", [("ROUND-TABLE", 5), ("SQUARE-CHAIR", 5)]))
+
+        [batch] = bus.uow.products.get("ROUND-TABLE").batches
+        assert batch.available_quantity == 10
+
+    def test_a_failed_order_keeps_lines_allocated_before_it(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "ROUND-TABLE", 10, None))
+        bus.handle(commands.CreateBatch("b2", "SQUARE-CHAIR", 1, None))
+        bus.handle(commands.Allocate("o1", "ROUND-TABLE", 5))
+
+        with pytest.raises(model.OutOfStock, match="Out of stock for SQUARE-CHAIR"):
+            bus.handle(commands.AllocateOrder("o1", [("ROUND-TABLE", 5), ("SQUARE-CHAIR", 5)]))
+
+        [batch] = bus.uow.products.get("ROUND-TABLE").batches
+        assert batch.available_quantity == 5
+
+    def test_errors_for_an_order_without_lines(self):
+        bus = bootstrap_test_app()
+
+        with pytest.raises(handlers.InvalidOrder, match="Order o1 has no lines"):
+            bus.handle(commands.AllocateOrder("o1", []))
+
+        assert not bus.uow.committed
+
+    def test_errors_for_an_order_with_two_lines_for_one_sku(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "ROUND-TABLE", 10, None))
+        bus.uow.committed = False
+
+        with pytest.raises(handlers.InvalidOrder, match="more than one line for ROUND-TABLE"):
+            bus.handle(commands.AllocateOrder("o1", [("ROUND-TABLE", 5), ("ROUND-TABLE", 3)]))
+
+        [batch] = bus.uow.products.get("ROUND-TABLE").batches
+        assert batch.available_quantity == 10
+        assert not bus.uow.committed
+
+
 class TestChangeBatchQuantity:
     def test_changes_available_quantity(self):
         bus = bootstrap_test_app()
@@ -153,3 +212,17 @@ class TestChangeBatchQuantity:
         assert batch1.available_quantity == 5
         # and 20 will be reallocated to the next batch
         assert batch2.available_quantity == 30
+
+
+class TestAvailability:
+    def test_batch_changes_and_allocations_adjust_the_index(self):
+        availability = FakeAvailability()
+        bus = bootstrap_test_app(availability)
+        bus.handle(commands.CreateBatch("b1", "SOFT-SOFA", 100, None))
+        bus.handle(commands.Allocate("o1", "SOFT-SOFA", 30))
+        bus.handle(commands.Deallocate("b1", "o1", "SOFT-SOFA", 30))
+        bus.handle(commands.Allocate("o2", "SOFT-SOFA", 20))
+        bus.handle(commands.ChangeBatchQuantity("b1", 80))
+
+        assert availability.adjusted == [("SOFT-SOFA", None, 100), ("SOFT-SOFA", None, -20)]
+        assert availability.by_batch == {"b1": -20}
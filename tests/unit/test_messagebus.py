@@ -0,0 +1,130 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from allocation import bootstrap
+from allocation.domain import commands, events
+from allocation.service_layer import handlers, messagebus
+from tests.conftest import FakeUnitOfWork
+
+
+def make_bus(*event_handlers):
+    return messagebus.MessageBus(
+        uow=FakeUnitOfWork(),
+        event_handlers={events.OutOfStock: list(event_handlers)},
+        command_handlers={},
+    )
+
+
+def test_independent_handlers_run_concurrently():
+    both_running = threading.Barrier(2, timeout=5)
+
+    @handlers.independent
+    def first(event):
+        both_running.wait()
+
+    @handlers.independent
+    def second(event):
+        both_running.wait()
+
+    make_bus(first, second).handle(events.OutOfStock("SKU"))
+
+    assert not both_running.broken
+
+
+def test_independent_handler_failures_are_retried_and_isolated():
+    calls = []
+
+    @handlers.independent
+    def flaky(event):
+        calls.append("flaky")
+        if calls.count("flaky") == 1:
+            raise ValueError("first attempt fails")
+
+    @handlers.independent
+    def steady(event):
+        calls.append("steady")
+
+    make_bus(flaky, steady).handle(events.OutOfStock("SKU"))
+
+    assert calls.count("flaky") == 2
+    assert calls.count("steady") == 1
+
+
+def test_injected_handlers_keep_their_independent_marker():
+    injected = bootstrap.inject_dependencies(handlers.add_allocations_to_read_model, {"uow": None})
+    assert injected.independent
+
+
+def test_independent_handlers_get_a_unit_of_work_of_their_own():
+    bus = bootstrap.bootstarp(
+        start_orm=False,
+        uow=FakeUnitOfWork(),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        projector=mock.Mock(),
+        availability=mock.Mock(),
+    )
+
+    independent = [h for h in bus.event_handlers[events.Allocated] if getattr(h, "independent", False)]
+    assert [h.__name__ for h in independent] == ["add_allocations_to_read_model"]
+    assert getattr(independent[0], "uow") is not bus.uow
+
+
+class Conflict(Exception):
+    pass
+
+
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    conflict_attempts = 3
+
+    def is_conflict(self, error):
+        return isinstance(error, Conflict)
+
+
+def make_command_bus(handler):
+    return messagebus.MessageBus(
+        uow=ConflictingUnitOfWork(),
+        event_handlers={},
+        command_handlers={commands.Allocate: handler},
+    )
+
+
+def test_command_handlers_are_retried_on_write_conflicts():
+    calls = []
+
+    def conflicts_once(command):
+        calls.append(command)
+        if len(calls) == 1:
+            raise Conflict()
+        return "batch1"
+
+    results = make_command_bus(conflicts_once).handle(commands.Allocate("o1", "SKU", 10))
+
+    assert results == ["batch1"]
+    assert len(calls) == 2
+
+
+def test_command_handlers_give_up_after_the_last_conflict():
+    calls = []
+
+    def always_conflicts(command):
+        calls.append(command)
+        raise Conflict()
+
+    with pytest.raises(Conflict):
+        make_command_bus(always_conflicts).handle(commands.Allocate("o1", "SKU", 10))
+    assert len(calls) == 3
+
+
+def test_other_command_errors_are_not_retried():
+    calls = []
+
+    def fails(command):
+        calls.append(command)
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        make_command_bus(fails).handle(commands.Allocate("o1", "SKU", 10))
+    assert len(calls) == 1
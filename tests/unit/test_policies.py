@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from hypothesis import given, strategies as st
+
+from allocation.domain import policies
+from allocation.domain.model import Batch, OrderLine, OutOfStock, Product, allocate_order
+
+today = date.today()
+
+
+def make_product(quantities, policy=None):
+    batches = [
+        Batch(f"b{i}", "FLAT-RACK", qty, eta=today + timedelta(i))
+        for i, qty in enumerate(quantities)
+    ]
+    return Product("FLAT-RACK", batches=batches, policy=policy), batches
+
+
+def test_earliest_eta_takes_the_first_batch_that_fits():
+    assert policies.EarliestEta().choose(np.array([5, 20, 30]), 10) == 1
+
+
+def test_best_fit_takes_the_batch_with_the_smallest_leftover():
+    assert policies.BestFit().choose(np.array([50, 12, 30, 12]), 10) == 1
+
+
+def test_fewest_splits_takes_the_batch_with_the_most_stock():
+    assert policies.FewestSplits().choose(np.array([20, 50, 50]), 10) == 1
+
+
+def test_no_batch_fits():
+    for policy in policies.POLICIES.values():
+        assert policy().choose(np.array([1, 2]), 10) is None
+        assert policy().choose(np.array([], dtype=np.int64), 10) is None
+
+
+def test_product_allocates_with_its_policy():
+    product, batches = make_product([50, 12, 30], policies.BestFit())
+
+    assert product.allocate(OrderLine("o1", "FLAT-RACK", 10)) == "b1"
+    # b1 is down to 2, so the next best fit is b2
+    assert product.allocate(OrderLine("o2", "FLAT-RACK", 10)) == "b2"
+
+
+def test_policy_sees_deallocations_and_quantity_changes():
+    product, batches = make_product([10, 10], policies.FewestSplits())
+    product.allocate(OrderLine("o1", "FLAT-RACK", 5))
+    product.change_batch_quantity("b1", 4)
+    product.deallocate("b0", OrderLine("o1", "FLAT-RACK", 5))
+
+    assert product.allocate(OrderLine("o2", "FLAT-RACK", 8)) == "b0"
+
+
+def test_policy_sees_batches_changed_outside_the_product():
+    early = Batch("early", "FLAT-RACK", 10, eta=today)
+    late = Batch("late", "FLAT-RACK", 10, eta=date(2030, 1, 1))
+    product = Product("FLAT-RACK", batches=[early, late])
+    line = OrderLine("o1", "FLAT-RACK", 10)
+    product.allocate(line)
+
+    early.deallocate(line)
+
+    assert product.allocate(OrderLine("o2", "FLAT-RACK", 5)) == "early"
+
+
+def test_a_policy_must_score_batches():
+    class Unscored(policies.AllocationPolicy):
+        pass
+
+    with pytest.raises(TypeError):
+        Unscored()  # type: ignore[abstract]
+
+
+def test_failed_order_leaves_the_policy_with_the_original_quantities():
+    product, batches = make_product([10])
+    lines = [OrderLine("o1", "FLAT-RACK", 10), OrderLine("o1", "FLAT-RACK", 1)]
+
+    with pytest.raises(OutOfStock):
+        allocate_order("o1", lines, {"FLAT-RACK": product})
+
+    assert product.allocate(OrderLine("o2", "FLAT-RACK", 10)) == "b0"
+
+
+@given(
+    quantities=st.lists(st.integers(min_value=0, max_value=50), max_size=20),
+    lines=st.lists(st.integers(min_value=1, max_value=30), max_size=20),
+)
+def test_earliest_eta_matches_the_sorted_batches_generator(quantities, lines):
+    product, _ = make_product(quantities)
+    _, expected_batches = make_product(quantities)
+
+    for i, qty in enumerate(lines):
+        line = OrderLine(f"o{i}", "FLAT-RACK", qty)
+        expected = next((b for b in sorted(expected_batches) if b.can_allocate(line)), None)
+        if expected is not None:
+            expected.allocate(line)
+        assert product.allocate(line) == (expected.reference if expected else None)
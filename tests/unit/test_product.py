@@ -2,8 +2,8 @@ from datetime import datetime, timedelta
 
 import pytest as pytest
 
-from allocation.domain import events
-from allocation.domain.model import Batch, OrderLine, Product
+from allocation.domain import commands, events
+from allocation.domain.model import Batch, OrderLine, OutOfStock, Product, allocate_order
 
 today = datetime.now()
 tomorrow = today + timedelta(1)
@@ -77,3 +77,137 @@ def test_increments_version_number():
     product.allocate(line)
     assert product.version_number == 8
 
+
+def test_added_batches_are_allocated_in_eta_order():
+    product = Product(sku="GOTHIC-MIRROR", batches=[])
+    product.add_batch(Batch("later-batch", "GOTHIC-MIRROR", 100, eta=later))
+    product.add_batch(Batch("in-stock-batch", "GOTHIC-MIRROR", 100, eta=None))
+    product.add_batch(Batch("tomorrow-batch", "GOTHIC-MIRROR", 100, eta=tomorrow))
+
+    assert product.allocate(OrderLine("o1", "GOTHIC-MIRROR", 100)) == "in-stock-batch"
+    assert product.allocate(OrderLine("o2", "GOTHIC-MIRROR", 100)) == "tomorrow-batch"
+    assert product.allocate(OrderLine("o3", "GOTHIC-MIRROR", 100)) == "later-batch"
+
+
+def test_batches_appended_directly_are_still_indexed():
+    product = Product(sku="LAZY-OTTOMAN", batches=[Batch("b1", "LAZY-OTTOMAN", 10, eta=tomorrow)])
+    product.batches.append(Batch("b2", "LAZY-OTTOMAN", 10, eta=None))
+
+    assert product.allocate(OrderLine("o1", "LAZY-OTTOMAN", 5)) == "b2"
+
+
+def test_deallocate_by_batch_reference():
+    batch = Batch("b1", "SHINY-LADDER", 100, eta=None)
+    product = Product(sku="SHINY-LADDER", batches=[batch])
+    line = OrderLine("o1", "SHINY-LADDER", 10)
+    product.allocate(line)
+
+    product.deallocate("b1", line)
+
+    assert batch.available_quantity == 100
+
+
+def test_change_batch_quantity_evicts_the_fewest_lines():
+    batch = Batch("b1", "TALL-SHELF", 100, eta=None)
+    product = Product(sku="TALL-SHELF", batches=[batch])
+    for orderid, qty in [("o1", 10), ("o2", 10), ("o3", 50), ("o4", 20)]:
+        product.allocate(OrderLine(orderid, "TALL-SHELF", qty))
+
+    product.change_batch_quantity("b1", 50)
+
+    assert batch.available_quantity == 10
+    assert [e for e in product.events if isinstance(e, events.Deallocated)] == [
+        events.Deallocated("o3", "TALL-SHELF", 50, "b1")
+    ]
+
+
+def test_change_batch_quantity_reallocates_within_the_product():
+    batch1 = Batch("b1", "WIDE-TABLE", 50, eta=None)
+    batch2 = Batch("b2", "WIDE-TABLE", 50, eta=tomorrow)
+    product = Product(sku="WIDE-TABLE", batches=[batch1, batch2])
+    product.allocate(OrderLine("o1", "WIDE-TABLE", 20))
+    product.allocate(OrderLine("o2", "WIDE-TABLE", 20))
+    product.events.clear()
+
+    product.change_batch_quantity("b1", 25)
+
+    assert batch1.available_quantity == 5
+    assert batch2.available_quantity == 30
+    [changed, deallocated, allocated] = product.events
+    assert changed == events.BatchQuantityChanged("b1", "WIDE-TABLE", -25, None)
+    assert isinstance(deallocated, events.Deallocated)
+    assert allocated == events.Allocated(deallocated.orderid, "WIDE-TABLE", 20, "b2")
+
+
+def test_change_batch_quantity_sends_out_lines_that_fit_nowhere():
+    batch = Batch("b1", "NARROW-DESK", 20, eta=None)
+    product = Product(sku="NARROW-DESK", batches=[batch])
+    product.allocate(OrderLine("o1", "NARROW-DESK", 20))
+    product.events.clear()
+
+    product.change_batch_quantity("b1", 10)
+
+    assert product.events == [
+        events.BatchQuantityChanged("b1", "NARROW-DESK", -10, None),
+        events.Deallocated("o1", "NARROW-DESK", 20, "b1"),
+        commands.Allocate("o1", "NARROW-DESK", 20),
+    ]
+
+
+def test_change_batch_quantity_of_an_unknown_batch_changes_nothing():
+    product = Product(sku="NARROW-DESK", batches=[Batch("b1", "NARROW-DESK", 20, eta=None)])
+
+    with pytest.raises(KeyError):
+        product.change_batch_quantity("b2", 10)
+
+    assert product.version_number == 0
+    assert product.events == []
+
+
+def test_allocate_order_emits_one_event_for_every_line():
+    table = Product(sku="ROUND-TABLE", batches=[Batch("b1", "ROUND-TABLE", 10, eta=None)])
+    chair = Product(sku="SQUARE-CHAIR", batches=[Batch("b2", "SQUARE-CHAIR", 10, eta=None)])
+    lines = [OrderLine("o1", "ROUND-TABLE", 5), OrderLine("o1", "SQUARE-CHAIR", 5)]
+
+    allocate_order("o1", lines, {"ROUND-TABLE": table, "SQUARE-CHAIR": chair})
+
+    assert table.events + chair.events == [
+        events.OrderAllocated("o1", [
+            events.Allocated("o1", "ROUND-TABLE", 5, "b1"),
+            events.Allocated("o1", "SQUARE-CHAIR", 5, "b2"),
+        ])
+    ]
+
+
+def test_allocate_order_undoes_earlier_lines_when_one_is_out_of_stock():
+    table_batch = Batch("b1", "ROUND-TABLE", 10, eta=None)
+    table = Product(sku="ROUND-TABLE", batches=[table_batch])
+    chair = Product(sku="SQUARE-CHAIR", batches=[Batch("b2", "SQUARE-CHAIR", 1, eta=None)])
+    lines = [OrderLine("o1", "ROUND-TABLE", 5), OrderLine("o1", "SQUARE-CHAIR", 5)]
+
+    with pytest.raises(OutOfStock):
+        allocate_order("o1", lines, {"ROUND-TABLE": table, "SQUARE-CHAIR": chair})
+
+    assert table_batch.available_quantity == 10
+    assert table.events == [] and chair.events == []
+    assert table.version_number == 0
+
+
+def test_add_batch_emits_batch_created():
+    product = Product(sku="LOW-STOOL", batches=[])
+
+    product.add_batch(Batch("b1", "LOW-STOOL", 30, eta=tomorrow))
+
+    assert product.events == [events.BatchCreated("b1", "LOW-STOOL", 30, tomorrow)]
+
+
+def test_deallocate_emits_deallocated_only_for_allocated_lines():
+    batch = Batch("b1", "TALL-LAMP", 20, eta=None)
+    product = Product(sku="TALL-LAMP", batches=[batch])
+    product.allocate(OrderLine("o1", "TALL-LAMP", 5))
+    product.events.clear()
+
+    product.deallocate("b1", OrderLine("o2", "TALL-LAMP", 5))
+    product.deallocate("b1", OrderLine("o1", "TALL-LAMP", 5))
+
+    assert product.events == [events.Deallocated("o1", "TALL-LAMP", 5, "b1")]
@@ -0,0 +1,34 @@
+import json
+
+from allocation.domain import commands
+from allocation.entrypoints import redis_eventconsumer
+
+
+class RecordingBus:
+    def __init__(self):
+        self.handled = []
+
+    def handle(self, cmd):
+        self.handled.append(cmd)
+
+
+def pubsub_message(batchref, qty):
+    return {"data": json.dumps({"batchref": batchref, "qty": qty})}
+
+
+def test_only_the_latest_quantity_per_batch_is_handled():
+    bus = RecordingBus()
+    messages = [
+        pubsub_message("b1", 30),
+        pubsub_message("b2", 5),
+        pubsub_message("b1", 20),
+        pubsub_message("b1", 10),
+    ]
+
+    skipped = redis_eventconsumer.handle_change_batch_quantities(messages, bus)
+
+    assert bus.handled == [
+        commands.ChangeBatchQuantity("b2", 5),
+        commands.ChangeBatchQuantity("b1", 10),
+    ]
+    assert skipped == 2
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).parents[2] / "src"
+
+NO_NETWORK = """
+import socket
+
+def refuse(*args, **kwargs):
+    raise AssertionError(f"network I/O at import time: {args}")
+
+socket.socket.connect = refuse
+socket.create_connection = refuse
+"""
+
+
+@pytest.mark.parametrize("module", [
+    "allocation.bootstrap",
+    "allocation.entrypoints.flask_app",
+    "allocation.entrypoints.asgi_app",
+    "allocation.entrypoints.redis_eventconsumer",
+])
+def test_importing_does_no_network_io(module):
+    result = subprocess.run(
+        [sys.executable, "-c", f"{NO_NETWORK}\nimport {module}"],
+        env={**os.environ, "PYTHONPATH": str(SRC)},
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ""
+
+
+def test_email_notifications_connect_on_first_send(monkeypatch):
+    from allocation.adapters import notifications
+
+    connections = []
+
+    def connect(*args, **kwargs):
+        connections.append(args)
+        return object()
+
+    monkeypatch.setattr(notifications.smtplib, "SMTP", connect)
+
+    email = notifications.EmailNotifications()
+    assert connections == []
+
+    email.server
+    email.server
+    assert len(connections) == 1
@@ -0,0 +1,75 @@
+from typing import List
+
+from allocation.adapters.view_cache import ViewCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def loader(*values):
+    calls = []  # type: List[None]
+
+    def load():
+        calls.append(None)
+        return values[min(len(calls), len(values)) - 1]
+
+    return load, calls
+
+
+def test_results_are_loaded_once_until_they_expire():
+    clock = FakeClock()
+    cache = ViewCache(ttl=5, clock=clock)
+    load, calls = loader([{"sku": "sku1", "batchref": "b1"}])
+
+    first = cache.get_or_load("o1", load)
+    clock.now = 4
+    second = cache.get_or_load("o1", load)
+    clock.now = 10
+    cache.get_or_load("o1", load)
+
+    assert second is first
+    assert len(calls) == 2
+
+
+def test_invalidating_a_key_reloads_it():
+    cache = ViewCache()
+    load, calls = loader([], [{"sku": "sku1", "batchref": "b1"}])
+    before = cache.get_or_load("o1", load)
+
+    cache.invalidate("o1")
+    after = cache.get_or_load("o1", load)
+
+    assert after.value == [{"sku": "sku1", "batchref": "b1"}]
+    assert after.etag != before.etag
+
+
+def test_etag_depends_only_on_the_content():
+    load, _ = loader([{"sku": "sku1", "batchref": "b1"}])
+
+    assert ViewCache().get_or_load("o1", load).etag == ViewCache().get_or_load("o1", load).etag
+
+
+def test_a_load_that_raced_an_invalidation_is_not_cached():
+    cache = ViewCache()
+
+    def stale_load():
+        cache.invalidate("o1")
+        return []
+
+    cache.get_or_load("o1", stale_load)
+
+    assert cache.get("o1") is None
+
+
+def test_cache_is_bounded():
+    cache = ViewCache(max_size=2)
+    for key in ("o1", "o2", "o3"):
+        cache.get_or_load(key, lambda: [])
+
+    assert cache.get("o1") is None
+    assert cache.get("o3") is not None